@@ -0,0 +1,76 @@
+"""
+Compares the previous stage decode path (json.loads then pd.DataFrame) with the
+columnar decoder, with and without the orjson accelerator.
+
+Usage, from the repository root: python -m benchmarks.bench_json_decode [rows]
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import columnar_json
+
+
+def make_payload(rows):
+    random = np.random.RandomState(1)
+    data = pd.DataFrame({
+        "Q601_asphalting_sand": random.randint(0, 50000, rows),
+        "Q606_other_gravel": random.randint(0, 50000, rows),
+        "Q608_total": random.randint(0, 100000, rows),
+        "Q608_total_largest_contributor": random.randint(0, 2000000, rows),
+        "Q608_total_second_largest_contributor": random.randint(0, 1000000, rows),
+        "cell_total_Q608_total": random.randint(0, 3000000, rows),
+        "county": random.randint(1, 50, rows),
+        "county_name": random.choice(["Tomato", "Grapefruit", "Lemon"], rows),
+        "ent_ref_count": random.randint(0, 20, rows),
+        "enterprise_reference": random.randint(10 ** 9, 10 ** 10, rows),
+        "gor_code": random.choice(["FE", "DC", "AB"], rows),
+        "marine": random.choice(["y", "n"], rows),
+        "period": 201809,
+        "region": random.randint(1, 12, rows),
+        "responder_id": np.arange(20000000001, 20000000001 + rows),
+        "response_type": random.randint(1, 3, rows),
+        "strata": random.choice(["A", "B", "E"], rows),
+    })
+    return data.to_json(orient="records")
+
+
+def measure(name, decode, payload):
+    start = time.perf_counter()
+    decoded = decode(payload)
+    elapsed = time.perf_counter() - start
+    del decoded
+
+    # Timed separately as tracing allocations slows the decode down.
+    tracemalloc.start()
+    decoded = decode(payload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("{:<28} {:>8.3f}s {:>10.1f} MiB peak ({} rows)".format(
+        name, elapsed, peak / 2 ** 20, len(decoded)))
+    return decoded
+
+
+def main(rows):
+    payload = make_payload(rows)
+    print("Payload size: {:.1f} MiB".format(len(payload) / 2 ** 20))
+
+    expected = measure("json.loads + DataFrame",
+                       lambda data: pd.DataFrame(json.loads(data)), payload)
+    columnar = measure("columnar (stdlib json)",
+                       lambda data: columnar_json.decode_records(data, False), payload)
+    pd.testing.assert_frame_equal(columnar, expected)
+
+    if columnar_json.orjson is not None:
+        accelerated = measure("columnar (orjson)", columnar_json.decode_records, payload)
+        pd.testing.assert_frame_equal(accelerated, expected)
+    else:
+        print("orjson is not installed, skipping the accelerated path.")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
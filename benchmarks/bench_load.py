@@ -0,0 +1,268 @@
+"""
+Runs many wrangler runs at once, as on results day, against moto S3, SNS and SQS and a
+stand-in for the lambda client which runs the stage lambdas' handlers in process.
+Reports the runs' latency percentiles and throughput, the payload sizes and the most
+stage invocations in flight at once, and the process's peak memory.
+
+Usage, from the repository root:
+    python -m benchmarks.bench_load --runs 32 --concurrency 8 --rows 2000 20000
+"""
+import argparse
+import io
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import numpy as np
+import pandas as pd
+from moto import mock_s3, mock_sns, mock_sqs
+
+import disclosure_wrangler
+import stage_chain
+import stage_registry
+import stage_warmup
+
+BUCKET_NAME = "load-test"
+METHOD_NAME = "es-disclosure-stage--method"
+
+RUNTIME_VARIABLES = {
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "environment": "sandbox",
+    "explanation": "reason",
+    "grouping_columns": ["region", "strata"],
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "stage5_threshold": "0.1",
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total"],
+    "total_steps": 6,
+    "unique_identifier": ["responder_id"]
+}
+
+
+class ThrottlingError(Exception):
+    """Raised, like the lambda service's TooManyRequestsException, when the stand-in
+    is invoked with its concurrency limit already reached."""
+
+
+class LoadTestInvoker(stage_chain.LocalInvoker):
+    """
+    A LocalInvoker for the stage lambdas which is safe to share between runs, and
+    records the payload sizes and the most invocations in flight at once.
+    """
+
+    def __init__(self, method_name=METHOD_NAME, concurrency_limit=None):
+        super().__init__({
+            stage_registry.lambda_name(method_name, stage): spec.module.lambda_handler
+            for stage, spec in stage_registry.STAGES.items()})
+        self.concurrency_limit = concurrency_limit
+        self.request_bytes = []
+        self.response_bytes = []
+        self.warmups = 0
+        self.throttles = 0
+        self.peak_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, FunctionName, Payload, InvocationType="RequestResponse"):
+        with self._lock:
+            if self.concurrency_limit and self._in_flight >= self.concurrency_limit:
+                self.throttles += 1
+                raise ThrottlingError(f"Rate exceeded invoking {FunctionName}")
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+        try:
+            response = super().invoke(FunctionName, Payload, InvocationType)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        if stage_warmup.WARMUP in json.loads(Payload):
+            with self._lock:
+                self.warmups += 1
+            return response
+        reply = response["Payload"].read()
+        with self._lock:
+            self.request_bytes.append(len(Payload))
+            self.response_bytes.append(len(reply))
+
+        return dict(response, Payload=io.BytesIO(reply))
+
+
+def make_dataset(rows, seed):
+    """
+    A synthetic wrangler input with about 10 contributors a cell.
+    :param rows: The number of rows - Type: Int
+    :param seed: The random seed - Type: Int
+    :return: The input - Type: DataFrame
+    """
+    random = np.random.RandomState(seed)
+    cells = max(1, rows // 10)
+    cell = random.randint(0, cells, rows)
+    totals = random.randint(0, 100000, rows) * (random.rand(rows) > 0.1)
+    data = pd.DataFrame({
+        "responder_id": np.arange(rows) + 10 ** 10,
+        "region": cell % 12,
+        "strata": (cell // 12).astype(str),
+        "ent_ref_count": random.randint(0, 20, rows),
+        "Q608_total": totals,
+    })
+    grouped = data.groupby(["region", "strata"])["Q608_total"]
+    data["cell_total_Q608_total"] = grouped.transform("sum")
+    data["Q608_total_largest_contributor"] = grouped.transform("max")
+    data["Q608_total_second_largest_contributor"] = grouped.transform(
+        lambda totals: totals.nlargest(2).iloc[-1] if len(totals) > 1 else 0)
+
+    return data
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values, dtype=float)
+    summary = {f"p{percentile}": round(float(np.percentile(values, percentile)), 3)
+               for percentile in (50, 90, 95, 99)}
+    summary["max"] = round(float(values.max()), 3)
+
+    return summary
+
+
+def run_load(runs, concurrency, rows, execution_mode="inline", data_compression=None,
+             concurrency_limit=None):
+    """
+    Runs the wrangler runs side by side against moto and the stand-in lambda client.
+    :param runs: The number of runs - Type: Int
+    :param concurrency: The most runs at once - Type: Int
+    :param rows: The rows of each run's input - Type: Int
+    :param execution_mode: The runs' execution_mode - Type: String
+    :param data_compression: The runs' data_compression - Type: String
+    :param concurrency_limit: The most stage invocations the stand-in takes at once,
+                              or None for no limit - Type: Int
+    :return: The report - Type: Dict
+    """
+    with mock_s3(), mock_sns(), mock_sqs():
+        s3_client = boto3.client("s3", region_name="eu-west-2")
+        s3_client.create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+        topic_arn = boto3.client("sns", region_name="eu-west-2").create_topic(
+            Name="load-test")["TopicArn"]
+        queue_url = boto3.client("sqs", region_name="eu-west-2").create_queue(
+            QueueName="load-test")["QueueUrl"]
+
+        events = []
+        for run in range(runs):
+            s3_client.put_object(
+                Bucket=BUCKET_NAME, Key=f"input_{run}.json",
+                Body=make_dataset(rows, run).to_json(orient="records").encode("UTF-8"))
+            runtime_variables = dict(
+                RUNTIME_VARIABLES, bpm_queue_url=queue_url, sns_topic_arn=topic_arn,
+                run_id=f"load-test-{run}", execution_mode=execution_mode,
+                in_file_name=f"input_{run}.json", out_file_name=f"output_{run}.json",
+                final_output_location=f"output_{run}.csv")
+            if data_compression:
+                runtime_variables["data_compression"] = data_compression
+            events.append({"RuntimeVariables": runtime_variables})
+
+        invoker = LoadTestInvoker(concurrency_limit=concurrency_limit)
+        environment_variables = {"bucket_name": BUCKET_NAME, "method_name": METHOD_NAME}
+        runtime_schema = disclosure_wrangler.RuntimeSchema()
+
+        def timed_run(event):
+            start = time.perf_counter()
+            try:
+                disclosure_wrangler.run_disclosure(
+                    event, None, environment_variables, runtime_schema, invoker)
+                error = None
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            return error, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed_run, events))
+        seconds = time.perf_counter() - start
+
+    latencies = [latency for error, latency in results if error is None]
+    errors = sorted({error for error, _ in results if error is not None})
+    return {
+        "runs": runs,
+        "concurrency": concurrency,
+        "rows": rows,
+        "execution_mode": execution_mode,
+        "failures": len(results) - len(latencies),
+        "errors": errors[:5],
+        "seconds": round(seconds, 3),
+        "runs_per_second": round(runs / seconds, 3),
+        "rows_per_second": round(runs * rows / seconds, 1),
+        "latency_seconds": percentiles(latencies),
+        "stage_invocations": len(invoker.request_bytes),
+        "warmup_pings": invoker.warmups,
+        "throttles": invoker.throttles,
+        "peak_in_flight": invoker.peak_in_flight,
+        "request_bytes": percentiles(invoker.request_bytes),
+        "response_bytes": percentiles(invoker.response_bytes),
+        # ru_maxrss is in KiB on Linux.
+        "peak_rss_mib": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run many disclosure wrangler runs at once against moto and a "
+                    "stand-in lambda client.")
+    parser.add_argument("--runs", type=int, default=16,
+                        help="Number of wrangler runs for each dataset size.")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Number of runs at once.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[2000],
+                        help="Rows in each run's input; one load test for each.")
+    parser.add_argument("--execution-mode", default="inline",
+                        help="The runs' execution_mode, e.g. inline, s3 or chunked.")
+    parser.add_argument("--data-compression",
+                        help="The runs' data_compression codec, e.g. zlib.")
+    parser.add_argument("--concurrency-limit", type=int,
+                        help="Throttle stage invocations beyond this many at once, "
+                             "like the lambda concurrency limit.")
+    parser.add_argument("--json", action="store_true",
+                        help="Print each report as JSON.")
+    arguments = parser.parse_args(argv)
+    logging.disable(logging.ERROR)
+
+    for rows in arguments.rows:
+        report = run_load(arguments.runs, arguments.concurrency, rows,
+                          arguments.execution_mode, arguments.data_compression,
+                          arguments.concurrency_limit)
+        if arguments.json:
+            print(json.dumps(report))
+            continue
+        latency = report["latency_seconds"]
+        print(f"{rows:>8} rows x {report['runs']} runs, {report['concurrency']} at once:"
+              f" {report['failures']} failed in {report['seconds']:.2f}s,"
+              f" {report['runs_per_second']:.2f} runs/s,"
+              f" {report['rows_per_second']:,.0f} rows/s")
+        for error in report["errors"]:
+            print(f"{'':>8} error: {error}")
+        print(f"{'':>8} latency p50 {latency.get('p50', 0):.3f}s"
+              f" p95 {latency.get('p95', 0):.3f}s p99 {latency.get('p99', 0):.3f}s"
+              f" max {latency.get('max', 0):.3f}s")
+        print(f"{'':>8} {report['stage_invocations']} stage invocations, at most"
+              f" {report['peak_in_flight']} at once, {report['throttles']} throttled;"
+              f" payloads p50 {report['request_bytes'].get('p50', 0):,.0f}"
+              f" max {report['request_bytes'].get('max', 0):,.0f} bytes;"
+              f" peak RSS {report['peak_rss_mib']} MiB")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+"""
+Times the stage 4 complementary suppression on synthetic region by strata by county
+tables, to show the time taken grows close to linearly with the number of cells.
+
+Usage, from the repository root: python -m benchmarks.bench_stage4 [cells ...]
+"""
+import logging
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import stage4_method
+
+
+def make_table(cells, disclosive_ratio=0.05):
+    random = np.random.RandomState(1)
+    regions = 12
+    stratas = 40
+    counties = max(1, cells // (regions * stratas))
+    cell = np.arange(regions * stratas * counties)
+    data = pd.DataFrame({
+        "responder_id": cell,
+        "region": cell % regions,
+        "strata": (cell // regions) % stratas,
+        "county": cell // (regions * stratas),
+        "cell_total_Q608_total": random.randint(0, 100000, len(cell)),
+    })
+    data["disclosive_Q608_total"] = np.where(
+        random.rand(len(cell)) < disclosive_ratio, "Yes", "No")
+    data["reason_Q608_total"] = "Passed Stage 5"
+    return data
+
+
+def run(cells):
+    data = make_table(cells)
+    start = time.perf_counter()
+    output = stage4_method.disclose_total_columns(
+        data, "disclosive", "publish", "reason", ["Q608_total"], "cell_total",
+        ["region", "strata", "county"], logging.getLogger(__name__))
+    seconds = time.perf_counter() - start
+
+    primary = int((data["disclosive_Q608_total"] == "Yes").sum())
+    complementary = int((output["disclosive_Q608_total"] == "Yes").sum()) - primary
+    print(f"{len(data):>9} cells {seconds:8.3f}s {len(data) / seconds:>12,.0f} cells/s"
+          f" {primary:>8} primary {complementary:>8} complementary")
+
+
+def main(argv=None):
+    sizes = [int(size) for size in (argv or [])] or [10000, 100000, 1000000]
+    for cells in sizes:
+        run(cells)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,114 @@
+import json
+
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class _NestedRecordError(ValueError):
+    """Raised when a record holds nested values that have no single column type."""
+
+
+class _RowMarker:
+    """Stands in for a decoded record so nested objects can be detected."""
+
+
+_ROW = _RowMarker()
+
+
+class _ColumnBuilder:
+    """
+    Collects the values of record-oriented JSON straight into per-column lists,
+    so that no dict is kept alive for each row.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.row_count = 0
+
+    def add_row(self, pairs):
+        row_number = self.row_count
+        columns = self.columns
+        for key, value in pairs:
+            if value is _ROW or isinstance(value, (dict, list)):
+                raise _NestedRecordError(key)
+            column = columns.get(key)
+            if column is None:
+                column = [None] * row_number
+                columns[key] = column
+            elif len(column) != row_number:
+                column.extend([None] * (row_number - len(column)))
+            column.append(value)
+        self.row_count = row_number + 1
+        return _ROW
+
+    def to_dataframe(self):
+        columns = self.columns
+        for column in columns.values():
+            if len(column) != self.row_count:
+                column.extend([None] * (self.row_count - len(column)))
+
+        # Convert one column at a time, releasing each list as soon as its
+        # typed array exists, to keep the peak memory close to the output size.
+        typed_columns = {}
+        for key in list(columns):
+            typed_columns[key] = pd.Series(columns.pop(key))
+        return pd.DataFrame(typed_columns, index=pd.RangeIndex(self.row_count))
+
+
+def decode_records(data, accelerate=True):
+    """
+    Decodes record-oriented JSON (as produced by to_json(orient="records")) into a
+    dataframe, producing the same columns and dtypes as pd.DataFrame(json.loads(data)).
+    :param data: Record-oriented JSON - Type: String/Bytes/Memoryview
+    :param accelerate: Use orjson when it is installed - Type: Boolean
+    :return: Decoded data - Type: DataFrame
+    """
+    if accelerate and orjson is not None:
+        try:
+            decoded = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN or integers over 64 bits, which only the json module reads.
+            pass
+        else:
+            return _decoded_to_dataframe(decoded)
+
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    builder = _ColumnBuilder()
+    try:
+        decoded = json.loads(data, object_pairs_hook=builder.add_row)
+    except _NestedRecordError:
+        # Not flat records, so fall back to letting pandas work out the layout.
+        return pd.DataFrame(json.loads(data))
+
+    if not isinstance(decoded, list):
+        raise ValueError("Expected a JSON array of records.")
+    if not decoded or len(decoded) != builder.row_count:
+        # Empty, or holding non-object elements, which pandas lays out differently.
+        return pd.DataFrame(json.loads(data))
+
+    return builder.to_dataframe()
+
+
+def _decoded_to_dataframe(decoded):
+    """
+    Puts decoded records through the same column builder as the json module's hook,
+    so orjson gives the same dtypes.
+    """
+    if not isinstance(decoded, list):
+        raise ValueError("Expected a JSON array of records.")
+    if not decoded or not all(isinstance(record, dict) for record in decoded):
+        return pd.DataFrame(decoded)
+
+    builder = _ColumnBuilder()
+    try:
+        for record in decoded:
+            builder.add_row(record.items())
+    except _NestedRecordError:
+        return pd.DataFrame(decoded)
+
+    return builder.to_dataframe()
@@ -0,0 +1,105 @@
+import collections
+
+import numpy as np
+
+import group_numbers
+
+# The largest contributors to each cell, for each total column.
+# cell_of_row: The cell each row belongs to - Type: Numpy Array
+# top: The k largest contributions to each cell, largest first, with 0 where a cell
+#      has fewer than k contributors - Type: Numpy Array (cells, total columns, k)
+# totals: The sum of the contributions to each cell - Type: Numpy Array (cells, total
+#         columns)
+TopContributors = collections.namedtuple("TopContributors",
+                                         ["cell_of_row", "top", "totals"])
+
+
+def top_contributors(input_df, grouping_columns, total_columns, k=2):
+    """
+    Finds the k largest contributors to every cell for every total column in a single
+    sort. The rows are treated as the contributors, and the (row, total column) values
+    are sorted together by cell, total column and descending value, so each group's
+    largest values are its first k entries.
+    Missing values contribute nothing.
+    :param input_df: Responder level data, one row per contributor - Type: DataFrame
+    :param grouping_columns: The columns which identify a cell - Type: List
+    :param total_columns: The columns holding the contributions - Type: List
+    :param k: The number of contributors to keep for each cell - Type: Int
+    :return: The top contributors - Type: TopContributors
+    """
+    cell_of_row = group_numbers.number_groups(input_df, grouping_columns)
+    cell_count = int(cell_of_row.max()) + 1 if len(cell_of_row) else 0
+    column_count = len(total_columns)
+
+    values = np.nan_to_num(input_df[total_columns].to_numpy(dtype=float)).ravel()
+    groups = (np.repeat(cell_of_row, column_count) * column_count
+              + np.tile(np.arange(column_count), len(cell_of_row)))
+
+    top = _top_of_groups(groups, values, cell_count * column_count, k)
+    totals = np.bincount(groups, weights=values, minlength=cell_count * column_count)
+
+    return TopContributors(cell_of_row,
+                           top.reshape(cell_count, column_count, k),
+                           totals.reshape(cell_count, column_count))
+
+
+def merge_top(cell_of_part, top, cell_count):
+    """
+    Finds the k largest contributors to cells made up of parts, e.g. regions made up
+    of the cells of a finer table, from the k largest contributors to each part. Every
+    contributor belongs to one part, so a cell's largest are among its parts' largest
+    and the data is not looked at again.
+    :param cell_of_part: The cell each part belongs to - Type: Numpy Array
+    :param top: The parts' top contributors, as TopContributors.top
+                - Type: Numpy Array (parts, total columns, k)
+    :param cell_count: The number of cells - Type: Int
+    :return: The cells' top contributors - Type: Numpy Array (cells, total columns, k)
+    """
+    part_count, column_count, k = top.shape
+    groups = (np.repeat(cell_of_part, column_count * k) * column_count
+              + np.tile(np.repeat(np.arange(column_count), k), part_count))
+
+    return _top_of_groups(groups, top.ravel(), cell_count * column_count, k)\
+        .reshape(cell_count, column_count, k)
+
+
+def _top_of_groups(groups, values, group_count, k):
+    """
+    Sorts the values by group and descending value, so each group's largest values are
+    its first k entries.
+    :return: The k largest values of each group, largest first, with 0 where a group
+             has fewer than k - Type: Numpy Array (group_count * k)
+    """
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.diff(sorted_groups, prepend=-1))
+    ranks = np.arange(len(order)) - np.repeat(starts, np.diff(starts, append=len(order)))
+    keep = ranks < k
+
+    top = np.zeros(group_count * k)
+    top[sorted_groups[keep] * k + ranks[keep]] = values[order][keep]
+
+    return top
+
+
+def contributor_columns(input_df, grouping_columns, total_columns, contributor_names):
+    """
+    Builds the largest contributor columns stage 5 reads, e.g.
+    Q608_total_largest_contributor, from the responder level rows.
+    :param input_df: Responder level data, one row per contributor - Type: DataFrame
+    :param grouping_columns: The columns which identify a cell - Type: List
+    :param total_columns: The columns holding the contributions - Type: List
+    :param contributor_names: The name of each rank, largest first, e.g.
+                              ["largest_contributor", "second_largest_contributor"]
+                              - Type: List
+    :return: {total_column + "_" + name: values for each row} - Type: Dict
+    """
+    contributors = top_contributors(input_df, grouping_columns, total_columns,
+                                    len(contributor_names))
+    columns = {}
+    for column_index, total_column in enumerate(total_columns):
+        for rank, name in enumerate(contributor_names):
+            columns[total_column + "_" + name] = \
+                contributors.top[contributors.cell_of_row, column_index, rank]
+
+    return columns
@@ -0,0 +1,204 @@
+"""
+Re-runs disclosure for many historical periods in process, on a process pool.
+
+Usage, from the repository root:
+    python disclosure_backfill.py --periods 201803 201806 201809 \
+        --in-file-name "disclosure_input_{period}.json" --bucket my-bucket \
+        --output-bucket my-bucket --runtime-variables runtime.json --concurrency 4
+or, for local files:
+    python disclosure_backfill.py --inputs data/*.json --output-dir output \
+        --runtime-variables runtime.json
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from es_aws_functions import aws_functions
+
+import disclosure_cli
+import disclosure_layout
+import disclosure_pipeline
+import dtype_plan
+
+
+def period_key(file_name, period):
+    """
+    Builds the per period key for an output, following out_file_name and
+    final_output_location. A "{period}" placeholder in the name is filled in,
+    otherwise the output is put under a prefix named after the period.
+    :param file_name: out_file_name or final_output_location - Type: String
+    :param period: The period being disclosed - Type: String
+    :return: The key for this period's output - Type: String
+    """
+    if "{period}" in file_name:
+        return file_name.format(period=period)
+    return period + "/" + file_name
+
+
+def build_jobs(runtime_variables, inputs=None, periods=None, bucket=None):
+    """
+    Lists the periods to backfill, either from input files or from periods and the
+    in_file_name template.
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param inputs: Local input files, named after their period - Type: List
+    :param periods: Periods to read from S3 with in_file_name - Type: List
+    :param bucket: The bucket to read periods from - Type: String
+    :return: jobs: [{"period", "input_file", "bucket"}] - Type: List
+    """
+    if inputs:
+        return [{"period": os.path.splitext(os.path.basename(input_file))[0],
+                 "input_file": input_file, "bucket": None} for input_file in inputs]
+
+    return [{"period": str(period),
+             "input_file": period_key(runtime_variables["in_file_name"], str(period)),
+             "bucket": bucket} for period in periods]
+
+
+def backfill_period(job, runtime_variables, output_dir=None, output_bucket=None):
+    """
+    Discloses a single period and writes its outputs. Errors are returned rather than
+    raised, so one bad period does not stop the rest of the backfill.
+    :param job: One of the jobs from build_jobs - Type: Dict
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param output_dir: Local directory to write the outputs to - Type: String
+    :param output_bucket: Bucket to write the outputs to - Type: String
+    :return: result: {"period", "success", "rows", "seconds", "error"} - Type: Dict
+    """
+    start = time.perf_counter()
+    result = {"period": job["period"], "success": False, "rows": 0, "error": None}
+    try:
+        if job["bucket"]:
+            data = aws_functions.read_dataframe_from_s3(job["bucket"], job["input_file"])
+        else:
+            data = disclosure_cli.read_input(job["input_file"])
+        data, _, _ = dtype_plan.apply_dtype_plan(
+            data, dtype_plan.build_dtype_plan(runtime_variables))
+
+        data, _ = disclosure_pipeline.run_stages(
+            data, runtime_variables, runtime_variables["disclosure_stages"])
+        data = disclosure_layout.apply_layout(data, runtime_variables)
+
+        out_file_name = period_key(runtime_variables["out_file_name"], job["period"])
+        final_output_location = period_key(runtime_variables["final_output_location"],
+                                           job["period"])
+        if output_bucket:
+            aws_functions.save_to_s3(output_bucket, out_file_name,
+                                     data.to_json(orient="records"))
+            aws_functions.save_dataframe_to_csv(data, output_bucket,
+                                                final_output_location)
+        else:
+            for key in (out_file_name, final_output_location):
+                path = os.path.join(output_dir, key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                disclosure_cli.write_output(data, path)
+
+        result["rows"] = len(data)
+        result["success"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_backfill(jobs, runtime_variables, concurrency=2, output_dir=None,
+                 output_bucket=None, logger=None):
+    """
+    Runs every job on a process pool, reporting progress as each period completes.
+    :param jobs: The jobs from build_jobs - Type: List
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param concurrency: The most periods to disclose at once - Type: Int
+    :param output_dir: Local directory to write the outputs to - Type: String
+    :param output_bucket: Bucket to write the outputs to - Type: String
+    :param logger: The logger to report progress to.
+    :return: results: One result per job, in the order of jobs - Type: List
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    start = time.perf_counter()
+    results = {}
+    total_rows = 0
+    failures = 0
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(backfill_period, job, runtime_variables,
+                                   output_dir, output_bucket): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died, e.g. it ran out of memory.
+                result = {"period": job["period"], "success": False, "rows": 0,
+                          "seconds": 0, "error": f"{type(e).__name__}: {e}"}
+            results[job["period"]] = result
+
+            total_rows += result["rows"]
+            if result["success"]:
+                logger.info(f"Period {result['period']} disclosed {result['rows']} rows"
+                            f" in {result['seconds']:.2f}s")
+            else:
+                failures += 1
+                logger.error(f"Period {result['period']} failed: {result['error']}")
+
+            elapsed = time.perf_counter() - start
+            logger.info(f"Completed {len(results)}/{len(jobs)} periods"
+                        f" ({failures} failed) - {total_rows / elapsed:.0f} rows/s,"
+                        f" {len(results) / elapsed * 60:.1f} periods/min")
+
+    return [results[job["period"]] for job in jobs]
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    logger = logging.getLogger("disclosure_backfill")
+
+    parser = argparse.ArgumentParser(
+        description="Re-run disclosure in process for many periods at once.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--inputs", nargs="+",
+                        help="Local input files, each named after its period.")
+    source.add_argument("--periods", nargs="+",
+                        help="Periods to read from --bucket using in_file_name.")
+    parser.add_argument("--bucket", default=os.environ.get("bucket_name"),
+                        help="The bucket to read periods from.")
+    destination = parser.add_mutually_exclusive_group(required=True)
+    destination.add_argument("--output-dir", help="Directory to write outputs to.")
+    destination.add_argument("--output-bucket", help="Bucket to write outputs to.")
+    parser.add_argument("--in-file-name", help="Input key, may contain {period}.")
+    parser.add_argument("--out-file-name", help="Output key, may contain {period}.")
+    parser.add_argument("--final-output-location",
+                        help="CSV output key, may contain {period}.")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count(),
+                        help="The most periods to disclose at once.")
+    disclosure_cli.add_runtime_arguments(parser)
+    arguments = parser.parse_args(argv)
+
+    required = ["out_file_name", "final_output_location"]
+    if arguments.periods:
+        required.append("in_file_name")
+        if not arguments.bucket:
+            parser.error("--bucket is required with --periods")
+    runtime_variables = disclosure_cli.build_runtime_variables(arguments)
+    for parameter in ("in_file_name", "out_file_name", "final_output_location"):
+        if getattr(arguments, parameter) is not None:
+            runtime_variables[parameter] = getattr(arguments, parameter)
+    missing = [parameter for parameter in required
+               if parameter not in runtime_variables]
+    if missing:
+        parser.error(f"Missing runtime variables: {', '.join(missing)}")
+
+    jobs = build_jobs(runtime_variables, arguments.inputs, arguments.periods,
+                      arguments.bucket)
+    results = run_backfill(jobs, runtime_variables, arguments.concurrency,
+                           arguments.output_dir, arguments.output_bucket, logger)
+
+    return 0 if all(result["success"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Runs disclosure locally, in process, on a JSON, CSV or Parquet file.
+
+Usage, from the repository root:
+    python disclosure_cli.py input.json output.json --stages "1 2 5" \
+        --runtime-variables runtime.json --workers 4 --timings
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import sys
+import time
+
+import pandas as pd
+
+import columnar_json
+import disclosure_layout
+import disclosure_pipeline
+import dtype_plan
+import geography_levels
+
+# The runtime variables which can be given on the command line, as they are named in
+# the wrangler's RuntimeSchema.
+STRING_PARAMETERS = ["cell_total_column", "disclosivity_marker", "dominance_k",
+                     "dominance_n", "explanation", "output_layout", "parent_column",
+                     "parent_reference_column", "publishable_indicator",
+                     "stage5_threshold", "survey", "threshold", "top1_column",
+                     "top2_column"]
+LIST_PARAMETERS = ["grouping_columns", "total_columns", "unique_identifier"]
+REQUIRED_PARAMETERS = ["disclosivity_marker", "explanation", "publishable_indicator",
+                       "total_columns", "unique_identifier"]
+
+
+def add_runtime_arguments(parser):
+    """
+    Adds the options which set the wrangler runtime variables to a parser.
+    :param parser: The parser to add the options to - Type: ArgumentParser
+    """
+    parser.add_argument("--stages", dest="disclosure_stages",
+                        help="The disclosure stages to run e.g. \"1 2 5\".")
+    parser.add_argument("--runtime-variables",
+                        help="JSON file of wrangler runtime variables, either bare or "
+                             "under a RuntimeVariables key. Options given on the "
+                             "command line take precedence.")
+    for parameter in STRING_PARAMETERS:
+        parser.add_argument("--" + parameter.replace("_", "-"), dest=parameter)
+    for parameter in LIST_PARAMETERS:
+        parser.add_argument("--" + parameter.replace("_", "-"), dest=parameter,
+                            nargs="+")
+    parser.add_argument("--dtype-overrides", type=json.loads,
+                        help="JSON object of per column dtype rules.")
+    parser.add_argument("--grouping-levels", type=json.loads,
+                        help="JSON object of each level to disclose the cells of and "
+                             "its grouping columns, e.g. "
+                             "'{\"region\": [\"region\"], \"county\": [\"county\"]}'.")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the disclosure stages locally on a JSON, CSV or Parquet file.")
+    parser.add_argument("input_file",
+                        help="Input file, in the format of the wrangler's in_file_name.")
+    parser.add_argument("output_file",
+                        help="Output file. .json writes records like out_file_name, "
+                             ".csv like final_output_location, or .parquet.")
+    add_runtime_arguments(parser)
+    parser.add_argument("--memory-map", action="store_true",
+                        help="Memory map the input file rather than reading it.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to split the rows across.")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print a summary of where the time was spent.")
+
+    return parser.parse_args(argv)
+
+
+def build_runtime_variables(arguments):
+    """
+    Combines the runtime variables file with the runtime variable options.
+    :param arguments: Parsed arguments from a parser with add_runtime_arguments.
+    :return: runtime_variables - Type: Dict
+    """
+    runtime_variables = {}
+    if arguments.runtime_variables:
+        with open(arguments.runtime_variables, "r") as file:
+            runtime_variables = json.load(file)
+        runtime_variables = runtime_variables.get("RuntimeVariables", runtime_variables)
+
+    for parameter in STRING_PARAMETERS + LIST_PARAMETERS + ["disclosure_stages",
+                                                            "dtype_overrides",
+                                                            "grouping_levels"]:
+        if getattr(arguments, parameter) is not None:
+            runtime_variables[parameter] = getattr(arguments, parameter)
+
+    missing = [parameter for parameter in REQUIRED_PARAMETERS + ["disclosure_stages"]
+               if parameter not in runtime_variables]
+    if missing:
+        raise ValueError(f"Missing runtime variables: {', '.join(missing)}")
+
+    return runtime_variables
+
+
+def read_input(file_name, memory_map=False):
+    """
+    Reads the input file according to its extension.
+    :param file_name: Path of a .json (records), .csv or .parquet file - Type: String
+    :param memory_map: Map the file into memory instead of reading it - Type: Boolean
+    :return: The input data - Type: DataFrame
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".csv":
+        return pd.read_csv(file_name, memory_map=memory_map)
+    if extension == ".parquet":
+        return pd.read_parquet(file_name, memory_map=memory_map)
+    if extension != ".json":
+        raise ValueError(f"Unsupported input file type: {file_name}")
+
+    if not memory_map:
+        with open(file_name, "rb") as file:
+            return columnar_json.decode_records(file.read())
+
+    with open(file_name, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            # orjson parses the view in place; the json module needs a copy of it.
+            with memoryview(mapped_file) as view:
+                return columnar_json.decode_records(view)
+
+
+def write_output(data, file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".csv":
+        data.to_csv(file_name, index=False)
+    elif extension == ".parquet":
+        data.to_parquet(file_name, index=False)
+    elif extension == ".json":
+        with open(file_name, "w") as file:
+            file.write(data.to_json(orient="records"))
+    else:
+        raise ValueError(f"Unsupported output file type: {file_name}")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    logger = logging.getLogger("disclosure_cli")
+
+    arguments = parse_arguments(argv)
+    runtime_variables = build_runtime_variables(arguments)
+    timings = {}
+
+    start = time.perf_counter()
+    data = read_input(arguments.input_file, arguments.memory_map)
+    timings["read"] = time.perf_counter() - start
+    logger.info(f"Read {len(data)} rows from {arguments.input_file}")
+
+    start = time.perf_counter()
+    data, memory_before, memory_after = dtype_plan.apply_dtype_plan(
+        data, dtype_plan.build_dtype_plan(runtime_variables))
+    timings["dtype plan"] = time.perf_counter() - start
+    logger.info(f"Applied dtype plan - memory usage reduced from {memory_before}"
+                f" to {memory_after} bytes")
+
+    if runtime_variables.get("grouping_levels"):
+        start = time.perf_counter()
+        data = geography_levels.build_cells(data, runtime_variables, logger)
+        runtime_variables = geography_levels.cell_runtime_variables(runtime_variables)
+        timings["levels"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data, stage_timings = disclosure_pipeline.run_stages(
+        data, runtime_variables, runtime_variables["disclosure_stages"], logger,
+        arguments.workers)
+    data = disclosure_layout.apply_layout(data, runtime_variables)
+    timings["disclosure"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_output(data, arguments.output_file)
+    timings["write"] = time.perf_counter() - start
+    logger.info(f"Wrote {len(data)} rows to {arguments.output_file}")
+
+    if arguments.timings:
+        print("Timing summary (seconds):", file=sys.stderr)
+        for step, seconds in timings.items():
+            print(f"  {step:<12} {seconds:10.3f}", file=sys.stderr)
+        for disclosure_step, seconds in stage_timings.items():
+            print(f"    stage {disclosure_step:<6} {seconds:10.3f}"
+                  f"{' (summed over workers)' if arguments.workers > 1 else ''}",
+                  file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import json
+import os
+
+import boto3
+import numpy as np
+import pandas as pd
+
+import columnar_json
+import group_numbers
+
+INDEX_SUFFIX = ".index.json"
+
+
+def index_file_name(file_name):
+    """
+    The name of the sidecar index of an output file, e.g. output.index.json for
+    output.json.
+    :param file_name: The output file name - Type: String
+    :return: The index file name - Type: String
+    """
+    return os.path.splitext(file_name)[0] + INDEX_SUFFIX
+
+
+def lookup_key(values):
+    """
+    The key a cell or unique_identifier is looked up by in the index.
+    :param values: The value of each grouping (or unique_identifier) column, or a
+                   single value - Type: List/Tuple/Scalar
+    :return: The key - Type: String
+    """
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+
+    return json.dumps(list(values))
+
+
+def _row_keys(data, columns):
+    # Series.tolist gives Python scalars, which json can serialise.
+    return [lookup_key(values)
+            for values in zip(*[data[column].tolist() for column in columns])]
+
+
+def write_indexed(data, grouping_columns, unique_identifier, row_group_rows=1000):
+    """
+    Sorts the output by cell and serialises it as record-oriented JSON in row groups of
+    about row_group_rows rows, each made of whole cells, with an index of where each
+    row group's records are. The file is still a single JSON array, but the bytes of
+    any row group, wrapped in [ and ], are one too, so they can be read with a ranged
+    GET.
+    :param data: The output - Type: DataFrame
+    :param grouping_columns: The columns which identify a cell - Type: List
+    :param unique_identifier: The columns which identify a responder - Type: List
+    :param row_group_rows: The rows to aim for in each row group - Type: Int
+    :return: (sorted data - Type: DataFrame, JSON - Type: String,
+              index - Type: Dict), where the index holds the grouping_columns, the
+             unique_identifier, the row_groups' byte ranges {"start", "end", "rows"}
+             and the row group of each cell and unique_identifier, by lookup_key.
+    """
+    if not grouping_columns:
+        raise ValueError("An indexed output needs grouping_columns to sort by")
+    data = data.sort_values(grouping_columns, kind="mergesort").reset_index(drop=True)
+    rows = len(data)
+
+    cell_of_row = group_numbers.number_groups(data, grouping_columns)
+    cell_starts = np.flatnonzero(np.diff(cell_of_row, prepend=-1))
+    # A row group starts at each cell which starts in a new block of row_group_rows,
+    # so cells are never split across row groups.
+    group_of_cell = np.cumsum(np.diff(cell_starts // row_group_rows, prepend=-1) > 0) - 1
+    group_starts = cell_starts[np.flatnonzero(np.diff(group_of_cell, prepend=-1))]
+    group_bounds = np.append(group_starts, rows)
+
+    parts = []
+    row_groups = []
+    offset = 1
+    for start, end in zip(group_bounds[:-1], group_bounds[1:]):
+        part = data.iloc[start:end].to_json(orient="records")[1:-1]
+        size = len(part.encode("UTF-8"))
+        parts.append(part)
+        row_groups.append({"start": offset, "end": offset + size,
+                           "rows": int(end - start)})
+        offset += size + 1
+
+    group_of_row = np.repeat(np.arange(len(row_groups)), np.diff(group_bounds))
+    index = {
+        "grouping_columns": list(grouping_columns),
+        "unique_identifier": list(unique_identifier),
+        "row_groups": row_groups,
+        "cells": dict(zip(_row_keys(data.iloc[cell_starts], grouping_columns),
+                          group_of_cell.tolist())),
+        "identifiers": dict(zip(_row_keys(data, unique_identifier),
+                                group_of_row.tolist()))
+    }
+
+    return data, "[" + ",".join(parts) + "]", index
+
+
+def read_index(bucket_name, file_name, s3_client=None):
+    """
+    Reads the sidecar index of an output file.
+    :param bucket_name: The bucket - Type: String
+    :param file_name: The output file name (not the index's) - Type: String
+    :param s3_client: The client to read with - Type: Service client
+    :return: index - Type: Dict
+    """
+    s3_client = s3_client or boto3.client("s3", region_name="eu-west-2")
+    s3_object = s3_client.get_object(Bucket=bucket_name,
+                                     Key=index_file_name(file_name))
+
+    return json.loads(s3_object["Body"].read().decode("UTF-8"))
+
+
+def lookup(bucket_name, file_name, cells=(), identifiers=(), index=None,
+           s3_client=None):
+    """
+    Reads the rows of some cells and responders from an indexed output, fetching only
+    the row groups which hold them, with one ranged GET for each run of adjacent row
+    groups.
+    :param bucket_name: The bucket - Type: String
+    :param file_name: The output file name - Type: String
+    :param cells: The cells, each as its grouping column values - Type: List
+    :param identifiers: The responders, each as its unique_identifier values
+                        - Type: List
+    :param index: The index, read here if not given - Type: Dict
+    :param s3_client: The client to read with - Type: Service client
+    :return: The rows of the cells and responders, in the order of the output
+             - Type: DataFrame
+    """
+    s3_client = s3_client or boto3.client("s3", region_name="eu-west-2")
+    if index is None:
+        index = read_index(bucket_name, file_name, s3_client)
+
+    cell_keys = {lookup_key(cell) for cell in cells}
+    identifier_keys = {lookup_key(identifier) for identifier in identifiers}
+    groups = sorted({index["cells"][key] for key in cell_keys if key in index["cells"]}
+                    | {index["identifiers"][key] for key in identifier_keys
+                       if key in index["identifiers"]})
+    if not groups:
+        return pd.DataFrame()
+
+    frames = []
+    runs = np.split(np.array(groups), np.flatnonzero(np.diff(groups) > 1) + 1)
+    for run in runs:
+        start = index["row_groups"][run[0]]["start"]
+        end = index["row_groups"][run[-1]]["end"]
+        s3_object = s3_client.get_object(Bucket=bucket_name, Key=file_name,
+                                         Range=f"bytes={start}-{end - 1}")
+        frames.append(columnar_json.decode_records(
+            "[" + s3_object["Body"].read().decode("UTF-8") + "]"))
+    data = pd.concat(frames, ignore_index=True)
+
+    wanted = np.isin(_row_keys(data, index["grouping_columns"]), list(cell_keys)) | \
+        np.isin(_row_keys(data, index["unique_identifier"]), list(identifier_keys))
+
+    return data[wanted].reset_index(drop=True)
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+import group_numbers
+
+# One row per contributor, with disclosure columns for every total column e.g.
+# disclosive_Q608_total.
+WIDE = "wide"
+# One row per cell and total column.
+LONG = "long"
+LAYOUTS = [WIDE, LONG]
+
+TOTAL_COLUMN = "total_column"
+REASON_CODE = "reason_code"
+SCORE = "Score"
+# Finds the stage an explanation names.
+STAGE_PATTERN = r"(?i)stage (\d)"
+
+
+def score_column(total_column):
+    """
+    The name stage 5 gives a total column's score when the output is to be long, so
+    that every total column keeps its own score.
+    :param total_column: The total column - Type: String
+    :return: The score column name - Type: String
+    """
+    return SCORE + "_" + total_column
+
+
+def to_long(data, runtime_variables):
+    """
+    Converts the wide disclosure output into one row per cell and total column,
+    holding the grouping columns, the total column's name and the cell's disclosure
+    marker, publish flag (if still present), reason code and score. Without
+    grouping_columns every row is a cell, identified by its unique_identifier.
+    The stages suppress cells whole, so a cell takes the values of its first
+    disclosive row, or of its first row when none is. The cells are in the order they
+    first appear, and the cells of each total column are kept together, in the order
+    of total_columns.
+    :param data: Wide disclosure output - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The long disclosure output - Type: DataFrame
+    """
+    total_columns = runtime_variables["total_columns"]
+    disclosivity_marker = runtime_variables["disclosivity_marker"]
+    grouping_columns = runtime_variables.get("grouping_columns")
+    if grouping_columns:
+        id_columns = list(grouping_columns)
+        cell_of_row = group_numbers.number_groups(data, grouping_columns)
+    else:
+        id_columns = list(runtime_variables["unique_identifier"])
+        cell_of_row = np.arange(len(data))
+    _, first_rows = np.unique(cell_of_row, return_index=True)
+    cell_count = len(first_rows)
+
+    # The row each cell takes its values from, for each total column.
+    cell_rows = []
+    for total_column in total_columns:
+        marker = disclosivity_marker + "_" + total_column
+        disclosive = (data[marker] == "Yes").to_numpy() if marker in data.columns \
+            else np.zeros(len(data), dtype=bool)
+        order = np.lexsort((~disclosive, cell_of_row))
+        cell_rows.append(order[np.searchsorted(cell_of_row[order],
+                                               np.arange(cell_count))])
+
+    long_data = {column: np.tile(data[column].to_numpy()[first_rows],
+                                 len(total_columns))
+                 for column in id_columns}
+    long_data[TOTAL_COLUMN] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(total_columns)), cell_count), total_columns)
+
+    for value_name in [disclosivity_marker, runtime_variables["publishable_indicator"]]:
+        values = _cell_values(data, value_name, total_columns, cell_rows)
+        if values is not None:
+            long_data[value_name] = values
+
+    explanations = _cell_values(data, runtime_variables["explanation"], total_columns,
+                                cell_rows)
+    long_data[REASON_CODE] = reason_codes(
+        explanations if explanations is not None
+        else np.full(cell_count * len(total_columns), np.nan, dtype=object))
+
+    scores = []
+    for index, (total_column, rows) in enumerate(zip(total_columns, cell_rows)):
+        if score_column(total_column) in data.columns:
+            scores.append(data[score_column(total_column)].to_numpy(dtype=float)[rows])
+        elif index == 0 and SCORE in data.columns:
+            # The wide output only keeps the score of the first total column.
+            scores.append(data[SCORE].to_numpy(dtype=float)[rows])
+        else:
+            scores.append(np.full(cell_count, np.nan))
+    long_data[SCORE] = np.concatenate(scores) if scores else np.array([], dtype=float)
+
+    return pd.DataFrame(long_data)
+
+
+def reason_codes(explanations):
+    """
+    Shortens the stages' explanations to reason codes: "S" and the number of the
+    stage the explanation names, e.g. "S2" for "Stage 2 - Only 1 parent references in
+    cell" and for "Passed Stage 2". The disclosure marker says which way it went.
+    :param explanations: The explanations - Type: Numpy Array
+    :return: The reason codes, missing where no stage is named - Type: Numpy Array
+    """
+    stages = pd.Series(explanations, dtype=object).str.extract(STAGE_PATTERN,
+                                                               expand=False)
+
+    return ("S" + stages).to_numpy(dtype=object)
+
+
+def apply_layout(data, runtime_variables):
+    """
+    Puts the disclosure output into the layout given by the output_layout runtime
+    variable, which defaults to wide.
+    :param data: Wide disclosure output - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The output in the chosen layout - Type: DataFrame
+    """
+    output_layout = runtime_variables.get("output_layout") or WIDE
+    if output_layout not in LAYOUTS:
+        raise ValueError(f"Unknown output_layout {output_layout}")
+    if output_layout == LONG:
+        return to_long(data, runtime_variables)
+
+    return data
+
+
+def _cell_values(data, value_name, total_columns, cell_rows):
+    """
+    The values of a disclosure column for each cell of each total column, taken from
+    the cells' rows, or None if no stage wrote it for any total column.
+    :return: The values - Type: Numpy Array
+    """
+    columns = [value_name + "_" + total_column for total_column in total_columns]
+    if not any(column in data.columns for column in columns):
+        return None
+
+    return np.concatenate([
+        data[column].to_numpy(dtype=object)[rows] if column in data.columns
+        else np.full(len(rows), np.nan, dtype=object)
+        for column, rows in zip(columns, cell_rows)])
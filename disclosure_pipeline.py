@@ -0,0 +1,75 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import execution_planner
+import stage_registry
+
+
+def run_stages(data, runtime_variables, disclosure_stages, logger=None, workers=1):
+    """
+    Runs the given disclosure stages in process, one after another, without any
+    serialisation between them.
+    With more than one worker the rows are split into chunks of whole cells of
+    grouping_columns (see execution_planner.split_chunks), which go through all of the
+    stages on a process pool, and are put back together in their original order. Runs
+    with a stage which needs the whole table, like stage 4, can not be split.
+    :param data: The input data - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param logger: The logger to report progress to.
+    :param workers: The number of processes to use - Type: Int
+    :return: disclosed data, seconds spent in each stage - Type: Tuple(DataFrame, Dict)
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    disclosure_stages_list = []
+    for step in stage_registry.compile_plan(
+            disclosure_stages, dict.fromkeys(disclosure_stages.split(),
+                                             stage_registry.IN_PROCESS)):
+        disclosure_stages_list += step.stages
+    if disclosure_stages_list != disclosure_stages.split():
+        logger.info(f"Running the stages in the order {' '.join(disclosure_stages_list)},"
+                    f" rather than as given ({disclosure_stages})")
+    for disclosure_step in disclosure_stages_list:
+        stage_registry.in_process_arguments(disclosure_step, runtime_variables)
+
+    if workers <= 1 or len(data) < 2:
+        return _run_chunk(data, runtime_variables, disclosure_stages_list, logger)
+
+    if not execution_planner.chunkable(disclosure_stages):
+        raise ValueError(f"Stages {disclosure_stages} can not run on more than one"
+                         f" worker as a stage needs the whole table")
+    chunks = execution_planner.split_chunks(
+        data, runtime_variables.get("grouping_columns"), min(workers, len(data)))
+    logger.info(f"Running stages {disclosure_stages} on {len(chunks)} workers")
+
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_run_chunk, [chunk for _, chunk in chunks],
+                                    [runtime_variables] * len(chunks),
+                                    [disclosure_stages_list] * len(chunks)))
+    for _, chunk_timings in results:
+        for disclosure_step, seconds in chunk_timings.items():
+            timings[disclosure_step] = timings.get(disclosure_step, 0) + seconds
+
+    output = execution_planner.combine_chunks(
+        [chunk_output for chunk_output, _ in results],
+        [positions for positions, _ in chunks])
+
+    return output, timings
+
+
+def _run_chunk(data, runtime_variables, disclosure_stages_list, logger=None):
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    timings = {}
+    for disclosure_step in disclosure_stages_list:
+        start = time.perf_counter()
+        data = stage_registry.run_in_process(data, runtime_variables,
+                                             [disclosure_step], logger)
+        timings[disclosure_step] = time.perf_counter() - start
+
+    return data, timings
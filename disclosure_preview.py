@@ -0,0 +1,203 @@
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+import disclosure_pipeline
+import disclosure_summary
+import group_numbers
+import stage_registry
+
+# The cells sampled unless preview_cells says otherwise.
+SAMPLE_CELLS = 400
+# The fewest cells sampled from a stratum with that many, so its variance can be
+# estimated.
+STRATUM_MINIMUM = 2
+CONFIDENCE = 0.95
+
+
+def preview(data, runtime_variables, logger=None):
+    """
+    Estimates the share of cells the run's stages would suppress, for each total
+    column, without running them on every row. Whole cells are sampled, in proportion
+    to the number of cells in each stratum of preview_strata, the sample is disclosed
+    in process and the rates are estimated from it, weighting each stratum by its
+    share of the cells.
+    The intervals are Wilson score intervals on the effective sample size of the
+    stratified estimate, so a rate of 0 in the sample still has an upper bound. A
+    stratum sampled in full adds no uncertainty, so when every cell is sampled the
+    intervals are the rates themselves.
+    Stages which need the whole table (stage 4) can not be previewed.
+    :param data: The input data - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables, with the optional
+                              preview_cells, preview_confidence, preview_seed and
+                              preview_strata - Type: Dict
+    :param logger: The logger to report progress to.
+    :return: {"cells", "sampled_cells", "sampled_rows", "strata", "confidence",
+             "seconds", "total_columns": {total_column: {"rate", "low", "high",
+             "stages": {stage: {"rate", "low", "high"}}}}}, where rate is the share
+             of cells suppressed, and each stage's the share it suppressed - Type: Dict
+    """
+    start = time.perf_counter()
+    disclosure_stages = runtime_variables["disclosure_stages"]
+    whole_table = [stage for stage in disclosure_stages.split()
+                   if stage_registry.get_stage(stage).scope == stage_registry.TABLE]
+    if whole_table:
+        raise ValueError(f"Stage {', '.join(whole_table)} needs the whole table, so"
+                         " can not be previewed")
+    grouping_columns = runtime_variables.get("grouping_columns") or []
+    strata_columns = runtime_variables.get("preview_strata")
+    if strata_columns is None:
+        strata_columns = grouping_columns[:1] if len(grouping_columns) > 1 else []
+    outside = [column for column in strata_columns if column not in grouping_columns]
+    if outside:
+        raise ValueError(f"preview_strata {outside} are not grouping_columns, so"
+                         " would split cells")
+    confidence = runtime_variables.get("preview_confidence", CONFIDENCE)
+    z = _normal_quantile(0.5 + confidence / 2)
+
+    # Every row is a cell of its own without grouping columns.
+    if grouping_columns:
+        cell_of_row = group_numbers.number_groups(data, grouping_columns)
+    else:
+        cell_of_row = np.arange(len(data))
+    _, first_rows = np.unique(cell_of_row, return_index=True)
+    if strata_columns:
+        stratum_of_cell = group_numbers.number_groups(
+            data[strata_columns].iloc[first_rows], strata_columns)
+    else:
+        stratum_of_cell = np.zeros(len(first_rows), dtype=int)
+    stratum_cells = np.bincount(stratum_of_cell)
+    stratum_sample = _allocate(stratum_cells,
+                               runtime_variables.get("preview_cells", SAMPLE_CELLS))
+
+    sampled = _sample_cells(stratum_of_cell, stratum_sample,
+                            np.random.RandomState(runtime_variables.get("preview_seed")))
+    rows = np.flatnonzero(sampled[cell_of_row])
+    sample = data.iloc[rows].reset_index(drop=True)
+    if logger:
+        logger.info(f"Previewing on {sampled.sum()} of {len(sampled)} cells"
+                    f" ({len(rows)} rows) in {len(stratum_cells)} strata")
+
+    output, _ = disclosure_pipeline.run_stages(sample, runtime_variables,
+                                               disclosure_stages, logger)
+    estimates = {}
+    for total_column in runtime_variables["total_columns"]:
+        cells = pd.DataFrame({
+            "cell": cell_of_row[rows],
+            "suppressed": (disclosure_summary.publish_status(
+                output, runtime_variables, total_column) == "No").to_numpy(),
+            "stage": disclosure_summary.deciding_stage(
+                output, runtime_variables, total_column).to_numpy()})
+        # A cell is suppressed when any of its rows is, by the stage which suppressed
+        # it.
+        cells = cells.sort_values("suppressed", ascending=False, kind="mergesort")\
+            .drop_duplicates("cell")
+        strata = stratum_of_cell[cells["cell"].to_numpy()]
+        suppressed = cells["suppressed"].to_numpy()
+        estimates[total_column] = _estimate(suppressed, strata, stratum_cells,
+                                            stratum_sample, z)
+        estimates[total_column]["stages"] = {
+            stage: _estimate(suppressed & (cells["stage"] == stage).to_numpy(), strata,
+                             stratum_cells, stratum_sample, z)
+            for stage in sorted(cells["stage"][cells["suppressed"]].dropna().unique())}
+
+    return {"cells": len(sampled), "sampled_cells": int(sampled.sum()),
+            "sampled_rows": len(rows), "strata": len(stratum_cells),
+            "confidence": confidence,
+            "seconds": round(time.perf_counter() - start, 3),
+            "total_columns": estimates}
+
+
+def _allocate(stratum_cells, sample_cells):
+    """
+    Shares the cells to sample between the strata in proportion to their cells, the
+    remainders going to the largest fractions, with at least STRATUM_MINIMUM cells
+    from each stratum which has them.
+    :param stratum_cells: The cells in each stratum - Type: Numpy Array
+    :param sample_cells: The cells to sample - Type: Int
+    :return: The cells to sample from each stratum - Type: Numpy Array
+    """
+    total_cells = stratum_cells.sum()
+    if sample_cells >= total_cells:
+        return stratum_cells.copy()
+
+    shares = stratum_cells * sample_cells / total_cells
+    allocated = np.floor(shares).astype(int)
+    remainders = np.argsort(allocated - shares, kind="stable")
+    allocated[remainders[:sample_cells - allocated.sum()]] += 1
+
+    return np.minimum(np.maximum(allocated, STRATUM_MINIMUM), stratum_cells)
+
+
+def _sample_cells(stratum_of_cell, stratum_sample, generator):
+    """
+    Samples cells from each stratum without replacement, by ranking its cells on a
+    random key.
+    :param stratum_of_cell: The stratum of each cell - Type: Numpy Array
+    :param stratum_sample: The cells to sample from each stratum - Type: Numpy Array
+    :param generator: The source of the keys - Type: Numpy RandomState
+    :return: Whether each cell is sampled - Type: Numpy Array
+    """
+    order = np.lexsort((generator.random_sample(len(stratum_of_cell)), stratum_of_cell))
+    stratum_starts = np.concatenate([[0], np.cumsum(np.bincount(stratum_of_cell))])
+    ranks = np.arange(len(order)) - stratum_starts[stratum_of_cell[order]]
+    sampled = np.zeros(len(order), dtype=bool)
+    sampled[order[ranks < stratum_sample[stratum_of_cell[order]]]] = True
+
+    return sampled
+
+
+def _estimate(values, strata, stratum_cells, stratum_sample, z):
+    """
+    Estimates the share of cells with a property from a stratified sample.
+    :param values: Whether each sampled cell has it - Type: Numpy Array
+    :param strata: The stratum of each sampled cell - Type: Numpy Array
+    :param stratum_cells: The cells in each stratum - Type: Numpy Array
+    :param stratum_sample: The cells sampled from each stratum - Type: Numpy Array
+    :param z: The normal quantile of the confidence - Type: Float
+    :return: {"rate", "low", "high"} - Type: Dict
+    """
+    weights = stratum_cells / stratum_cells.sum()
+    rates = np.bincount(strata, weights=values, minlength=len(stratum_cells)) \
+        / np.maximum(stratum_sample, 1)
+    rate = float(weights @ rates)
+
+    # The sample variance of each stratum, taken at its largest where a single cell
+    # was sampled from several.
+    sampled = np.maximum(stratum_sample, 1)
+    variances = np.where(stratum_sample > 1,
+                         rates * (1 - rates) * sampled / np.maximum(sampled - 1, 1),
+                         0.25)
+    variance = float(np.sum(weights ** 2 * (1 - stratum_sample / stratum_cells)
+                            * variances / sampled))
+    if variance == 0 and (stratum_sample == stratum_cells).all():
+        low, high = rate, rate
+    else:
+        effective = rate * (1 - rate) / variance if variance > 0 and 0 < rate < 1 \
+            else stratum_sample.sum()
+        centre = (rate + z ** 2 / (2 * effective)) / (1 + z ** 2 / effective)
+        half = z / (1 + z ** 2 / effective) * math.sqrt(
+            rate * (1 - rate) / effective + z ** 2 / (4 * effective ** 2))
+        low, high = max(centre - half, 0.0), min(centre + half, 1.0)
+
+    return {"rate": round(rate, 4), "low": round(low, 4), "high": round(high, 4)}
+
+
+def _normal_quantile(probability):
+    """
+    The standard normal quantile, found by bisection, as the lambdas' Python has no
+    statistics.NormalDist.
+    :param probability: The probability, between 0 and 1 - Type: Float
+    :return: The quantile - Type: Float
+    """
+    low, high = -10.0, 10.0
+    for _ in range(60):
+        middle = (low + high) / 2
+        if (1 + math.erf(middle / math.sqrt(2))) / 2 < probability:
+            low = middle
+        else:
+            high = middle
+
+    return (low + high) / 2
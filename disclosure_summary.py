@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+import disclosure_layout
+import group_numbers
+
+SCORE_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+# The publish status of a row which passed a stage but which no stage has decided.
+NOT_APPLICABLE = "Not Applicable"
+# Finds the explanation a stage gives a row it passes on, e.g. "Passed Stage 2".
+PASSED_PATTERN = r"(?i)passed stage \d"
+
+
+def summarise(data, runtime_variables):
+    """
+    Summarises the wide disclosure output with one groupby over every total column:
+    for each total column, publish status and deciding stage, the number of
+    responders and, when grouping_columns is given, of cells; and for each total
+    column the distribution of the stage 5 scores.
+    The publish status is the publishable_indicator if it is still in the data, and is
+    otherwise worked out from the disclosivity_marker and explanation (see
+    publish_status). The deciding stage is the stage named in the explanation.
+    :param data: The output in the wide layout - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: summary: {"responders", "counts": [{"total_column", "status", "stage",
+             "responders", "cells"}], "scores": {total_column: {"count", "min",
+             "p10", ..., "max"}}} - Type: Dict
+    """
+    total_columns = runtime_variables["total_columns"]
+    grouping_columns = runtime_variables.get("grouping_columns")
+    grouped = pd.DataFrame({
+        disclosure_layout.TOTAL_COLUMN: np.repeat(total_columns, len(data)),
+        "status": np.concatenate(
+            [publish_status(data, runtime_variables, total_column)
+             .fillna("None").to_numpy() for total_column in total_columns]
+            or [np.array([], dtype=object)]),
+        "stage": np.concatenate(
+            [deciding_stage(data, runtime_variables, total_column)
+             .fillna("None").to_numpy() for total_column in total_columns]
+            or [np.array([], dtype=object)])
+    })
+    keys = [disclosure_layout.TOTAL_COLUMN, "status", "stage"]
+    if grouping_columns:
+        # The cells are numbered once and shared by every total column.
+        grouped["cell"] = np.tile(group_numbers.number_groups(data, grouping_columns),
+                                  len(total_columns))
+        total_counts = grouped.groupby(keys, sort=True)["cell"]\
+            .agg(["size", "nunique"])
+    else:
+        total_counts = grouped.groupby(keys, sort=True).size().to_frame("size")
+        total_counts["nunique"] = None
+    counts = [{disclosure_layout.TOTAL_COLUMN: name[0], "status": name[1],
+               "stage": name[2], "responders": int(row["size"]),
+               "cells": None if row["nunique"] is None else int(row["nunique"])}
+              for name, row in total_counts.iterrows()]
+
+    scores = {}
+    for index, total_column in enumerate(total_columns):
+        score = _score(data, total_column, index)
+        if score is not None and score.notna().any():
+            scores[total_column] = {"count": int(score.count()),
+                                    "min": float(score.min())}
+            scores[total_column].update({
+                f"p{int(quantile * 100)}": float(value)
+                for quantile, value in score.quantile(SCORE_QUANTILES).items()})
+            scores[total_column]["max"] = float(score.max())
+
+    return {
+        "responders": len(data),
+        "counts": counts,
+        "scores": scores
+    }
+
+
+def publish_status(data, runtime_variables, total_column):
+    """
+    The publish status of each row of the wide output for a total column: the
+    publishable_indicator if it is still in the data, and otherwise worked out from
+    the disclosivity_marker ("Yes" is "No", "No" is "Publish"), except that a row
+    whose explanation is that it passed a stage is "Not Applicable", as no stage has
+    decided it.
+    :param data: The output in the wide layout - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param total_column: The total column - Type: String
+    :return: "Publish", "No", "Not Applicable", or missing - Type: Series
+    """
+    publishable_indicator = runtime_variables["publishable_indicator"] + "_" \
+        + total_column
+    if publishable_indicator in data.columns:
+        return data[publishable_indicator].astype(object)
+
+    status = _values(data, runtime_variables["disclosivity_marker"] + "_"
+                     + total_column).map({"Yes": "No", "No": "Publish"})
+    passed = _values(data, runtime_variables["explanation"] + "_" + total_column)\
+        .str.match(PASSED_PATTERN).fillna(False).to_numpy(dtype=bool)
+    status[passed & (status == "Publish").to_numpy()] = NOT_APPLICABLE
+
+    return status
+
+
+def deciding_stage(data, runtime_variables, total_column):
+    """
+    The stage named in the explanation of each row of the wide output for a total
+    column.
+    :param data: The output in the wide layout - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param total_column: The total column - Type: String
+    :return: The stage number, or missing - Type: Series
+    """
+    return _values(data, runtime_variables["explanation"] + "_" + total_column)\
+        .str.extract(disclosure_layout.STAGE_PATTERN, expand=False)
+
+
+def _values(data, column):
+    """
+    The values of a disclosure column, missing for every row when no stage wrote it.
+    :return: The values - Type: Series
+    """
+    if column in data.columns:
+        return data[column].astype(object)
+
+    return pd.Series(np.nan, index=data.index, dtype=object)
+
+
+def _score(data, total_column, index):
+    """
+    The stage 5 score of each row for a total column: its own score column, kept for
+    the long layout, or Score, which the wide output keeps for the first total column.
+    :return: The scores, or None - Type: Series
+    """
+    if disclosure_layout.score_column(total_column) in data.columns:
+        return data[disclosure_layout.score_column(total_column)].astype(float)
+    if index == 0 and disclosure_layout.SCORE in data.columns:
+        return data[disclosure_layout.SCORE].astype(float)
+
+    return None
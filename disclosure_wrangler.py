@@ -1,11 +1,36 @@
+import functools
 import json
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import pandas as pd
 from es_aws_functions import aws_functions, exception_classes, general_functions
-from marshmallow import EXCLUDE, Schema, fields
+from marshmallow import EXCLUDE, Schema, fields, validate
+
+import columnar_json
+import disclosure_index
+import disclosure_layout
+import disclosure_preview
+import disclosure_summary
+import dtype_plan
+import execution_planner
+import geography_levels
+import input_validation
+import multipart_input
+import payload_compression
+import profiling
+import s3_payload
+import side_calls
+import stage_chain
+import stage_registry
+import stage_warmup
+import surrogate_key
+
+# The name a chained run's surrogate_key identifiers are kept under in s3.
+IDENTIFIERS = "identifiers"
 
 
 class EnvironmentSchema(Schema):
@@ -17,6 +42,7 @@ class EnvironmentSchema(Schema):
         raise ValueError(f"Error validating environment params: {e}")
 
     bucket_name = fields.Str(required=True)
+    finaliser_name = fields.Str(required=False)
     method_name = fields.Str(required=True)
 
 
@@ -30,17 +56,50 @@ class RuntimeSchema(Schema):
 
     bpm_queue_url = fields.Str(required=True)
     cell_total_column = fields.Str(required=True)
+    compression_level = fields.Int(required=False)
+    data_compression = fields.Str(required=False,
+                                  validate=validate.OneOf(payload_compression.CODECS))
     disclosivity_marker = fields.Str(required=True)
     disclosure_stages = fields.Str(required=True)
+    dominance_k = fields.Str(required=False)
+    dominance_n = fields.Str(required=False)
+    dtype_overrides = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
     environment = fields.Str(required=True)
+    execution_mode = fields.Str(
+        required=False,
+        validate=validate.OneOf(execution_planner.MODES + [execution_planner.AUTO]))
     explanation = fields.Str(required=True)
     final_output_location = fields.Str(required=True)
+    grouping_columns = fields.List(fields.String, required=False)
+    grouping_levels = fields.Dict(keys=fields.Str(), values=fields.List(fields.Str()),
+                                  required=False)
     in_file_name = fields.Str(required=True)
+    indexed_output = fields.Bool(required=False)
+    input_parts = fields.Str(required=False,
+                             validate=validate.OneOf(multipart_input.PART_SOURCES))
     out_file_name = fields.Str(required=True)
+    output_layout = fields.Str(required=False,
+                               validate=validate.OneOf(disclosure_layout.LAYOUTS))
     parent_column = fields.Str(required=True)
+    parent_reference_column = fields.Str(required=False)
+    planner_thresholds = fields.Dict(keys=fields.Str(), values=fields.Int(),
+                                     required=False)
+    preview = fields.Bool(required=False)
+    preview_cells = fields.Int(required=False, validate=validate.Range(min=1))
+    preview_confidence = fields.Float(
+        required=False, validate=validate.Range(min=0, max=1, min_inclusive=False,
+                                                max_inclusive=False))
+    preview_seed = fields.Int(required=False)
+    preview_strata = fields.List(fields.String, required=False)
+    profile = fields.Str(required=False, validate=validate.OneOf(profiling.PROFILERS))
+    profile_allocations = fields.Bool(required=False)
     publishable_indicator = fields.Str(required=True)
+    read_concurrency = fields.Int(required=False, validate=validate.Range(min=1))
+    row_group_rows = fields.Int(required=False, validate=validate.Range(min=1))
     sns_topic_arn = fields.Str(required=True)
     stage5_threshold = fields.Str(required=True)
+    stage_targets = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
+    surrogate_key = fields.Bool(required=False)
     survey = fields.Str(required=True)
     threshold = fields.Str(required=True)
     top1_column = fields.Str(required=True)
@@ -48,8 +107,27 @@ class RuntimeSchema(Schema):
     total_columns = fields.List(fields.String, required=True)
     total_steps = fields.Int(required=True)
     unique_identifier = fields.List(fields.String, required=True)
+    warmup = fields.Bool(required=False)
 
 
+class BatchSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    def handle_error(self, e, data, **kwargs):
+        logging.error(f"Error validating batch params: {e}")
+        raise ValueError(f"Error validating batch params: {e}")
+
+    bpm_queue_url = fields.Str(required=True)
+    environment = fields.Str(required=True)
+    max_concurrency = fields.Int(required=False, validate=validate.Range(min=1))
+    runs = fields.List(fields.Dict(), required=True)
+    shared = fields.Dict(required=False)
+    survey = fields.Str(required=True)
+    total_steps = fields.Int(required=True)
+
+
+@profiling.profiled("wrangler")
 def lambda_handler(event, context):
     """
     Responsible for executing specified disclosure methods, masking values which could
@@ -58,15 +136,74 @@ def lambda_handler(event, context):
     RuntimeVariables:{
         bpm_queue_url: Queue url to send BPM status message.
         cell_total_column: The name of the column holding the cell total.
+        compression_level: Optional. The data_compression level, defaulting to the
+            codec's own default.
+        data_compression: Optional. The codec (e.g. "zlib", "lzma") to compress the
+            data sent to, and returned by, the stage lambdas with.
         disclosivity_marker: The name of the column to put "disclosive" marker.
-        disclosure_stages: The stages of disclosure you wish to run e.g. (1 2 5)
+        disclosure_stages: The stages of disclosure you wish to run e.g. (1 2 5),
+            run in the order 1, 2, 3, 5, 4 (see stage_registry.run_order).
+        dominance_k: The largest percentage of a cell's total its top dominance_n
+            contributors can make up. Required when stage 3 is run.
+        dominance_n: The number of largest contributors in the stage 3 dominance test.
+            Required when stage 3 is run.
+        dtype_overrides: Optional per column dtype rules for the dtype plan.
         environment: The operating environment to use in the spp logger.
+        execution_mode: Optional. How to run the stages: "inline", "s3",
+            "in_process", "chunked" or "chained". Defaults to "auto", which chooses
+            from the size of the input, though never "chained".
         explanation: The name of the column to put reason for pass/fail.
-        in_file_name: Input file specified.
+        grouping_columns: The columns which identify a cell of the published table.
+            Required when stage 3 or 4 is run, or when the top contributor columns
+            are not in the data for stage 5.
+        grouping_levels: Optional. The levels to disclose the cells of, each with
+            the columns which identify its cells, e.g. {"region": ["region"],
+            "county": ["county"]}. The input is then aggregated into the cells of
+            every level, which stages 1, 2 and 5 disclose together, and the output
+            has one row per cell (see geography_levels).
+        in_file_name: Input file specified, or with input_parts the prefix or
+            manifest of its parts.
+        indexed_output: Optional. Whether to write the output sorted by cell, in row
+            groups, with a sidecar index for partial reads (see disclosure_index).
+            Needs grouping_columns.
+        input_parts: Optional. "prefix" to read the input from every object under
+            in_file_name, in key order, or "manifest" from the objects listed in
+            the manifest in_file_name, several at once (see multipart_input).
         out_file_name: Output file specified.
+        output_layout: Optional. "wide" (the default) for one row per contributor
+            with disclosure columns for each total column, or "long" for one row per
+            cell and total column.
         parent_column: The name of the column holding the count of parent company.
+        parent_reference_column: Optional. The name of the column holding each
+            responder's parent company reference, counted in each cell with
+            grouping_levels. Required when stage 2 is run with grouping_levels.
+        planner_thresholds: Optional overrides of
+            execution_planner.DEFAULT_THRESHOLDS.
+        preview: Optional. Whether to only estimate the share of cells the stages
+            would suppress, from a sample of whole cells disclosed in process, and
+            return the estimates without writing any output (see
+            disclosure_preview). Stage 4 can not be previewed.
+        preview_cells: Optional. The cells to sample for a preview, default 400.
+        preview_confidence: Optional. The confidence of the preview's intervals,
+            default 0.95.
+        preview_seed: Optional. The seed of the preview's sample, for a repeatable
+            preview.
+        preview_strata: Optional. The grouping_columns to stratify the preview's
+            sample by, defaulting to the first of several grouping_columns.
+        profile: Optional. "cprofile" or "sampling" to profile this invocation and
+            the stages it invokes, writing each profile to the bucket under
+            disclosure-profiles/<run_id>/ (see profiling).
+        profile_allocations: Optional. Whether to trace allocations too.
         publishable_indicator: The name of the column to put "publish" marker.
+        read_concurrency: Optional. The most input parts read at once, default 8.
+        row_group_rows: Optional. The rows in each row group of an indexed output,
+            default 1000.
         stage5_threshold: The threshold used in the disclosure calculation.
+        stage_targets: Optional map of stage number to where it runs, "remote" (its
+            own lambda, the default) or "in_process" (inside the wrangler).
+        surrogate_key: Optional. Whether to send the stages one integer key in place
+            of the unique_identifier columns they do not read, restoring the columns
+            in the output (see surrogate_key).
         survey: The survey selected to be used in the logger.
         threshold: The threshold used in the disclosure steps.
         top1_column: The name of the column largest contributor to the cell.
@@ -74,14 +211,42 @@ def lambda_handler(event, context):
         total_column: The name of the column holding the cell total.
         total_steps: The total number of steps in the system.
         unique_identifier: A list of the column names to specify a unique cell.
+        warmup: Optional. Whether to ping the stage lambdas while the input is read,
+            default true.
     }
     :param context: AWS Context Object.
     :return final_output: Dict containing either:
         {"success": True}
+        {"success": True, "chained": True} when the stages were started as a chain,
+        which the finaliser completes.
+        {"success": True, "preview": <the estimates from disclosure_preview.preview
+         - Type: Dict>} for a preview.
         {"success": False, "error": <error message - Type: String>}
     """
+    return run_disclosure(event, context)
+
+
+def run_disclosure(event, context, environment_variables=None, runtime_schema=None,
+                   lambda_client=None, send_status=True):
+    """
+    Runs disclosure for a single run. Used by lambda_handler and, once per run, by
+    batch_lambda_handler, which passes in what the runs can share.
+    :param event: JSON payload, as for lambda_handler.
+    :param context: AWS Context Object.
+    :param environment_variables: The loaded EnvironmentSchema, loaded here if not
+                                  given - Type: Dict
+    :param runtime_schema: The RuntimeSchema to load the runtime variables with
+                           - Type: RuntimeSchema
+    :param lambda_client: The client to invoke the stages with - Type: Service client
+    :param send_status: Whether to send the start of method status to BPM.
+                        - Type: Boolean
+    :return final_output: {"success": True}, with "chained": True when the stages
+             were started as a chain, or "preview" for a preview, or raises
+             LambdaFailure.
+    """
     current_module = "Disclosure Wrangler"
     error_message = ""
+    chained = False
     # Set-up variables for status message
     current_step_num = 6
     bpm_queue_url = None
@@ -92,8 +257,10 @@ def lambda_handler(event, context):
         # Because it is used in exception handling
         run_id = event["RuntimeVariables"]["run_id"]
 
-        environment_variables = EnvironmentSchema().load(os.environ)
-        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+        if environment_variables is None:
+            environment_variables = EnvironmentSchema().load(os.environ)
+        runtime_variables = (runtime_schema or RuntimeSchema()).load(
+            event["RuntimeVariables"])
 
         # Environment Variables
         bucket_name = environment_variables["bucket_name"]
@@ -101,25 +268,16 @@ def lambda_handler(event, context):
 
         # Runtime Variables
         bpm_queue_url = runtime_variables["bpm_queue_url"]
-        cell_total_column = runtime_variables["cell_total_column"]
-        disclosivity_marker = runtime_variables["disclosivity_marker"]
         disclosure_stages = runtime_variables["disclosure_stages"]
         environment = runtime_variables["environment"]
-        explanation = runtime_variables["explanation"]
-        final_output_location = runtime_variables["final_output_location"]
         in_file_name = runtime_variables["in_file_name"]
-        out_file_name = runtime_variables["out_file_name"]
-        parent_column = runtime_variables["parent_column"]
-        publishable_indicator = runtime_variables["publishable_indicator"]
-        sns_topic_arn = runtime_variables["sns_topic_arn"]
-        stage5_threshold = runtime_variables["stage5_threshold"]
         survey = runtime_variables["survey"]
-        threshold = runtime_variables["threshold"]
-        top1_column = runtime_variables["top1_column"]
-        top2_column = runtime_variables["top2_column"]
-        total_columns = runtime_variables["total_columns"]
         total_steps = runtime_variables["total_steps"]
-        unique_identifier = runtime_variables["unique_identifier"]
+
+        # The stages write their profiles to the wrangler's bucket.
+        if runtime_variables.get("profile") or \
+                runtime_variables.get("profile_allocations"):
+            runtime_variables["profile_bucket"] = bucket_name
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
@@ -135,127 +293,672 @@ def lambda_handler(event, context):
                                                            bpm_queue_url=bpm_queue_url)
         raise exception_classes.LambdaFailure(error_message)
 
+    # The BPM status and SNS messages are sent in the background as the run goes on.
+    dispatcher = side_calls.Dispatcher(logger)
+    warmup = None
     try:
         logger.info("Started - retrieved configuration variables.")
 
-        # Send start of method status to BPM.
-        status = "IN PROGRESS"
-        aws_functions.send_bpm_status(bpm_queue_url, current_module, status, run_id,
-                                      current_step_num, total_steps)
+        # A preview is not a run of the method, so is not reported to BPM.
+        if send_status and not runtime_variables.get("preview"):
+            # Send start of method status to BPM.
+            status = "IN PROGRESS"
+            dispatcher.submit(side_calls.BPM, aws_functions.send_bpm_status,
+                              bpm_queue_url, current_module, status, run_id,
+                              current_step_num, total_steps)
+
+        # Set up clients, through the stand-in invoker when run locally.
+        if lambda_client is None:
+            lambda_client = stage_chain.client()
+
+        # Ping the stage lambdas while the input is read, so their cold starts are
+        # not waited for one at a time.
+        warmup = stage_warmup.Warmup(
+            lambda_client,
+            [stage_registry.lambda_name(method_name, stage)
+             for stage in _warmup_stages(disclosure_stages, runtime_variables)])
+        metrics = {}
+
+        if runtime_variables.get("input_parts"):
+            data = multipart_input.read_parts(
+                bucket_name, in_file_name, runtime_variables["input_parts"],
+                runtime_variables.get("read_concurrency",
+                                      multipart_input.READ_CONCURRENCY),
+                logger=logger)
+        else:
+            data = aws_functions.read_dataframe_from_s3(bucket_name, in_file_name)
+        metrics["read_seconds"] = round(time.perf_counter() - warmup.started, 3)
+        logger.info("Successfully retrieved data")
 
-        # Set up clients
-        lambda_client = boto3.client("lambda", "eu-west-2")
+        if runtime_variables.get("grouping_levels"):
+            data = geography_levels.build_cells(data, runtime_variables, logger)
+            runtime_variables = geography_levels.cell_runtime_variables(
+                runtime_variables)
+            logger.info(f"Built the {len(data)} cells of"
+                        f" {len(runtime_variables['grouping_levels'])} levels")
+
+        # Reject bad input before any stage is paid for, with every problem at once.
+        input_validation.validate(data, disclosure_stages, runtime_variables)
+        logger.info("Validated the input")
+
+        if runtime_variables.get("preview"):
+            data = _apply_dtype_plan(data, runtime_variables, logger)
+            preview = disclosure_preview.preview(data, runtime_variables, logger)
+            logger.info("Preview: " + json.dumps(preview))
+            # Nothing is written, invoked or sent for a preview.
+            dispatcher.close()
+            return {"success": True, "preview": preview}
+
+        # The stages are given the key in place of the identifier columns, which are
+        # put back in the output.
+        identifiers = None
+        stage_variables = runtime_variables
+        if runtime_variables.get("surrogate_key"):
+            data, identifiers, stage_variables = surrogate_key.encode(
+                data, disclosure_stages, runtime_variables)
+            if identifiers is None:
+                logger.info("Kept the identifier columns, as the stages read them all")
+            else:
+                logger.info(f"Encoded {len(identifiers.columns)} identifier columns"
+                            f" into {surrogate_key.KEY}")
+
+        metrics["warmup"] = warmup.wait(time.perf_counter())
+        logger.info("Warmed up the stage lambdas: " + json.dumps(metrics["warmup"]))
+
+        decision = execution_planner.plan_execution(data, disclosure_stages,
+                                                    runtime_variables)
+        logger.info(f"Running in {decision.mode} mode: " + "; ".join(decision.reasons))
+        metrics["execution_mode"] = decision.mode
+
+        plan = stage_registry.compile_plan(
+            disclosure_stages,
+            execution_planner.stage_targets(decision.mode, disclosure_stages,
+                                            runtime_variables.get("stage_targets")))
+        stages_run = stage_registry.run_order(disclosure_stages)
+        if stages_run != disclosure_stages.split():
+            logger.info(f"Running the stages in the order {' '.join(stages_run)},"
+                        f" rather than as given ({disclosure_stages})")
+
+        if decision.mode == execution_planner.CHAINED:
+            _start_chain(data, plan, event["RuntimeVariables"], stage_variables,
+                         run_id, environment_variables, metrics, lambda_client, logger,
+                         identifiers)
+            chained = True
+            logger.info("Started the stages as a chain, which the finaliser completes")
+        else:
+            run_plan = functools.partial(
+                _run_plan, plan=plan, runtime_variables=stage_variables,
+                run_id=run_id, method_name=method_name, lambda_client=lambda_client,
+                logger=logger,
+                bucket_name=bucket_name if decision.mode == execution_planner.S3
+                else None)
+
+            if decision.mode == execution_planner.CHUNKED:
+                chunks = execution_planner.split_chunks(
+                    data, runtime_variables.get("grouping_columns"), decision.chunks)
+                logger.info(f"Split the data into {len(chunks)} chunks")
+                thresholds = execution_planner.get_thresholds(runtime_variables)
+                with ThreadPoolExecutor(max_workers=thresholds["max_concurrency"]) \
+                        as executor:
+                    outputs = list(executor.map(lambda chunk: run_plan(chunk[1]),
+                                                chunks))
+                output_dataframe = execution_planner.combine_chunks(
+                    outputs, [positions for positions, _ in chunks])
+            else:
+                output_dataframe = run_plan(data)
+
+            if decision.mode == execution_planner.S3:
+                s3_payload.remove(bucket_name, run_id)
+            if identifiers is not None:
+                output_dataframe = surrogate_key.decode(output_dataframe, identifiers)
+
+            _finish_run(output_dataframe, runtime_variables, bucket_name, metrics,
+                        logger, dispatcher)
 
-        data = aws_functions.read_dataframe_from_s3(bucket_name, in_file_name)
-        logger.info("Successfully retrieved data")
+    except Exception as e:
+        # The failure status follows the statuses already queued.
+        dispatcher.flush()
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+    finally:
+        if warmup is not None:
+            warmup.close()
+        if (len(error_message)) > 0:
+            dispatcher.close()
+            logger.error(error_message)
+            raise exception_classes.LambdaFailure(error_message)
 
-        formatted_data = data.to_json(orient="records")
+    if chained:
+        dispatcher.close()
+        logger.info("Successfully started the chain.")
+        return {"success": True, "chained": True}
 
-        disclosure_stages_list = disclosure_stages.split()
-        disclosure_stages_list.sort()
+    logger.info("Successfully completed module.")
 
-        generic_json_payload = {
-            "bpm_queue_url": bpm_queue_url,
-            "data": formatted_data,
-            "disclosivity_marker": disclosivity_marker,
-            "environment": environment,
-            "explanation": explanation,
-            "publishable_indicator": publishable_indicator,
-            "run_id": run_id,
-            "survey": survey,
-            "total_columns": total_columns,
-            "unique_identifier": unique_identifier
-        }
+    # Send end of method status to BPM.
+    status = "DONE"
+    dispatcher.submit(side_calls.BPM, aws_functions.send_bpm_status, bpm_queue_url,
+                      current_module, status, run_id, current_step_num, total_steps)
+    dispatcher.close()
 
-        stage1_payload = {
-            "cell_total_column": cell_total_column
-        }
+    return {"success": True}
 
-        stage2_payload = {
-            "parent_column": parent_column,
-            "threshold": threshold
-        }
 
-        stage3_payload = {
-        }
+@profiling.profiled("finaliser")
+def finalise_lambda_handler(event, context):
+    """
+    Completes a chained run once its last stage has handed off its output: writes the
+    outputs and sends the summary to SNS, as the wrangler does for other runs. A stage
+    which fails hands off its error instead, which is reported here.
+    :param event: JSON payload containing:
+    RuntimeVariables:{
+        The wrangler's RuntimeVariables, as for lambda_handler, with:
+        chain: The chain the run was started with (see stage_chain).
+        data_location: The s3 object holding the last stage's output, with
+            data_compression when it is compressed.
+        error: The error of the stage which failed, in place of data_location.
+        metrics: The metrics the wrangler gathered before starting the chain.
+    }
+    :param context: AWS Context Object.
+    :return final_output: {"success": True}, or raises LambdaFailure.
+    """
+    current_module = "Disclosure Finaliser"
+    error_message = ""
+    # Set-up variables for status message
+    current_step_num = 6
+    bpm_queue_url = None
+    chain = None
+    # Define run_id outside of try block
+    run_id = 0
+    try:
+        # Retrieve run_id before input validation
+        # Because it is used in exception handling
+        run_id = event["RuntimeVariables"]["run_id"]
+        chain = event["RuntimeVariables"][stage_chain.CHAIN]
 
-        stage4_payload = {
-        }
+        environment_variables = EnvironmentSchema().load(os.environ)
+        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+        if runtime_variables.get("grouping_levels"):
+            runtime_variables = geography_levels.cell_runtime_variables(
+                runtime_variables)
 
-        stage5_payload = {
-            "top1_column": top1_column,
-            "top2_column": top2_column,
-            "cell_total_column": cell_total_column,
-            "threshold": stage5_threshold
-        }
+        # Environment Variables
+        bucket_name = environment_variables["bucket_name"]
 
-        for disclosure_step in disclosure_stages_list:
+        # Runtime Variables
+        bpm_queue_url = runtime_variables["bpm_queue_url"]
+        environment = runtime_variables["environment"]
+        survey = runtime_variables["survey"]
+        total_steps = runtime_variables["total_steps"]
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        raise exception_classes.LambdaFailure(error_message)
 
-            payload_array = [generic_json_payload, stage1_payload, stage2_payload,
-                             stage3_payload, stage4_payload, stage5_payload]
+    try:
+        logger = general_functions.get_logger(survey, current_module, environment,
+                                              run_id)
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        raise exception_classes.LambdaFailure(error_message)
 
-            # Find the specific location where the stage number need to be inserted and
-            # constructs the relevant method name using the disclosure stage number.
-            index = method_name.find("-method")
-            lambda_name = method_name[:index] + disclosure_step + method_name[index:]
+    dispatcher = side_calls.Dispatcher(logger)
+    try:
+        logger.info("Started - retrieved configuration variables.")
+        stage_error = event["RuntimeVariables"].get("error")
+        if stage_error:
+            raise exception_classes.MethodFailure(stage_error)
+
+        output_dataframe = _to_dataframe(s3_payload.envelope(event["RuntimeVariables"]),
+                                         logger)
+        if surrogate_key.KEY in output_dataframe.columns:
+            identifiers = _to_dataframe(
+                {s3_payload.DATA_LOCATION: s3_payload.location(bucket_name, run_id,
+                                                               IDENTIFIERS)}, logger)
+            output_dataframe = surrogate_key.decode(output_dataframe, identifiers)
+        s3_payload.remove(bucket_name, run_id)
+
+        metrics = event["RuntimeVariables"].get("metrics") or {}
+        metrics["chain_seconds"] = round(time.time() - chain["started"], 3)
+        _finish_run(output_dataframe, runtime_variables, bucket_name, metrics, logger,
+                    dispatcher)
+        stage_chain.record_progress(chain, stage_chain.DONE)
 
-            # Combines the generic payload and the stage specific payload.
-            combined_input = {**payload_array[0], **(payload_array[int(disclosure_step)])}
-            combined_input = {"RuntimeVariables": combined_input}
+    except Exception as e:
+        dispatcher.flush()
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        stage_chain.record_progress(chain, stage_chain.FAILED, error=error_message)
+    finally:
+        if (len(error_message)) > 0:
+            dispatcher.close()
+            logger.error(error_message)
+            raise exception_classes.LambdaFailure(error_message)
 
-            formatted_data = invoke_method(lambda_name,
-                                           combined_input,
-                                           lambda_client)
+    logger.info("Successfully completed module.")
 
-            if not formatted_data["success"]:
-                raise exception_classes.MethodFailure(formatted_data["error"])
+    status = "DONE"
+    dispatcher.submit(side_calls.BPM, aws_functions.send_bpm_status, bpm_queue_url,
+                      current_module, status, run_id, current_step_num, total_steps)
+    dispatcher.close()
 
-            logger.info("Successfully invoked stage " + disclosure_step + " lambda")
+    return {"success": True}
 
-            # Located here as after the first loop it requires formatted data to be
-            # referenced with "data" and the JSON needs to be reset to use the right data.
-            generic_json_payload = {
-                "bpm_queue_url": bpm_queue_url,
-                "data": formatted_data["data"],
-                "disclosivity_marker": disclosivity_marker,
-                "environment": environment,
-                "explanation": explanation,
-                "publishable_indicator": publishable_indicator,
-                "run_id": run_id,
-                "survey": survey,
-                "total_columns": total_columns,
-                "unique_identifier": unique_identifier
-            }
 
-        aws_functions.save_to_s3(bucket_name, out_file_name, formatted_data["data"])
+def batch_lambda_handler(event, context):
+    """
+    Runs disclosure for many runs, e.g. every survey and period of a results cycle, in
+    a single invocation. The runs share the environment, the lambda client and the
+    loaded schemas, and up to max_concurrency of them run at once.
+    :param event: JSON payload containing:
+    RuntimeVariables:{
+        bpm_queue_url: Queue url to send the batch's BPM status message.
+        environment: The operating environment to use in the spp logger.
+        max_concurrency: Optional. The most runs to process at once, default 4.
+        run_id: The id of the batch.
+        runs: The RuntimeVariables of each run, as for lambda_handler, each with its
+            own run_id.
+        shared: Optional. RuntimeVariables shared by every run, which a run's own
+            RuntimeVariables override.
+        survey: The survey selected to be used in the logger.
+        total_steps: The total number of steps in the system.
+    }
+    :param context: AWS Context Object.
+    :return final_output: Dict containing:
+        {"success": <whether every run succeeded>,
+         "runs": [{"run_id": <run id>, "success": True} or
+                  {"run_id": <run id>, "success": False, "error": <error message>}]}
+        with one entry per run, in the order of runs.
+    """
+    current_module = "Disclosure Batch Wrangler"
+    error_message = ""
+    # Set-up variables for status message
+    current_step_num = 6
+    bpm_queue_url = None
+    # Define run_id outside of try block
+    run_id = 0
+    try:
+        # Retrieve run_id before input validation
+        # Because it is used in exception handling
+        run_id = event["RuntimeVariables"]["run_id"]
 
-        logger.info("Successfully sent data to s3")
+        environment_variables = EnvironmentSchema().load(os.environ)
+        batch_variables = BatchSchema().load(event["RuntimeVariables"])
 
-        output_data = formatted_data["data"]
+        # Runtime Variables
+        bpm_queue_url = batch_variables["bpm_queue_url"]
+        environment = batch_variables["environment"]
+        max_concurrency = batch_variables.get("max_concurrency", 4)
+        runs = batch_variables["runs"]
+        shared = batch_variables.get("shared", {})
+        survey = batch_variables["survey"]
+        total_steps = batch_variables["total_steps"]
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        raise exception_classes.LambdaFailure(error_message)
 
-        aws_functions.save_dataframe_to_csv(pd.read_json(output_data, dtype=False),
-                                            bucket_name, final_output_location)
+    try:
+        logger = general_functions.get_logger(survey, current_module, environment,
+                                              run_id)
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        raise exception_classes.LambdaFailure(error_message)
 
-        aws_functions.send_sns_message(sns_topic_arn, "Disclosure")
-        logger.info("Successfully sent message to sns")
+    dispatcher = side_calls.Dispatcher(logger)
+    try:
+        logger.info(f"Started - retrieved configuration variables for {len(runs)}"
+                    " runs.")
 
+        # Send start of method status to BPM once for the whole batch.
+        status = "IN PROGRESS"
+        dispatcher.submit(side_calls.BPM, aws_functions.send_bpm_status, bpm_queue_url,
+                          current_module, status, run_id, current_step_num, total_steps)
+
+        # Set up what the runs share.
+        lambda_client = boto3.client("lambda", "eu-west-2")
+        runtime_schema = RuntimeSchema()
+
+        run_events = [{"RuntimeVariables": {**shared, **run}} for run in runs]
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            results = list(executor.map(
+                lambda run_event: _run_batch_member(run_event, context,
+                                                    environment_variables,
+                                                    runtime_schema, lambda_client),
+                run_events))
+
+        failures = sum(not result["success"] for result in results)
+        logger.info(f"Completed {len(results)} runs, {failures} failed")
     except Exception as e:
+        dispatcher.flush()
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
                                                            bpm_queue_url=bpm_queue_url)
     finally:
         if (len(error_message)) > 0:
+            dispatcher.close()
             logger.error(error_message)
             raise exception_classes.LambdaFailure(error_message)
 
-    logger.info("Successfully completed module.")
+    logger.info("Successfully completed module: " + current_module)
 
-    # Send start of method status to BPM.
     status = "DONE"
-    aws_functions.send_bpm_status(bpm_queue_url, current_module, status, run_id,
-                                  current_step_num, total_steps)
+    dispatcher.submit(side_calls.BPM, aws_functions.send_bpm_status, bpm_queue_url,
+                      current_module, status, run_id, current_step_num, total_steps)
+    dispatcher.close()
 
-    return {"success": True}
+    return {"success": failures == 0, "runs": results}
+
+
+def _finish_run(output_dataframe, runtime_variables, bucket_name, metrics, logger,
+                dispatcher):
+    """
+    Writes a run's outputs in its layout and queues its summary to SNS.
+    :param output_dataframe: The output of the stages - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param bucket_name: The bucket to write to - Type: String
+    :param metrics: The run's metrics - Type: Dict
+    :param logger: The logger to report progress to.
+    :param dispatcher: The run's side calls - Type: side_calls.Dispatcher
+    """
+    out_file_name = runtime_variables["out_file_name"]
+
+    summary = disclosure_summary.summarise(output_dataframe, runtime_variables)
+    logger.info("Disclosure summary: " + json.dumps(summary))
+
+    output_dataframe = disclosure_layout.apply_layout(output_dataframe,
+                                                      runtime_variables)
+    identifiers = runtime_variables["unique_identifier"]
+    if runtime_variables.get("output_layout") == disclosure_layout.LONG:
+        # The long layout has a row per cell, so only the cells are indexed.
+        identifiers = []
+        logger.info("Converted the output to the long layout")
+
+    if runtime_variables.get("indexed_output"):
+        output_dataframe, output_json, index = disclosure_index.write_indexed(
+            output_dataframe, runtime_variables.get("grouping_columns"), identifiers,
+            runtime_variables.get("row_group_rows", 1000))
+        aws_functions.save_to_s3(bucket_name,
+                                 disclosure_index.index_file_name(out_file_name),
+                                 json.dumps(index))
+        logger.info(f"Indexed the output in {len(index['row_groups'])} row groups")
+    else:
+        output_json = output_dataframe.to_json(orient="records")
+
+    aws_functions.save_to_s3(bucket_name, out_file_name, output_json)
+
+    logger.info("Successfully sent data to s3")
+
+    aws_functions.save_dataframe_to_csv(output_dataframe, bucket_name,
+                                        runtime_variables["final_output_location"])
+
+    logger.info("Run metrics: " + json.dumps(metrics))
+    dispatcher.submit(side_calls.SNS, send_summary_message,
+                      runtime_variables["sns_topic_arn"], "Disclosure", summary, metrics)
+    logger.info("Queued the message to sns")
+
+
+def _start_chain(data, plan, event_runtime_variables, runtime_variables, run_id,
+                 environment_variables, metrics, lambda_client, logger,
+                 identifiers=None):
+    """
+    Starts a run's stages as a chain (see stage_chain) and returns without waiting.
+    The input is written to s3, and every stage is given the payload it will be
+    invoked with, so each can invoke the next with its output and the last can invoke
+    the finaliser.
+    :param data: The input data - Type: DataFrame
+    :param plan: The execution plan - Type: List of PlanStep
+    :param event_runtime_variables: The RuntimeVariables the wrangler was invoked
+                                    with, passed on to the finaliser - Type: Dict
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param run_id: The run id - Type: String
+    :param environment_variables: The loaded EnvironmentSchema - Type: Dict
+    :param metrics: The run's metrics so far - Type: Dict
+    :param lambda_client: The client to invoke the first stage with
+                          - Type: Service client
+    :param logger: The logger to report progress to.
+    :param identifiers: The identifier columns of each surrogate_key.KEY, written to
+                        s3 for the finaliser to restore - Type: DataFrame
+    """
+    bucket_name = environment_variables["bucket_name"]
+    finaliser_name = environment_variables.get("finaliser_name")
+    if not finaliser_name:
+        raise ValueError("The chained execution_mode needs the finaliser_name"
+                         " environment variable")
+
+    steps = []
+    for step in plan:
+        for stage in step.stages:
+            payload = stage_registry.build_payload(stage, runtime_variables, run_id,
+                                                   {})["RuntimeVariables"]
+            payload[s3_payload.OUTPUT_LOCATION] = s3_payload.location(
+                bucket_name, run_id, f"stage_{stage}_output")
+            steps.append({"stage": stage,
+                          "function_name": stage_registry.lambda_name(
+                              environment_variables["method_name"], stage),
+                          "payload": payload})
+    chain = stage_chain.build_chain(steps, finaliser_name,
+                                    dict(event_runtime_variables, metrics=metrics),
+                                    bucket_name, run_id)
+
+    envelope = payload_compression.pack(data.to_json(orient="records"),
+                                        runtime_variables.get("data_compression"),
+                                        runtime_variables.get("compression_level"),
+                                        logger)
+    envelope = s3_payload.store(envelope,
+                                s3_payload.location(bucket_name, run_id, "input"))
+    if identifiers is not None:
+        s3_payload.store({"data": identifiers.to_json(orient="records")},
+                         s3_payload.location(bucket_name, run_id, IDENTIFIERS))
+    stage_chain.start(chain, envelope, lambda_client)
+
+
+def _run_batch_member(run_event, context, environment_variables, runtime_schema,
+                      lambda_client):
+    """
+    Runs one run of a batch, turning its failure into a result so the other runs
+    carry on.
+    :return: {"run_id", "success"} and "error" if it failed - Type: Dict
+    """
+    result = {"run_id": run_event["RuntimeVariables"].get("run_id"), "success": True}
+    try:
+        run_disclosure(run_event, context, environment_variables, runtime_schema,
+                       lambda_client, send_status=False)
+    except Exception as e:
+        result["success"] = False
+        result["error"] = str(e) or type(e).__name__
+
+    return result
+
+
+def _run_plan(data, plan, runtime_variables, run_id, method_name, lambda_client,
+              logger, bucket_name=None):
+    """
+    Runs the steps of an execution plan on the data. Each stage is only given the rows
+    it can still change (see stage_registry.pending_rows), and a stage with none is
+    skipped; its output for those rows is patched back into the rest, so the result is
+    the same as running every stage on every row.
+    :param data: The input data - Type: DataFrame
+    :param plan: The execution plan - Type: List of PlanStep
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param run_id: The run id - Type: String
+    :param method_name: The method_name environment variable - Type: String
+    :param lambda_client: The client to invoke the stages with - Type: Service client
+    :param logger: The logger to report progress to.
+    :param bucket_name: The bucket to pass the data through, or None to send it in
+                        the payloads - Type: String
+    :return: The output - Type: DataFrame
+    """
+    # The plan is applied to the data the wrangler works on itself, as sending it to
+    # a stage lambda throws the dtypes away, and again after each such stage.
+    planned = False
+    # The last remote stage's output envelope, while the data is still all of it, so
+    # the next remote stage can be sent it without it being encoded again.
+    envelope = None
+    for step in plan:
+        for disclosure_step in step.stages:
+            if step.target == stage_registry.IN_PROCESS and not planned:
+                data = _apply_dtype_plan(data, runtime_variables, logger)
+                planned = True
+            rows = stage_registry.pending_rows(disclosure_step, data, runtime_variables)
+            if rows is not None and len(rows) == 0:
+                data = stage_registry.skip_stage(disclosure_step, data,
+                                                 runtime_variables)
+                envelope = None
+                logger.info("Skipped stage " + disclosure_step
+                            + " as it has no rows left to change")
+                continue
+            if rows is None:
+                stage_input = data
+            else:
+                stage_input = data.iloc[rows].reset_index(drop=True)
+                logger.info(f"Sending stage {disclosure_step} the {len(rows)} of"
+                            f" {len(data)} rows it can change")
+
+            if step.target == stage_registry.IN_PROCESS:
+                output = stage_registry.run_in_process(stage_input, runtime_variables,
+                                                       [disclosure_step], logger)
+                envelope = None
+            else:
+                envelope = _invoke_stage(
+                    envelope if rows is None and envelope is not None else stage_input,
+                    disclosure_step, runtime_variables, run_id, method_name,
+                    lambda_client, logger, bucket_name)
+                output = _to_dataframe(envelope, logger)
+                planned = False
+
+            if rows is None:
+                data = output
+            else:
+                data = stage_registry.patch_rows(disclosure_step, data, rows, output,
+                                                 runtime_variables)
+                envelope = None
+
+    return data
+
+
+def _apply_dtype_plan(data, runtime_variables, logger):
+    """
+    Applies the run's dtype plan to data the wrangler is about to work on.
+    :param data: The data - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param logger: The logger to report the memory saved to.
+    :return: The converted data - Type: DataFrame
+    """
+    data, memory_before, memory_after = dtype_plan.apply_dtype_plan(
+        data, dtype_plan.build_dtype_plan(runtime_variables))
+    logger.info(f"Applied dtype plan - memory usage reduced from {memory_before}"
+                f" to {memory_after} bytes")
+
+    return data
+
+
+def _invoke_stage(data, disclosure_step, runtime_variables, run_id, method_name,
+                  lambda_client, logger, bucket_name=None):
+    """
+    Runs a stage in its own lambda. The data is sent as the (possibly compressed) JSON
+    envelope from payload_compression.pack, which refers to s3 when a bucket_name is
+    given. A previous stage's output envelope is sent on as it is, only recompressed
+    when it is not in the run's data_compression.
+    :param data: The stage's input, or a previous stage's output envelope
+                 - Type: DataFrame/Dict
+    :param disclosure_step: The stage number - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param run_id: The run id - Type: String
+    :param method_name: The method_name environment variable - Type: String
+    :param lambda_client: The client to invoke the stages with - Type: Service client
+    :param logger: The logger to report progress to.
+    :param bucket_name: The bucket to pass the data through, or None to send it in
+                        the payload - Type: String
+    :return: The stage's output envelope, holding its data - Type: Dict
+    """
+    if isinstance(data, pd.DataFrame):
+        envelope = payload_compression.pack(data.to_json(orient="records"),
+                                            runtime_variables.get("data_compression"),
+                                            runtime_variables.get("compression_level"),
+                                            logger)
+    else:
+        envelope = payload_compression.repack(data,
+                                              runtime_variables.get("data_compression"),
+                                              runtime_variables.get("compression_level"),
+                                              logger)
+    if bucket_name:
+        envelope = s3_payload.store(
+            envelope, s3_payload.location(bucket_name, run_id,
+                                          f"stage_{disclosure_step}_input"))
+    payload = stage_registry.build_payload(disclosure_step, runtime_variables, run_id,
+                                           envelope)
+    if bucket_name:
+        payload["RuntimeVariables"][s3_payload.OUTPUT_LOCATION] = \
+            s3_payload.location(bucket_name, run_id, f"stage_{disclosure_step}_output")
+
+    formatted_data = invoke_method(
+        stage_registry.lambda_name(method_name, disclosure_step), payload,
+        lambda_client)
+
+    if not formatted_data["success"]:
+        raise exception_classes.MethodFailure(formatted_data["error"])
+
+    logger.info("Successfully invoked stage " + disclosure_step + " lambda")
+
+    return s3_payload.fetch(s3_payload.envelope(formatted_data))
+
+
+def _to_dataframe(data, logger):
+    """
+    Decodes the envelope _run_plan keeps the data of remote stages in.
+    :param data: The data - Type: DataFrame/Dict
+    :param logger: The logger to report decompression to.
+    :return: The data - Type: DataFrame
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+
+    return columnar_json.decode_records(
+        payload_compression.unpack(s3_payload.fetch(data), logger))
+
+
+def _warmup_stages(disclosure_stages, runtime_variables):
+    """
+    The stages worth warming up: those which may run in their own lambda.
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The stage numbers - Type: List
+    """
+    if not runtime_variables.get("warmup", True) or \
+            runtime_variables.get("preview") or \
+            runtime_variables.get("execution_mode") == execution_planner.IN_PROCESS:
+        return []
+    stage_targets = runtime_variables.get("stage_targets") or {}
+
+    return [stage for stage in disclosure_stages.split()
+            if stage_targets.get(stage, stage_registry.get_stage(stage).target)
+            == stage_registry.REMOTE]
+
+
+def send_summary_message(sns_topic_arn, module, summary, metrics=None):
+    """
+    Sends the completion message for a run to SNS, with the run's disclosure summary
+    so the results do not have to be downloaded to see what was suppressed.
+    :param sns_topic_arn: The topic to publish to - Type: String
+    :param module: The module which completed - Type: String
+    :param summary: The summary from disclosure_summary.summarise - Type: Dict
+    :param metrics: The run's metrics, e.g. how long the input took to read
+                    - Type: Dict
+    """
+    message = {"success": True, "module": module, "summary": summary}
+    if metrics is not None:
+        message["metrics"] = metrics
+    sns = boto3.client("sns", region_name="eu-west-2")
+    sns.publish(TargetArn=sns_topic_arn, Message=json.dumps(message))
 
 
 def invoke_method(lambda_execution_name, payload, lambda_client):
@@ -0,0 +1,96 @@
+import pandas as pd
+
+# Columns whose dtype is left exactly as loaded.
+EXACT = "exact"
+# Downcast integers and categorise low-cardinality strings.
+AUTO = "auto"
+CATEGORY = "category"
+
+
+def build_dtype_plan(runtime_variables, max_category_ratio=0.5):
+    """
+    Derives the dtype plan for a run from its runtime variables.
+    Identifier columns keep their exact dtype so joins on them stay cheap, and the
+    measure columns used in the disclosure calculations keep theirs so that arithmetic
+    on them can not overflow. Every other column is downcast where possible.
+    A survey can override the rule for any column through dtype_overrides, using
+    "exact", "auto", "category" or any dtype name pandas accepts (e.g. "Int64").
+    :param runtime_variables: The wrangler or stage runtime variables - Type: Dict
+    :param max_category_ratio: The largest ratio of distinct values to rows for which
+                               a string column is turned into a categorical.
+                               - Type: Float
+    :return: plan: {"columns": {column: rule}, "default": rule,
+                    "max_category_ratio": ratio} - Type: Dict
+    """
+    total_columns = runtime_variables.get("total_columns") or []
+    exact_columns = list(runtime_variables.get("unique_identifier") or [])
+    exact_columns += total_columns
+
+    cell_total_column = runtime_variables.get("cell_total_column")
+    if cell_total_column:
+        exact_columns += [cell_total_column + "_" + total_column
+                          for total_column in total_columns]
+
+    for contributor_column in ("top1_column", "top2_column"):
+        if runtime_variables.get(contributor_column):
+            exact_columns += [
+                total_column + "_" + runtime_variables[contributor_column]
+                for total_column in total_columns]
+
+    if runtime_variables.get("parent_column"):
+        exact_columns.append(runtime_variables["parent_column"])
+
+    columns = {column: EXACT for column in exact_columns}
+    columns.update(runtime_variables.get("dtype_overrides") or {})
+
+    return {
+        "columns": columns,
+        "default": AUTO,
+        "max_category_ratio": max_category_ratio
+    }
+
+
+def apply_dtype_plan(dataframe, dtype_plan):
+    """
+    Converts the columns of a dataframe according to a dtype plan.
+    Integer columns are only downcast to a dtype that holds every value, and float
+    columns are left alone under "auto" so no precision is lost.
+    :param dataframe: The data to convert - Type: DataFrame
+    :param dtype_plan: A plan from build_dtype_plan - Type: Dict
+    :return: converted dataframe, memory used before, memory used after (bytes)
+             - Type: Tuple(DataFrame, Int, Int)
+    """
+    memory_before = int(dataframe.memory_usage(deep=True).sum())
+    rules = dtype_plan["columns"]
+    converted = {}
+
+    for column in dataframe.columns:
+        rule = rules.get(column, dtype_plan["default"])
+        original = dataframe[column]
+        if rule == EXACT:
+            continue
+        elif rule == AUTO:
+            values = _downcast(original, dtype_plan["max_category_ratio"])
+        else:
+            values = original.astype(rule)
+        if values is not original:
+            converted[column] = values
+
+    if converted:
+        dataframe = dataframe.assign(**converted)
+
+    memory_after = int(dataframe.memory_usage(deep=True).sum())
+
+    return dataframe, memory_before, memory_after
+
+
+def _downcast(values, max_category_ratio):
+    if pd.api.types.is_bool_dtype(values):
+        return values
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast="integer")
+    if pd.api.types.is_object_dtype(values) and len(values) > 0 \
+            and pd.api.types.infer_dtype(values, skipna=True) == "string" \
+            and values.nunique() <= len(values) * max_category_ratio:
+        return values.astype(CATEGORY)
+    return values
@@ -0,0 +1,229 @@
+import collections
+import math
+
+import numpy as np
+import pandas as pd
+
+import group_numbers
+import payload_compression
+import stage_registry
+
+# Every stage runs in its own lambda with the data inline in the payload.
+INLINE = "inline"
+# Every stage runs in its own lambda with the data passed through s3.
+S3 = "s3"
+# Every stage runs inside the wrangler.
+IN_PROCESS = "in_process"
+# The data is split into chunks of whole cells, each run like INLINE, side by side.
+CHUNKED = "chunked"
+# Every stage runs in its own lambda, handing its output through s3 to the next, and
+# the wrangler returns once the first has started (see stage_chain). Only run when
+# forced, as the run then completes after the wrangler has returned.
+CHAINED = "chained"
+MODES = [INLINE, S3, IN_PROCESS, CHUNKED, CHAINED]
+AUTO = "auto"
+
+DEFAULT_THRESHOLDS = {
+    # Runs at most this big run in the wrangler rather than invoking the stages. Off
+    # by default, so auto only invokes the stages unless planner_thresholds sets it.
+    "in_process_max_rows": 0,
+    "in_process_max_bytes": 200 * 1024 * 1024,
+    # The largest payload to send inline, leaving room under the 6MB lambda limit.
+    "inline_max_bytes": 5 * 1024 * 1024,
+    # The payload size to aim for in each chunk.
+    "chunk_max_bytes": 4 * 1024 * 1024,
+    # The most chunks to run at once.
+    "max_concurrency": 8,
+    # The rows serialised to estimate the payload size.
+    "sample_rows": 1000
+}
+
+# rows, columns: The shape of the input.
+# memory_bytes: The input's size in memory.
+# payload_bytes: The estimated size of the data field of a stage payload.
+DataProfile = collections.namedtuple(
+    "DataProfile", ["rows", "columns", "memory_bytes", "payload_bytes"])
+
+# mode: One of MODES.
+# chunks: The number of chunks to split the data into in CHUNKED mode, otherwise 1.
+# reasons: Why the mode was chosen, to be logged - Type: List of String
+# profile: The DataProfile the decision was made on.
+ExecutionDecision = collections.namedtuple(
+    "ExecutionDecision", ["mode", "chunks", "reasons", "profile"])
+
+
+def get_thresholds(runtime_variables):
+    """
+    The planner thresholds, with the planner_thresholds runtime variable applied over
+    DEFAULT_THRESHOLDS.
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: thresholds - Type: Dict
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for name, value in (runtime_variables.get("planner_thresholds") or {}).items():
+        if name not in DEFAULT_THRESHOLDS:
+            raise ValueError(f"Unknown planner threshold {name}")
+        thresholds[name] = value
+
+    return thresholds
+
+
+def profile_data(data, runtime_variables, sample_rows=1000):
+    """
+    Measures the input the mode is chosen on. The payload size is estimated from an
+    evenly spaced sample of the rows, compressed as it would be sent when
+    data_compression is given, rather than by serialising all of the data.
+    :param data: The input data - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param sample_rows: The number of rows to serialise - Type: Int
+    :return: profile - Type: DataProfile
+    """
+    rows = len(data)
+    memory_bytes = int(data.memory_usage(index=False, deep=True).sum())
+    if rows == 0:
+        return DataProfile(rows, len(data.columns), memory_bytes, 2)
+
+    sample = data.iloc[::max(1, rows // sample_rows)]
+    sample_bytes = len(payload_compression.pack(
+        sample.to_json(orient="records"),
+        runtime_variables.get("data_compression"),
+        runtime_variables.get("compression_level"))["data"])
+
+    return DataProfile(rows, len(data.columns), memory_bytes,
+                       int(math.ceil(sample_bytes * rows / len(sample))))
+
+
+def chunkable(disclosure_stages):
+    """
+    Whether a run's stages can run on chunks of whole cells, which is so unless a
+    stage needs the whole table, like stage 4.
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :return: Boolean
+    """
+    return all(stage_registry.get_stage(stage).scope != stage_registry.TABLE
+               for stage in disclosure_stages.split())
+
+
+def choose_mode(profile, disclosure_stages, runtime_variables):
+    """
+    Chooses how a run is executed: in process when it is small, with inline payloads
+    when they fit, in chunks when the stages allow it, and through s3 otherwise. The
+    execution_mode runtime variable forces a mode.
+    :param profile: The input's profile - Type: DataProfile
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: decision - Type: ExecutionDecision
+    """
+    thresholds = get_thresholds(runtime_variables)
+    chunks = max(1, int(math.ceil(profile.payload_bytes
+                                  / thresholds["chunk_max_bytes"])))
+    reasons = [f"{profile.rows} rows, {profile.columns} columns,"
+               f" {profile.memory_bytes} bytes in memory, an estimated"
+               f" {profile.payload_bytes} byte payload"]
+
+    execution_mode = runtime_variables.get("execution_mode") or AUTO
+    if execution_mode != AUTO:
+        if execution_mode not in MODES:
+            raise ValueError(f"Unknown execution_mode {execution_mode}")
+        if execution_mode == CHUNKED and not chunkable(disclosure_stages):
+            raise ValueError(f"Stages {disclosure_stages} can not run in chunks as a"
+                             f" stage needs the whole table")
+        reasons.append(f"execution_mode is forced to {execution_mode}")
+        return ExecutionDecision(execution_mode,
+                                 chunks if execution_mode == CHUNKED else 1,
+                                 reasons, profile)
+
+    if profile.rows <= thresholds["in_process_max_rows"] \
+            and profile.memory_bytes <= thresholds["in_process_max_bytes"]:
+        reasons.append(f"at most {thresholds['in_process_max_rows']} rows and"
+                       f" {thresholds['in_process_max_bytes']} bytes, so the stages"
+                       f" run in the wrangler")
+        return ExecutionDecision(IN_PROCESS, 1, reasons, profile)
+
+    if profile.payload_bytes <= thresholds["inline_max_bytes"]:
+        reasons.append(f"the payload fits in {thresholds['inline_max_bytes']} bytes,"
+                       f" so it is sent inline")
+        return ExecutionDecision(INLINE, 1, reasons, profile)
+
+    if chunkable(disclosure_stages):
+        reasons.append(f"the payload is over {thresholds['inline_max_bytes']} bytes"
+                       f" and the stages work on whole cells, so it is split into"
+                       f" {chunks} chunks")
+        return ExecutionDecision(CHUNKED, chunks, reasons, profile)
+
+    reasons.append(f"the payload is over {thresholds['inline_max_bytes']} bytes and a"
+                   f" stage needs the whole table, so it is passed through s3")
+    return ExecutionDecision(S3, 1, reasons, profile)
+
+
+def plan_execution(data, disclosure_stages, runtime_variables):
+    """
+    Profiles the input and chooses the mode to run it in.
+    :param data: The input data - Type: DataFrame
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: decision - Type: ExecutionDecision
+    """
+    profile = profile_data(data, runtime_variables,
+                           get_thresholds(runtime_variables)["sample_rows"])
+    return choose_mode(profile, disclosure_stages, runtime_variables)
+
+
+def stage_targets(mode, disclosure_stages, stage_targets=None):
+    """
+    The stage_targets to compile the plan with in a mode. In process mode runs every
+    stage in the wrangler and chained mode runs every stage in its own lambda; the
+    other modes keep the run's own stage_targets.
+    :param mode: One of MODES - Type: String
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param stage_targets: The run's stage_targets - Type: Dict
+    :return: stage_targets - Type: Dict
+    """
+    if mode == IN_PROCESS:
+        return {stage: stage_registry.IN_PROCESS for stage in disclosure_stages.split()}
+    if mode == CHAINED:
+        return {stage: stage_registry.REMOTE for stage in disclosure_stages.split()}
+
+    return stage_targets
+
+
+def split_chunks(data, grouping_columns, chunks):
+    """
+    Splits the data into chunks of about the same number of rows, keeping the rows of
+    each cell together when grouping_columns is given.
+    :param data: The input data - Type: DataFrame
+    :param grouping_columns: The columns which identify a cell - Type: List
+    :param chunks: The number of chunks - Type: Int
+    :return: (positions, chunk) for each non empty chunk, where positions are the rows'
+             positions in data - Type: List of (Numpy Array, DataFrame)
+    """
+    rows = len(data)
+    if grouping_columns:
+        cell_of_row = group_numbers.number_groups(data, grouping_columns)
+        cell_rows = np.bincount(cell_of_row)
+        # Each cell goes to the chunk its first row would be in if rows were split
+        # evenly, so the chunks stay close in size.
+        cell_starts = np.cumsum(cell_rows) - cell_rows
+        chunk_of_row = (cell_starts * chunks // max(rows, 1))[cell_of_row]
+    else:
+        chunk_of_row = np.arange(rows) * chunks // max(rows, 1)
+
+    order = np.argsort(chunk_of_row, kind="stable")
+    bounds = np.searchsorted(chunk_of_row[order], np.arange(chunks + 1))
+    return [(order[start:end], data.iloc[order[start:end]].reset_index(drop=True))
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def combine_chunks(outputs, positions):
+    """
+    Reverses split_chunks on the chunks' outputs.
+    :param outputs: The output of each chunk - Type: List of DataFrame
+    :param positions: The positions returned by split_chunks - Type: List
+    :return: The output in the order of the input - Type: DataFrame
+    """
+    if not outputs:
+        return pd.DataFrame()
+    combined = pd.concat(outputs, ignore_index=True, sort=False)
+    order = np.argsort(np.concatenate(positions), kind="stable")
+
+    return combined.iloc[order].reset_index(drop=True)
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+import contributor_topk
+import group_numbers
+
+# The column of the cell table naming the level each cell belongs to.
+LEVEL = "level"
+
+# The stages which can disclose the cell table: those which only read a cell's
+# aggregates. Stage 3 needs the contributions of each responder, and stage 4 the
+# table of one level.
+LEVEL_STAGES = ["1", "2", "5"]
+
+
+def level_columns(grouping_levels):
+    """
+    Lists the columns of every level, in the order they are first named.
+    :param grouping_levels: {level: the columns which identify its cells} - Type: Dict
+    :return: The columns - Type: List
+    """
+    columns = []
+    for grouping_columns in grouping_levels.values():
+        columns += [column for column in grouping_columns if column not in columns]
+
+    return columns
+
+
+def cell_identifier(grouping_levels):
+    """
+    The columns which identify a row of the cell table: its level, and the columns of
+    every level, which are missing for the levels which do not use them.
+    :param grouping_levels: {level: the columns which identify its cells} - Type: Dict
+    :return: The columns - Type: List
+    """
+    return [LEVEL] + level_columns(grouping_levels)
+
+
+def cell_runtime_variables(runtime_variables):
+    """
+    The runtime variables of a run disclosing the cell table, in which each row is a
+    cell, identified by cell_identifier.
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The runtime variables - Type: Dict
+    """
+    identifier = cell_identifier(runtime_variables["grouping_levels"])
+
+    return dict(runtime_variables, unique_identifier=identifier,
+                grouping_columns=identifier)
+
+
+def build_cells(data, runtime_variables, logger=None):
+    """
+    Builds the aggregates each of the stages in LEVEL_STAGES reads for the cells of
+    every level in grouping_levels, so one run discloses them all. The responders are
+    grouped once, into the cells of every level's columns together, and each level's
+    cells are then built from those, so the cost of each level grows with the number
+    of cells rather than of responders. The levels need not nest.
+    Each cell has, for every total column, its total ({cell_total_column}_{total}) and
+    largest contributors ({total}_{top1_column}, {total}_{top2_column}), and, when
+    stage 2 runs, the number of distinct parent_reference_column values
+    ({parent_column}).
+    :param data: Responder level data, one row per contributor - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param logger: The logger to report progress to.
+    :return: The cell table, one row per cell, the levels in the order given and
+             their cells sorted - Type: DataFrame
+    """
+    grouping_levels = runtime_variables["grouping_levels"]
+    total_columns = runtime_variables["total_columns"]
+    stages = runtime_variables["disclosure_stages"].split()
+    unsupported = [stage for stage in stages if stage not in LEVEL_STAGES]
+    if unsupported:
+        raise ValueError(f"Stage {', '.join(unsupported)} can not be run with"
+                         f" grouping_levels, only stages {', '.join(LEVEL_STAGES)}")
+    if not grouping_levels or not all(grouping_levels.values()):
+        raise ValueError("Every level in grouping_levels needs grouping columns")
+    columns = level_columns(grouping_levels)
+    if LEVEL in columns:
+        raise ValueError(f"{LEVEL} can not be a level's grouping column")
+    parent_reference = None
+    if "2" in stages:
+        parent_reference = runtime_variables.get("parent_reference_column")
+        if not parent_reference:
+            raise ValueError("Stage 2 with grouping_levels requires the runtime"
+                             " variable 'parent_reference_column'")
+
+    needed = columns + total_columns + ([parent_reference] if parent_reference else [])
+    missing = [column for column in needed if column not in data.columns]
+    if missing:
+        raise ValueError(f"Columns {missing} are needed for grouping_levels but are"
+                         " not in the data")
+
+    # The finest cells, those of every level's columns together.
+    contributors = contributor_topk.top_contributors(data, columns, total_columns)
+    _, first_rows = np.unique(contributors.cell_of_row, return_index=True)
+    finest = data[columns].iloc[first_rows].reset_index(drop=True)
+    if parent_reference:
+        parents = pd.DataFrame({"cell": contributors.cell_of_row,
+                                "parent": data[parent_reference].to_numpy()})\
+            .drop_duplicates()
+    if logger:
+        logger.info(f"Grouped {len(data)} responders into {len(finest)} cells")
+
+    levels = []
+    for level, grouping_columns in grouping_levels.items():
+        cell_of_finest = _number_cells(finest, grouping_columns)
+        cell_count = int(cell_of_finest.max()) + 1 if len(cell_of_finest) else 0
+        _, first_cells = np.unique(cell_of_finest, return_index=True)
+
+        cells = {LEVEL: np.full(cell_count, level, dtype=object)}
+        for column in columns:
+            cells[column] = finest[column].to_numpy()[first_cells] \
+                if column in grouping_columns else np.full(cell_count, None)
+        top = contributor_topk.merge_top(cell_of_finest, contributors.top, cell_count)
+        for column_index, total_column in enumerate(total_columns):
+            cells[f"{runtime_variables['cell_total_column']}_{total_column}"] = \
+                np.bincount(cell_of_finest,
+                            weights=contributors.totals[:, column_index],
+                            minlength=cell_count)
+            cells[f"{total_column}_{runtime_variables['top1_column']}"] = \
+                top[:, column_index, 0]
+            cells[f"{total_column}_{runtime_variables['top2_column']}"] = \
+                top[:, column_index, 1]
+        if parent_reference:
+            level_parents = pd.DataFrame({"cell": cell_of_finest[parents["cell"]],
+                                          "parent": parents["parent"].to_numpy()})\
+                .drop_duplicates()
+            cells[runtime_variables["parent_column"]] = np.bincount(
+                level_parents["cell"], minlength=cell_count)
+        levels.append(pd.DataFrame(cells))
+
+        if logger:
+            logger.info(f"Built the {cell_count} cells of level {level}")
+
+    return pd.concat(levels, ignore_index=True)
+
+
+def _number_cells(cells, grouping_columns):
+    """
+    Numbers the cells of a level in sorted order, missing values last. Grouping with
+    sort=True does not sort mixed categorical and object columns consistently, so the
+    cells are sorted first and numbered in the order they appear.
+    :param cells: The finest cells - Type: DataFrame
+    :param grouping_columns: The columns which identify a cell of the level - Type: List
+    :return: The level cell of each finest cell - Type: Numpy Array
+    """
+    sorted_cells = cells[grouping_columns].sort_values(grouping_columns, kind="mergesort")
+    numbers = pd.Series(group_numbers.number_groups(sorted_cells, grouping_columns),
+                        index=sorted_cells.index)
+
+    return numbers.reindex(cells.index).to_numpy()
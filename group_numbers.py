@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+
+def number_groups(data, columns):
+    """
+    Numbers the distinct combinations of values in the columns in the order they first
+    appear, with missing values a value of their own, like
+    groupby(columns, sort=False, dropna=False, observed=True).ngroup() on pandas
+    versions which have no dropna.
+    :param data: The data - Type: DataFrame
+    :param columns: The columns whose values make up a group - Type: List
+    :return: The group of each row - Type: Numpy Array
+    """
+    numbers = np.zeros(len(data), dtype=np.int64)
+    for column in columns:
+        # Missing values are coded -1, so shifting the codes keeps them a group.
+        codes = pd.factorize(data[column], sort=False)[0].astype(np.int64) + 1
+        if len(codes):
+            numbers = pd.factorize(numbers * (codes.max() + 1) + codes,
+                                   sort=False)[0].astype(np.int64)
+
+    return numbers
@@ -0,0 +1,136 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+import stage_registry
+
+# The identifiers of at most this many offending rows are listed in each problem.
+EXAMPLE_ROWS = 5
+
+
+def required_columns(disclosure_stages, runtime_variables, columns):
+    """
+    Works out the columns a run needs in its input from the columns its stages read,
+    less those an earlier stage writes. A column a stage can work out from others
+    (see StageSpec.derived) is only needed if it can not.
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param columns: The columns of the input - Type: Index/List
+    :return: {column: the stages which read it} in the order found, starting with the
+             unique_identifier, which every stage needs, and the columns the stages
+             write - Type: (OrderedDict, Set)
+    """
+    columns = set(columns)
+    required = collections.OrderedDict(
+        (column, []) for column in runtime_variables["unique_identifier"])
+    written = set()
+    for step in stage_registry.compile_plan(disclosure_stages):
+        for stage in step.stages:
+            spec = stage_registry.get_stage(stage)
+            reads = []
+            for total_column in runtime_variables["total_columns"]:
+                for template in spec.reads:
+                    sources = (spec.derived or {}).get(template)
+                    column = template.format(total_column=total_column,
+                                             **runtime_variables)
+                    if sources and column not in columns and \
+                            runtime_variables.get("grouping_columns"):
+                        reads.extend(source.format(total_column=total_column,
+                                                   **runtime_variables)
+                                     for source in sources)
+                        reads.extend(runtime_variables["grouping_columns"])
+                    else:
+                        reads.append(column)
+            if spec.grouped:
+                reads.extend(runtime_variables.get("grouping_columns") or [])
+            for column in reads:
+                if column not in written:
+                    required.setdefault(column, [])
+                    if stage not in required[column]:
+                        required[column].append(stage)
+            written.update(stage_registry.stage_columns(stage, runtime_variables,
+                                                        "writes"))
+
+    return required, written
+
+
+def _examples(data, rows, runtime_variables):
+    identifiers = data[runtime_variables["unique_identifier"]]\
+        .iloc[np.flatnonzero(rows)[:EXAMPLE_ROWS]]
+    return ", ".join(str(list(identifier))
+                     for identifier in identifiers.itertuples(index=False))
+
+
+def find_problems(data, disclosure_stages, runtime_variables):
+    """
+    Checks the input of a run in one pass before any stage runs, so every problem is
+    found at once rather than as a KeyError inside a stage. It checks the stages'
+    parameters are given, the columns they read are present, the numeric ones are
+    numeric, and none of the totals are missing or negative.
+    :param data: The input - Type: DataFrame
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The problems found - Type: List of String
+    """
+    problems = []
+    stages = disclosure_stages.split()
+    for stage in stages:
+        try:
+            stage_registry.in_process_arguments(stage, runtime_variables)
+        except ValueError as e:
+            problems.append(str(e))
+    if problems:
+        return problems
+
+    required, written = required_columns(disclosure_stages, runtime_variables,
+                                         data.columns)
+    missing = [column for column in required if column not in data.columns]
+    for column in missing:
+        readers = f"read by stage {', '.join(required[column])}" if required[column] \
+            else "the unique_identifier"
+        problems.append(f"Column {column}, {readers}, is missing")
+    if any(column in missing for column in runtime_variables["unique_identifier"]):
+        return problems
+
+    # The disclosure markers, which a run of later stages alone reads from its input,
+    # and the identifiers hold text; every other column the stages read is a count or
+    # a total.
+    text_columns = written | set(runtime_variables["unique_identifier"]) | \
+        set(runtime_variables.get("grouping_columns") or [])
+    text_columns.update(
+        template.format(total_column=total_column, **runtime_variables)
+        for total_column in runtime_variables["total_columns"]
+        for template in stage_registry.DISCLOSURE_OUTPUT_COLUMNS)
+    numeric = [column for column in required
+               if column not in missing and column not in text_columns]
+    mistyped = [column for column in numeric
+                if not pd.api.types.is_numeric_dtype(data[column])
+                or pd.api.types.is_bool_dtype(data[column])]
+    for column in mistyped:
+        problems.append(f"Column {column} is {data[column].dtype}, not numeric")
+
+    checked = [column for column in numeric if column not in mistyped]
+    if checked:
+        values = data[checked]
+        for name, bad in [("missing", values.isna()), ("negative", values < 0)]:
+            counts = bad.sum()
+            for column in counts[counts > 0].index:
+                problems.append(
+                    f"Column {column} has {counts[column]} {name} values, e.g. for"
+                    f" {_examples(data, bad[column].to_numpy(), runtime_variables)}")
+
+    return problems
+
+
+def validate(data, disclosure_stages, runtime_variables):
+    """
+    Raises if the input of a run has any of the problems find_problems looks for.
+    :param data: The input - Type: DataFrame
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    """
+    problems = find_problems(data, disclosure_stages, runtime_variables)
+    if problems:
+        raise ValueError(f"The input has {len(problems)} problems: "
+                         + "; ".join(problems))
@@ -0,0 +1,87 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pandas as pd
+from botocore.config import Config
+
+import columnar_json
+
+# Where the parts of a multi-part input are listed: every object under in_file_name
+# as a prefix, in key order, or the keys in the manifest in_file_name, in its order.
+PREFIX = "prefix"
+MANIFEST = "manifest"
+PART_SOURCES = [PREFIX, MANIFEST]
+
+# The parts read at once, each on its own connection, unless read_concurrency says
+# otherwise.
+READ_CONCURRENCY = 8
+
+
+def list_parts(bucket_name, in_file_name, input_parts, s3_client):
+    """
+    Finds the keys of the parts of an input, in the order they are concatenated.
+    :param bucket_name: The bucket - Type: String
+    :param in_file_name: The prefix of the parts, or the key of their manifest, a JSON
+                         list of keys or {"parts": [keys]} - Type: String
+    :param input_parts: PREFIX or MANIFEST - Type: String
+    :param s3_client: The client to read with - Type: Service client
+    :return: The keys - Type: List
+    """
+    if input_parts == MANIFEST:
+        manifest = json.loads(s3_client.get_object(Bucket=bucket_name,
+                                                   Key=in_file_name)["Body"].read())
+        keys = manifest["parts"] if isinstance(manifest, dict) else manifest
+    elif input_parts == PREFIX:
+        keys = []
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=in_file_name):
+            # Skip the placeholders some tools write for folders.
+            keys += [s3_object["Key"] for s3_object in page.get("Contents", [])
+                     if not s3_object["Key"].endswith("/")]
+        keys.sort()
+    else:
+        raise ValueError(f"input_parts must be one of {PART_SOURCES}, not {input_parts}")
+
+    if not keys:
+        raise ValueError(f"No input parts found for {input_parts} {in_file_name}")
+
+    return keys
+
+
+def read_parts(bucket_name, in_file_name, input_parts, concurrency=READ_CONCURRENCY,
+               s3_client=None, logger=None):
+    """
+    Reads an input written as several parts, each record-oriented JSON like
+    in_file_name, fetching and decoding up to concurrency of them at once on a thread
+    pool, rather than reading one large object on a single stream. The parts are
+    concatenated in the order of list_parts, whichever finishes first.
+    :param bucket_name: The bucket - Type: String
+    :param in_file_name: The prefix of the parts, or the key of their manifest
+                         - Type: String
+    :param input_parts: PREFIX or MANIFEST - Type: String
+    :param concurrency: The most parts read at once - Type: Int
+    :param s3_client: The client to read with, by default one with a connection for
+                      each part read at once - Type: Service client
+    :param logger: The logger to report progress to.
+    :return: The input - Type: DataFrame
+    """
+    if s3_client is None:
+        s3_client = boto3.client("s3", region_name="eu-west-2",
+                                 config=Config(max_pool_connections=concurrency))
+    keys = list_parts(bucket_name, in_file_name, input_parts, s3_client)
+
+    def read_part(key):
+        body = s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+        return columnar_json.decode_records(body)
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(keys))) as executor:
+        parts = list(executor.map(read_part, keys))
+    # An empty part has no columns, which would turn every column to object.
+    parts = [part for part in parts if len(part.columns)] or parts[:1]
+    data = pd.concat(parts, ignore_index=True, sort=False)
+
+    if logger:
+        logger.info(f"Read {len(data)} rows from {len(keys)} parts")
+
+    return data
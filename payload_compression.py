@@ -0,0 +1,121 @@
+import base64
+import bz2
+import gzip
+import lzma
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The payload field naming the codec the data field is compressed with. A stage which
+# receives compressed data compresses its output with the same codec.
+DATA_COMPRESSION = "data_compression"
+
+# codec: (compress(bytes, level), decompress(bytes), default level)
+CODECS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress, 6),
+    "gzip": (lambda data, level: gzip.compress(data, level), gzip.decompress, 6),
+    "bz2": (lambda data, level: bz2.compress(data, level), bz2.decompress, 9),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 6),
+}
+if zstandard is not None:
+    CODECS["zstd"] = (
+        lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data), 3)
+
+
+def _get_codec(codec):
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError(f"Unknown data_compression codec {codec}")
+
+
+def compress(data, codec, level=None):
+    """
+    Compresses JSON data into base64 text, so it can travel in a JSON payload.
+    :param data: The data - Type: String
+    :param codec: A key of CODECS - Type: String
+    :param level: The compression level, or None for the codec's default - Type: Int
+    :return: The compressed data - Type: String
+    """
+    compressor, _, default_level = _get_codec(codec)
+    compressed = compressor(data.encode("UTF-8"),
+                            default_level if level is None else level)
+    return base64.b64encode(compressed).decode("ascii")
+
+
+def decompress(data, codec):
+    """
+    Reverses compress.
+    :param data: The compressed data - Type: String
+    :param codec: The codec it was compressed with - Type: String
+    :return: The data - Type: String
+    """
+    _, decompressor, _ = _get_codec(codec)
+    return decompressor(base64.b64decode(data)).decode("UTF-8")
+
+
+def pack(data, codec=None, level=None, logger=None):
+    """
+    Wraps JSON data in the fields a payload or stage response carries it in,
+    compressing it when a codec is given.
+    :param data: The data - Type: String
+    :param codec: A key of CODECS, or None to send the data as it is - Type: String
+    :param level: The compression level, or None for the codec's default - Type: Int
+    :param logger: The logger to report the compression ratio and time to.
+    :return: {"data"} and, when compressed, {"data_compression"} - Type: Dict
+    """
+    if not codec:
+        return {"data": data}
+
+    start = time.perf_counter()
+    compressed = compress(data, codec, level)
+    if logger is not None:
+        ratio = len(data) / max(len(compressed), 1)
+        logger.info(f"Compressed data with {codec} from {len(data)} to"
+                    f" {len(compressed)} bytes ({ratio:.1f}x) in"
+                    f" {time.perf_counter() - start:.3f}s")
+
+    return {"data": compressed, DATA_COMPRESSION: codec}
+
+
+def unpack(envelope, logger=None):
+    """
+    Takes the JSON data out of a payload or stage response, decompressing it if the
+    envelope names a codec.
+    :param envelope: A Dict holding "data" and optionally "data_compression".
+    :param logger: The logger to report the decompression time to.
+    :return: The data - Type: String
+    """
+    codec = envelope.get(DATA_COMPRESSION)
+    if not codec:
+        return envelope["data"]
+
+    start = time.perf_counter()
+    data = decompress(envelope["data"], codec)
+    if logger is not None:
+        logger.info(f"Decompressed {codec} data from {len(envelope['data'])} to"
+                    f" {len(data)} bytes in {time.perf_counter() - start:.3f}s")
+
+    return data
+
+
+def repack(envelope, codec=None, level=None, logger=None):
+    """
+    Makes sure an envelope's data is compressed with the given codec, passing it on
+    untouched when it already is, e.g. between two remote stages.
+    :param envelope: A Dict holding "data" and optionally "data_compression".
+    :param codec: A key of CODECS, or None for uncompressed data - Type: String
+    :param level: The compression level, or None for the codec's default - Type: Int
+    :param logger: The logger to report the compression ratio and time to.
+    :return: {"data"} and, when compressed, {"data_compression"} - Type: Dict
+    """
+    if (envelope.get(DATA_COMPRESSION) or None) == (codec or None):
+        return {key: envelope[key] for key in ("data", DATA_COMPRESSION)
+                if key in envelope}
+
+    return pack(unpack(envelope, logger), codec, level, logger)
@@ -0,0 +1,207 @@
+import collections
+import contextlib
+import cProfile
+import functools
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+import boto3
+
+# A deterministic profile of every call, written as a pstats file (.prof), which
+# pstats, snakeviz and similar tools read.
+CPROFILE = "cprofile"
+# Stacks sampled every SAMPLE_INTERVAL seconds, written as folded stacks (.folded),
+# which flamegraph.pl and speedscope read.
+SAMPLING = "sampling"
+PROFILERS = [CPROFILE, SAMPLING]
+
+SAMPLE_INTERVAL = 0.005
+# The frames kept of each allocation's traceback.
+ALLOCATION_FRAMES = 10
+
+PREFIX = "disclosure-profiles/"
+
+
+def profile_location(bucket_name, run_id, name):
+    """
+    The s3 key, less its extension, of a profile of one invocation. Each invocation
+    has its own, as a stage may be invoked many times in a run.
+    :param bucket_name: The bucket - Type: String
+    :param run_id: The run id - Type: String
+    :param name: What was profiled e.g. "stage_1" - Type: String
+    :return: {"bucket", "key"} - Type: Dict
+    """
+    return {"bucket": bucket_name,
+            "key": f"{PREFIX}{run_id}/{name}-{uuid.uuid4().hex[:8]}"}
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _fold(counts):
+    return "".join(f"{stack} {count}\n" for stack, count in counts.items())
+
+
+class _Sampler:
+    """
+    Samples the stack of every other thread from a background thread.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+
+
+class Capture:
+    """
+    Profiles the code run inside it, then writes the profile to s3. Writing the
+    profile never raises, as a failed capture should not fail the invocation.
+    """
+
+    def __init__(self, profiler, allocations, bucket_name, run_id, name,
+                 s3_client=None):
+        """
+        :param profiler: One of PROFILERS, or None - Type: String
+        :param allocations: Whether to trace allocations - Type: Boolean
+        :param bucket_name: The bucket to write to - Type: String
+        :param run_id: The run id - Type: String
+        :param name: What is profiled e.g. "stage_1" - Type: String
+        :param s3_client: The client to write with - Type: Service client
+        """
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler}")
+        self.profiler = profiler
+        self.allocations = allocations
+        self.location = profile_location(bucket_name, run_id, name)
+        self.s3_client = s3_client
+        # The s3 keys written.
+        self.keys = []
+        self._profile = None
+        self._sampler = None
+
+    def __enter__(self):
+        if self.allocations:
+            tracemalloc.start(ALLOCATION_FRAMES)
+        if self.profiler == CPROFILE:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.profiler == SAMPLING:
+            self._sampler = _Sampler()
+            self._sampler.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._started
+        files = {}
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.create_stats()
+            # The format of pstats.Stats.dump_stats.
+            files[".prof"] = marshal.dumps(self._profile.stats)
+        if self._sampler is not None:
+            self._sampler.stop()
+            files[".folded"] = _fold(self._sampler.counts).encode("UTF-8")
+        if self.allocations:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            # Folded stacks weighted by the bytes still allocated, with the peak
+            # recorded as a stack of its own.
+            counts = collections.Counter({"peak": peak})
+            for statistic in snapshot.statistics("traceback"):
+                stack = ";".join(f"{os.path.basename(frame.filename)}:{frame.lineno}"
+                                 for frame in statistic.traceback)
+                counts[stack] += statistic.size
+            files[".allocations.folded"] = _fold(counts).encode("UTF-8")
+
+        try:
+            s3_client = self.s3_client or boto3.client("s3", region_name="eu-west-2")
+            for extension, body in files.items():
+                key = self.location["key"] + extension
+                s3_client.put_object(Bucket=self.location["bucket"], Key=key,
+                                     Body=body)
+                self.keys.append(key)
+            logging.info(f"Wrote the profile of {seconds:.3f}s to {self.keys}")
+        except Exception as e:
+            logging.warning(f"Could not write the profile: {e}")
+
+
+def capture(runtime_variables, bucket_name, run_id, name):
+    """
+    Profiles the code run inside it when the runtime variables ask for it.
+    :param runtime_variables: Holding "profile", one of PROFILERS, and
+                              "profile_allocations", whether to trace allocations
+                              - Type: Dict
+    :param bucket_name: The bucket to write to - Type: String
+    :param run_id: The run id - Type: String
+    :param name: What is profiled e.g. "stage_1" - Type: String
+    :return: A Capture, or a context which does nothing when profiling is off.
+    """
+    profiler = runtime_variables.get("profile")
+    allocations = bool(runtime_variables.get("profile_allocations"))
+    if not profiler and not allocations:
+        return contextlib.nullcontext()
+
+    return Capture(profiler, allocations, bucket_name, run_id, name)
+
+
+def profiled(name):
+    """
+    Profiles a lambda_handler's invocations which ask for it in their RuntimeVariables,
+    writing the profile under the run_id to the bucket named by profile_bucket, or the
+    bucket_name environment variable. Other invocations call the handler as it is.
+    :param name: What the handler is e.g. "stage_1" - Type: String
+    :return: A decorator - Type: Function
+    """
+    def decorator(lambda_handler):
+        @functools.wraps(lambda_handler)
+        def handler(event, context):
+            runtime_variables = event.get("RuntimeVariables") \
+                if isinstance(event, dict) else None
+            if not isinstance(runtime_variables, dict) or \
+                    not (runtime_variables.get("profile") or
+                         runtime_variables.get("profile_allocations")):
+                return lambda_handler(event, context)
+            # An unknown profiler is left for the handler's schema to reject.
+            if runtime_variables.get("profile") not in PROFILERS + [None]:
+                return lambda_handler(event, context)
+
+            bucket_name = runtime_variables.get("profile_bucket") or \
+                os.environ.get("bucket_name")
+            with capture(runtime_variables, bucket_name,
+                         runtime_variables.get("run_id"), name):
+                return lambda_handler(event, context)
+
+        return handler
+
+    return decorator
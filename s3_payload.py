@@ -0,0 +1,94 @@
+import boto3
+
+import payload_compression
+
+# The payload field giving the s3 object a stage's data is in, in place of data.
+DATA_LOCATION = "data_location"
+# The payload field giving the s3 object a stage is to write its output to.
+OUTPUT_LOCATION = "output_location"
+# The fields of a payload or stage response which carry the data.
+ENVELOPE_KEYS = ["data", payload_compression.DATA_COMPRESSION, DATA_LOCATION]
+
+PREFIX = "disclosure-payloads/"
+
+
+def location(bucket_name, run_id, name):
+    """
+    The s3 object a run's payload data is kept in.
+    :param bucket_name: The bucket - Type: String
+    :param run_id: The run id - Type: String
+    :param name: The name of the object within the run e.g. "stage_1_output"
+                 - Type: String
+    :return: {"bucket", "key"} - Type: Dict
+    """
+    return {"bucket": bucket_name, "key": f"{PREFIX}{run_id}/{name}.json"}
+
+
+def envelope(response):
+    """
+    Picks the fields which carry the data out of a payload or stage response.
+    :param response: The payload or stage response - Type: Dict
+    :return: envelope - Type: Dict
+    """
+    return {key: response[key] for key in ENVELOPE_KEYS if key in response}
+
+
+def store(envelope, output_location, s3_client=None):
+    """
+    Writes an envelope's data to s3 when a location is given, returning an envelope
+    which refers to it.
+    An envelope which already refers to s3 is returned as it is.
+    :param envelope: A Dict holding "data" and optionally "data_compression".
+    :param output_location: {"bucket", "key"} to write to, or None to leave the data
+                            inline - Type: Dict
+    :param s3_client: The client to write with - Type: Service client
+    :return: envelope - Type: Dict
+    """
+    if not output_location or envelope.get("data") is None:
+        return envelope
+
+    s3_client = s3_client or boto3.client("s3", region_name="eu-west-2")
+    s3_client.put_object(Bucket=output_location["bucket"], Key=output_location["key"],
+                         Body=envelope["data"].encode("UTF-8"))
+    stored = {key: value for key, value in envelope.items() if key != "data"}
+    stored[DATA_LOCATION] = output_location
+
+    return stored
+
+
+def fetch(envelope, s3_client=None):
+    """
+    Reverses store, reading the data of an envelope which refers to s3.
+    :param envelope: A Dict holding "data" or "data_location", and optionally
+                     "data_compression".
+    :param s3_client: The client to read with - Type: Service client
+    :return: envelope, holding "data" - Type: Dict
+    """
+    if envelope.get("data") is not None:
+        return envelope
+    data_location = envelope.get(DATA_LOCATION)
+    if not data_location:
+        raise ValueError("The payload holds neither data nor a data_location")
+
+    s3_client = s3_client or boto3.client("s3", region_name="eu-west-2")
+    s3_object = s3_client.get_object(Bucket=data_location["bucket"],
+                                     Key=data_location["key"])
+    fetched = {key: value for key, value in envelope.items() if key != DATA_LOCATION}
+    fetched["data"] = s3_object["Body"].read().decode("UTF-8")
+
+    return fetched
+
+
+def remove(bucket_name, run_id, s3_client=None):
+    """
+    Deletes the payload data kept for a run.
+    :param bucket_name: The bucket - Type: String
+    :param run_id: The run id - Type: String
+    :param s3_client: The client to delete with - Type: Service client
+    """
+    s3_client = s3_client or boto3.client("s3", region_name="eu-west-2")
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{PREFIX}{run_id}/"):
+        keys = [{"Key": s3_object["Key"]} for s3_object in page.get("Contents", [])]
+        if keys:
+            s3_client.delete_objects(Bucket=bucket_name, Delete={"Objects": keys})
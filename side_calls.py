@@ -0,0 +1,121 @@
+import logging
+import queue
+import threading
+import time
+
+# The channels side calls are made on. Each has its own worker, so the calls of one
+# channel are made in the order they were submitted, alongside those of the others.
+BPM = "bpm"
+SNS = "sns"
+
+# The attempts made at each call before it is given up on, and the seconds waited
+# before the first retry, doubling after each.
+ATTEMPTS = 3
+RETRY_SECONDS = 0.2
+
+_STOP = object()
+
+
+class Dispatcher:
+    """
+    Makes side calls, such as the BPM status and SNS messages, which do not change the
+    result of a run, on background threads, so their round trips are not waited for
+    on the way. A failed call is retried, and a call which still fails is logged with
+    its arguments and kept in failed, rather than failing the run.
+    A handler closes its dispatcher before it returns or raises, which waits for every
+    call submitted, as a lambda's threads are frozen once it returns.
+    """
+
+    def __init__(self, logger=None, attempts=ATTEMPTS, retry_seconds=RETRY_SECONDS):
+        """
+        :param logger: The logger to report failed calls to.
+        :param attempts: The attempts made at each call - Type: Int
+        :param retry_seconds: The seconds waited before the first retry - Type: Float
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self.attempts = attempts
+        self.retry_seconds = retry_seconds
+        # (function name, arguments, error) of each call given up on.
+        self.failed = []
+        self._queues = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def submit(self, channel, function, *args, **kwargs):
+        """
+        Queues a call to be made on a channel's worker, starting the worker if need be.
+        A dispatcher which has been closed makes the call straight away instead.
+        :param channel: The channel e.g. BPM - Type: String
+        :param function: The function to call - Type: Function
+        """
+        with self._lock:
+            if self._queues is None:
+                calls = None
+            else:
+                if channel not in self._queues:
+                    self._queues[channel] = queue.Queue()
+                    self._threads[channel] = threading.Thread(
+                        target=self._work, args=(self._queues[channel],), daemon=True)
+                    self._threads[channel].start()
+                calls = self._queues[channel]
+        if calls is None:
+            self._call(function, args, kwargs)
+        else:
+            calls.put((function, args, kwargs))
+
+    def flush(self):
+        """
+        Waits for every call submitted so far to be made or given up on.
+        """
+        with self._lock:
+            calls = list((self._queues or {}).values())
+        for channel_calls in calls:
+            channel_calls.join()
+
+    def close(self):
+        """
+        Flushes the calls and stops the workers. Calls submitted afterwards are made
+        straight away.
+        :return: The calls given up on - Type: List
+        """
+        with self._lock:
+            queues, threads = self._queues or {}, self._threads
+            self._queues = None
+        for calls in queues.values():
+            calls.put(_STOP)
+        for thread in threads.values():
+            thread.join()
+
+        return self.failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _work(self, calls):
+        while True:
+            call = calls.get()
+            try:
+                if call is _STOP:
+                    return
+                self._call(*call)
+            finally:
+                calls.task_done()
+
+    def _call(self, function, args, kwargs):
+        delay = self.retry_seconds
+        for attempt in range(1, self.attempts + 1):
+            try:
+                function(*args, **kwargs)
+                return
+            except Exception as e:
+                if attempt == self.attempts:
+                    name = getattr(function, "__name__", repr(function))
+                    self.failed.append((name, args, str(e)))
+                    self.logger.error(f"Gave up on {name}{args} after {attempt}"
+                                      f" attempts: {e}")
+                    return
+                time.sleep(delay)
+                delay *= 2
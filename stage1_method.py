@@ -1,9 +1,16 @@
-import json
 import logging
 
-import pandas as pd
+import numpy as np
 from es_aws_functions import general_functions
-from marshmallow import EXCLUDE, Schema, fields
+from marshmallow import EXCLUDE, Schema, fields, validate
+
+import columnar_json
+import dtype_plan
+import payload_compression
+import profiling
+import s3_payload
+import stage_chain
+import stage_warmup
 
 
 class RuntimeSchema(Schema):
@@ -16,35 +23,69 @@ class RuntimeSchema(Schema):
 
     bpm_queue_url = fields.Str(required=True)
     cell_total_column = fields.Str(required=True)
-    data = fields.Str(required=True)
+    compression_level = fields.Int(required=False)
+    data = fields.Str(required=False)
+    data_compression = fields.Str(required=False,
+                                  validate=validate.OneOf(payload_compression.CODECS))
+    data_location = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
     disclosivity_marker = fields.Str(required=True)
+    dtype_overrides = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
     environment = fields.Str(required=True)
     explanation = fields.Str(required=True)
+    output_location = fields.Dict(keys=fields.Str(), values=fields.Str(),
+                                  required=False)
+    profile = fields.Str(required=False, validate=validate.OneOf(profiling.PROFILERS))
+    profile_allocations = fields.Bool(required=False)
+    profile_bucket = fields.Str(required=False)
     publishable_indicator = fields.Str(required=True)
     run_id = fields.Str(required=True)
     survey = fields.Str(required=True)
     total_columns = fields.List(fields.Str(), required=True)
-    unique_identifier = fields.List(fields.Str(), required=True)
 
 
+@stage_chain.chained
+@profiling.profiled("stage_1")
 def lambda_handler(event, context):
     """
     Main entry point into method
     :param event: json payload containing:
             bpm_queue_url: Queue url to send BPM status message.
-            data: input data.
+            chain: Optional. The rest of a chained run, which the output is handed
+                        on to rather than returned (see stage_chain).
+            compression_level: Optional. The level to compress the output with.
+            data: input data. Left out when data_location is given.
+            data_compression: Optional. The codec data is compressed with, which the
+                        output is compressed with too.
+            data_location: Optional. The s3 object ({"bucket", "key"}) holding the
+                        data, in place of data.
             disclosivity_marker: The name of the column to put "disclosive" marker.
+            dtype_overrides: Optional per column dtype rules for the dtype plan.
             environment: The operating environment to use in the spp logger.
             explanation: The name of the column to put reason for pass/fail.
+            output_location: Optional. The s3 object ({"bucket", "key"}) to write the
+                        output to, which is then returned as data_location.
+            profile: Optional. "cprofile" or "sampling" to profile the invocation
+                        (see profiling).
+            profile_allocations: Optional. Whether to trace the allocations of
+                        the invocation.
+            profile_bucket: Optional. The bucket to write the profile to.
             publishable_indicator: The name of the column to put "publish" marker.
             survey: The survey selected to be used in the logger.
             total_columns: The names of the columns holding the cell totals.
-            unique_identifier: The name of the column holding the contributor id.
+            Or the wrangler's warm-up ping, {"warmup": True}.
     :param context: AWS Context Object.
     :return final_output: Dict containing either:
             {"success": True, "data": <stage 1 output - json >}
+            with "data_compression" when the data is compressed.
             {"success": False, "error": <error message - string>}
+            {"success": True, "warmup": True, "cold": <whether the container was
+             cold - boolean>} for a warm-up ping.
     """
+    # A warm-up ping from the wrangler only needs the container to be loaded.
+    warmup_reply = stage_warmup.handle_warmup(event)
+    if warmup_reply is not None:
+        return warmup_reply
+
     current_module = "Disclosure Stage 1 Method"
     error_message = ""
     # Set-up variables for status message
@@ -65,10 +106,10 @@ def lambda_handler(event, context):
         explanation = runtime_variables["explanation"]
         publishable_indicator = runtime_variables["publishable_indicator"]
         survey = runtime_variables["survey"]
-        unique_identifier = runtime_variables["unique_identifier"]
         total_columns = runtime_variables["total_columns"]
 
-        input_json = json.loads(runtime_variables["data"])
+        input_dataframe = columnar_json.decode_records(
+            payload_compression.unpack(s3_payload.fetch(runtime_variables)))
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
@@ -86,37 +127,23 @@ def lambda_handler(event, context):
 
     try:
         logger.info("Started - retrieved wrangler configuration variables.")
-        input_dataframe = pd.DataFrame(input_json)
-        stage_1_output = pd.DataFrame()
-        first_loop = True
-        for total_column in total_columns:
-            this_disclosivity_marker = disclosivity_marker + "_" + total_column
-            this_publishable_indicator = publishable_indicator + "_" + total_column
-            this_explanation = explanation + "_" + total_column
-            this_total_column = cell_total_column + "_" + total_column
-
-            disclosure_output = disclosure(input_dataframe,
-                                           this_disclosivity_marker,
-                                           this_publishable_indicator,
-                                           this_explanation,
-                                           this_total_column)
-            if first_loop:
-                stage_1_output = disclosure_output
-                first_loop = False
-            else:
-                keep_columns = [this_disclosivity_marker,
-                                this_explanation,
-                                this_publishable_indicator] \
-                               + unique_identifier
-                stage_1_output = stage_1_output.merge(disclosure_output[keep_columns],
-                                                      on=unique_identifier,
-                                                      how="left")
-
-            logger.info("Successfully completed Disclosure stage 1 for:"
-                        + str(total_column))
-
+        input_dataframe, memory_before, memory_after = dtype_plan.apply_dtype_plan(
+            input_dataframe, dtype_plan.build_dtype_plan(runtime_variables))
+        logger.info(f"Applied dtype plan - memory usage reduced from {memory_before}"
+                    f" to {memory_after} bytes")
+        stage_1_output = disclose_total_columns(input_dataframe,
+                                                disclosivity_marker,
+                                                publishable_indicator,
+                                                explanation,
+                                                total_columns,
+                                                cell_total_column,
+                                                logger)
         logger.info("Successfully completed Disclosure")
-        final_output = {"data": stage_1_output.to_json(orient="records")}
+        output = payload_compression.pack(stage_1_output.to_json(orient="records"),
+                                          runtime_variables.get("data_compression"),
+                                          runtime_variables.get("compression_level"),
+                                          logger)
+        final_output = s3_payload.store(output, runtime_variables.get("output_location"))
 
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
@@ -132,6 +159,34 @@ def lambda_handler(event, context):
     return final_output
 
 
+def disclose_total_columns(input_dataframe, disclosivity_marker, publishable_indicator,
+                           explanation, total_columns, cell_total_column, logger):
+    """
+    Applies the stage1 disclosure rule for each of the total columns.
+    :param input_dataframe: input data.
+    :param disclosivity_marker: The name of the column to put "disclosive" marker.
+    :param publishable_indicator: The name of the column to put "publish" marker.
+    :param explanation: The name of the column to put reason for pass/fail.
+    :param total_columns: The names of the columns holding the cell totals.
+    :param cell_total_column: The name of the column holding the cell total.
+    :param logger: The logger to report progress to.
+    :return stage_1_output: Input dataframe with the addition of stage1 disclosure
+            info for every total column.
+    """
+    stage_1_output = input_dataframe
+    for total_column in total_columns:
+        stage_1_output = disclosure(stage_1_output,
+                                    disclosivity_marker + "_" + total_column,
+                                    publishable_indicator + "_" + total_column,
+                                    explanation + "_" + total_column,
+                                    cell_total_column + "_" + total_column)
+
+        logger.info("Successfully completed Disclosure stage 1 for:"
+                    + str(total_column))
+
+    return stage_1_output
+
+
 def disclosure(input_df, disclosivity_marker, publishable_indicator,
                explanation, total_column):
     """
@@ -143,19 +198,14 @@ def disclosure(input_df, disclosivity_marker, publishable_indicator,
     :param total_column - The name of the column to check.
     :return output_df: Input dataframe with the addition of stage1 disclosure info.
     """
-
-    def run_disclosure(row):
-
-        if row[total_column] == 0:
-            row[disclosivity_marker] = "No"
-            row[publishable_indicator] = "Publish"
-            row[explanation] = "Stage 1 - Total column is 0"
-        else:
-            row[disclosivity_marker] = "Yes"
-            row[publishable_indicator] = "Not Applicable"
-            row[explanation] = "Through stage 1"
-        return row
-
-    output_df = input_df.apply(run_disclosure, axis=1)
+    output_df = input_df.copy()
+    zero_total = (output_df[total_column] == 0).to_numpy()
+
+    output_df[disclosivity_marker] = np.where(zero_total, "No", "Yes").astype(object)
+    output_df[publishable_indicator] = \
+        np.where(zero_total, "Publish", "Not Applicable").astype(object)
+    output_df[explanation] = \
+        np.where(zero_total, "Stage 1 - Total column is 0", "Through stage 1")\
+        .astype(object)
 
     return output_df
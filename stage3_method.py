@@ -1,2 +1,294 @@
+import logging
+
+import numpy as np
+from es_aws_functions import general_functions
+from marshmallow import EXCLUDE, Schema, fields, validate
+
+import columnar_json
+import contributor_topk
+import dtype_plan
+import payload_compression
+import profiling
+import s3_payload
+import stage_chain
+import stage_columns
+import stage_warmup
+
+
+class RuntimeSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    def handle_error(self, e, data, **kwargs):
+        logging.error(f"Error validating runtime params: {e}")
+        raise ValueError(f"Error validating runtime params: {e}")
+
+    bpm_queue_url = fields.Str(required=True)
+    compression_level = fields.Int(required=False)
+    data = fields.Str(required=False)
+    data_compression = fields.Str(required=False,
+                                  validate=validate.OneOf(payload_compression.CODECS))
+    data_location = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
+    disclosivity_marker = fields.Str(required=True)
+    dominance_k = fields.Str(required=True)
+    dominance_n = fields.Str(required=True)
+    dtype_overrides = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
+    environment = fields.Str(required=True)
+    explanation = fields.Str(required=True)
+    grouping_columns = fields.List(fields.Str(), required=True)
+    output_location = fields.Dict(keys=fields.Str(), values=fields.Str(),
+                                  required=False)
+    profile = fields.Str(required=False, validate=validate.OneOf(profiling.PROFILERS))
+    profile_allocations = fields.Bool(required=False)
+    profile_bucket = fields.Str(required=False)
+    publishable_indicator = fields.Str(required=True)
+    run_id = fields.Str(required=True)
+    survey = fields.Str(required=True)
+    total_columns = fields.List(fields.Str(), required=True)
+
+
+@stage_chain.chained
+@profiling.profiled("stage_3")
 def lambda_handler(event, context):
-    return event["data"]
+    """
+    Main entry point into method
+    :param event: json payload containing:
+            bpm_queue_url: Queue url to send BPM status message.
+            chain: Optional. The rest of a chained run, which the output is handed
+                        on to rather than returned (see stage_chain).
+            compression_level: Optional. The level to compress the output with.
+            data: input data, one row per contributor.
+                        Left out when data_location is given.
+            data_compression: Optional. The codec data is compressed with, which the
+                        output is compressed with too.
+            data_location: Optional. The s3 object ({"bucket", "key"}) holding the
+                        data, in place of data.
+            disclosivity_marker: The name of the column to put "disclosive" marker.
+            dominance_k: The largest percentage of a cell's total its top dominance_n
+                        contributors can make up.
+            dominance_n: The number of largest contributors in the dominance test.
+            dtype_overrides: Optional per column dtype rules for the dtype plan.
+            environment: The operating environment to use in the spp logger.
+            explanation: The name of the column to put reason for pass/fail.
+            grouping_columns: The columns which identify a cell of the published table.
+            output_location: Optional. The s3 object ({"bucket", "key"}) to write the
+                        output to, which is then returned as data_location.
+            profile: Optional. "cprofile" or "sampling" to profile the invocation
+                        (see profiling).
+            profile_allocations: Optional. Whether to trace the allocations of
+                        the invocation.
+            profile_bucket: Optional. The bucket to write the profile to.
+            publishable_indicator: The name of the column to put "publish" marker.
+            survey: The survey selected to be used in the logger.
+            total_columns: The names of the columns holding the contributions.
+                        Included so that correct disclosure columns used.
+            Or the wrangler's warm-up ping, {"warmup": True}.
+    :param context: AWS Context Object.
+    :return final_output: Dict containing either:
+            {"success": True, "data": <stage 3 output - json >}
+            with "data_compression" when the data is compressed.
+            {"success": False, "error": <error message - string>}
+            {"success": True, "warmup": True, "cold": <whether the container was
+             cold - boolean>} for a warm-up ping.
+    """
+    # A warm-up ping from the wrangler only needs the container to be loaded.
+    warmup_reply = stage_warmup.handle_warmup(event)
+    if warmup_reply is not None:
+        return warmup_reply
+
+    current_module = "Disclosure Stage 3 Method"
+    error_message = ""
+    # Set-up variables for status message
+    bpm_queue_url = None
+    # Define run_id outside of try block
+    run_id = 0
+    try:
+        # Retrieve run_id before input validation
+        # Because it is used in exception handling
+        run_id = event["RuntimeVariables"]["run_id"]
+        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+
+        # Runtime Variables
+        bpm_queue_url = runtime_variables["bpm_queue_url"]
+        disclosivity_marker = runtime_variables["disclosivity_marker"]
+        dominance_k = float(runtime_variables["dominance_k"])
+        dominance_n = int(runtime_variables["dominance_n"])
+        environment = runtime_variables["environment"]
+        explanation = runtime_variables["explanation"]
+        grouping_columns = runtime_variables["grouping_columns"]
+        publishable_indicator = runtime_variables["publishable_indicator"]
+        survey = runtime_variables["survey"]
+        total_columns = runtime_variables["total_columns"]
+
+        input_dataframe = columnar_json.decode_records(
+            payload_compression.unpack(s3_payload.fetch(runtime_variables)))
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        return {"success": False, "error": error_message}
+
+    try:
+        logger = general_functions.get_logger(survey, current_module, environment,
+                                              run_id)
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        return {"success": False, "error": error_message}
+
+    try:
+        logger.info("Started - retrieved wrangler configuration variables.")
+        input_dataframe, memory_before, memory_after = dtype_plan.apply_dtype_plan(
+            input_dataframe, dtype_plan.build_dtype_plan(runtime_variables))
+        logger.info(f"Applied dtype plan - memory usage reduced from {memory_before}"
+                    f" to {memory_after} bytes")
+        stage_3_output = disclose_total_columns(input_dataframe,
+                                                disclosivity_marker,
+                                                publishable_indicator,
+                                                explanation,
+                                                total_columns,
+                                                dominance_n,
+                                                dominance_k,
+                                                grouping_columns,
+                                                logger)
+        logger.info("Successfully completed Disclosure")
+        output = payload_compression.pack(stage_3_output.to_json(orient="records"),
+                                          runtime_variables.get("data_compression"),
+                                          runtime_variables.get("compression_level"),
+                                          logger)
+        final_output = s3_payload.store(output, runtime_variables.get("output_location"))
+
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+    finally:
+        if (len(error_message)) > 0:
+            logger.error(error_message)
+            return {"success": False, "error": error_message}
+
+    logger.info("Successfully completed module: " + current_module)
+    final_output["success"] = True
+    return final_output
+
+
+def disclose_total_columns(input_dataframe, disclosivity_marker, publishable_indicator,
+                           explanation, total_columns, dominance_n, dominance_k,
+                           grouping_columns, logger):
+    """
+    Applies the stage3 dominance rule for each of the total columns. The top
+    contributors of every total column are found in one pass before the rule is
+    applied.
+    :param input_dataframe: input data, one row per contributor.
+    :param disclosivity_marker: The name of the column to put "disclosive" marker.
+    :param publishable_indicator: The name of the column to put "publish" marker.
+    :param explanation: The name of the column to put reason for pass/fail.
+    :param total_columns: The names of the columns holding the contributions.
+    :param dominance_n: The number of largest contributors in the dominance test.
+    :param dominance_k: The largest percentage of a cell's total its top dominance_n
+                        contributors can make up.
+    :param grouping_columns: The columns which identify a cell of the published table.
+    :param logger: The logger to report progress to.
+    :return stage_3_output: Input dataframe with the addition of stage3 disclosure
+            info for every total column.
+    """
+    contributors = contributor_topk.top_contributors(input_dataframe, grouping_columns,
+                                                     total_columns, dominance_n)
+    logger.info(f"Found the top {dominance_n} contributors of"
+                f" {len(contributors.totals)} cells")
+
+    stage_3_output = input_dataframe
+    for column_index, total_column in enumerate(total_columns):
+        stage_3_output = disclosure(stage_3_output,
+                                    disclosivity_marker + "_" + total_column,
+                                    publishable_indicator + "_" + total_column,
+                                    explanation + "_" + total_column,
+                                    total_column,
+                                    grouping_columns,
+                                    dominance_n,
+                                    dominance_k,
+                                    _column_contributors(contributors, column_index))
+
+        logger.info("Successfully completed Disclosure stage 3 for:"
+                    + str(total_column))
+
+    return stage_3_output
+
+
+def disclosure(input_df, disclosivity_marker, publishable_indicator, explanation,
+               total_column, grouping_columns, dominance_n, dominance_k,
+               contributors=None):
+    """
+    Takes in a dataframe and applies the stage3 (n, k) dominance rule: a cell is
+    disclosive if its dominance_n largest contributors make up more than dominance_k
+    percent of its total.
+    :param input_df: input data, one row per contributor.
+    :param disclosivity_marker: The name of the column to put "disclosive" marker.
+    :param publishable_indicator: The name of the column to put "publish" marker.
+    :param explanation: The name of the column to put reason for pass/fail.
+    :param total_column: The name of the column holding the contributions.
+    :param grouping_columns: The columns which identify a cell of the published table.
+    :param dominance_n: The number of largest contributors in the dominance test.
+    :param dominance_k: The largest percentage of a cell's total its top dominance_n
+                        contributors can make up.
+    :param contributors: This total column's top contributors, found here if not given.
+    :return output_df: Input dataframe with the addition of stage3 disclosure info.
+    """
+    output_df = input_df.copy()
+    if contributors is None:
+        contributors = contributor_topk.top_contributors(
+            output_df, grouping_columns, [total_column], dominance_n)
+        contributors = _column_contributors(contributors, 0)
+
+    if publishable_indicator in output_df.columns:
+        to_check = pending_rows(output_df, disclosivity_marker, publishable_indicator)
+    else:
+        to_check = np.ones(len(output_df), dtype=bool)
+    if not to_check.any():
+        return output_df
+
+    top, totals = contributors.top[:, 0], contributors.totals[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = np.where(totals > 0, top.sum(axis=1) / totals * 100, np.nan)
+    row_shares = shares[contributors.cell_of_row]
+
+    failed = to_check & (row_shares > dominance_k)
+    passed = to_check & ~failed
+
+    reasons = np.array([f"Stage 3 - Top {dominance_n} contributors make up"
+                        f" {share:.1f}% of the cell" for share in row_shares[failed]],
+                       dtype=object)
+
+    output_df[disclosivity_marker] = stage_columns.update(
+        output_df, disclosivity_marker, failed, "Yes", passed, "No")
+    output_df[publishable_indicator] = stage_columns.update(
+        output_df, publishable_indicator, failed, "No", passed, "Not Applicable")
+    output_df[explanation] = stage_columns.update(
+        output_df, explanation, failed, reasons, passed, "Passed Stage 3")
+
+    return output_df
+
+
+def pending_rows(input_df, disclosivity_marker, publishable_indicator):
+    """
+    Finds the rows the stage3 rule can change: those not yet published or suppressed.
+    :param input_df: input data.
+    :param disclosivity_marker: The name of the column holding the "disclosive" marker.
+    :param publishable_indicator: The name of the column holding the "publish" marker.
+    :return: Whether each row can change - Type: Numpy Array
+    """
+    return (~input_df[publishable_indicator].isin(["Publish", "No"])).to_numpy()
+
+
+def _column_contributors(contributors, column_index):
+    """
+    Picks one total column out of the top contributors of several.
+    :param contributors: The top contributors - Type: TopContributors
+    :param column_index: The position of the total column - Type: Int
+    :return: The total column's top contributors - Type: TopContributors
+    """
+    return contributor_topk.TopContributors(
+        contributors.cell_of_row,
+        contributors.top[:, column_index:column_index + 1],
+        contributors.totals[:, column_index:column_index + 1])
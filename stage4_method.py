@@ -1,2 +1,338 @@
+import collections
+import logging
+
+import numpy as np
+from es_aws_functions import general_functions
+from marshmallow import EXCLUDE, Schema, fields, validate
+
+import columnar_json
+import dtype_plan
+import group_numbers
+import payload_compression
+import profiling
+import s3_payload
+import stage_chain
+import stage_columns
+import stage_warmup
+
+# The cells of a table and the lines they are published in, built once per run.
+# cell_of_row: The cell each row belongs to - Type: Numpy Array
+# first_rows: The position of the first row of each cell - Type: Numpy Array
+# lines: For each grouping column, the line (the cells which share every other
+#        grouping value, and so add up to one published total) of each cell.
+#        - Type: List of Numpy Array
+CellIndex = collections.namedtuple("CellIndex", ["cell_of_row", "first_rows", "lines"])
+
+
+class RuntimeSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    def handle_error(self, e, data, **kwargs):
+        logging.error(f"Error validating runtime params: {e}")
+        raise ValueError(f"Error validating runtime params: {e}")
+
+    bpm_queue_url = fields.Str(required=True)
+    cell_total_column = fields.Str(required=True)
+    compression_level = fields.Int(required=False)
+    data = fields.Str(required=False)
+    data_compression = fields.Str(required=False,
+                                  validate=validate.OneOf(payload_compression.CODECS))
+    data_location = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
+    disclosivity_marker = fields.Str(required=True)
+    dtype_overrides = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
+    environment = fields.Str(required=True)
+    explanation = fields.Str(required=True)
+    grouping_columns = fields.List(fields.Str(), required=True)
+    output_location = fields.Dict(keys=fields.Str(), values=fields.Str(),
+                                  required=False)
+    profile = fields.Str(required=False, validate=validate.OneOf(profiling.PROFILERS))
+    profile_allocations = fields.Bool(required=False)
+    profile_bucket = fields.Str(required=False)
+    publishable_indicator = fields.Str(required=True)
+    run_id = fields.Str(required=True)
+    survey = fields.Str(required=True)
+    total_columns = fields.List(fields.Str(), required=True)
+
+
+@stage_chain.chained
+@profiling.profiled("stage_4")
 def lambda_handler(event, context):
-    return event["data"]
+    """
+    Main entry point into method
+    :param event: json payload containing:
+            bpm_queue_url: Queue url to send BPM status message.
+            cell_total_column: The name of the column holding the cell total.
+            chain: Optional. The rest of a chained run, which the output is handed
+                        on to rather than returned (see stage_chain).
+            compression_level: Optional. The level to compress the output with.
+            data: input data. Left out when data_location is given.
+            data_compression: Optional. The codec data is compressed with, which the
+                        output is compressed with too.
+            data_location: Optional. The s3 object ({"bucket", "key"}) holding the
+                        data, in place of data.
+            disclosivity_marker: The name of the column to put "disclosive" marker.
+            dtype_overrides: Optional per column dtype rules for the dtype plan.
+            environment: The operating environment to use in the spp logger.
+            explanation: The name of the column to put reason for pass/fail.
+            grouping_columns: The columns which identify a cell of the published
+                        table, each of which is totalled over in the table.
+            output_location: Optional. The s3 object ({"bucket", "key"}) to write the
+                        output to, which is then returned as data_location.
+            profile: Optional. "cprofile" or "sampling" to profile the invocation
+                        (see profiling).
+            profile_allocations: Optional. Whether to trace the allocations of
+                        the invocation.
+            profile_bucket: Optional. The bucket to write the profile to.
+            publishable_indicator: The name of the column to put "publish" marker.
+            survey: The survey selected to be used in the logger.
+            total_columns: The names of the columns holding the cell totals.
+                        Included so that correct disclosure columns used.
+            Or the wrangler's warm-up ping, {"warmup": True}.
+    :param context: AWS Context Object.
+    :return final_output: Dict containing either:
+            {"success": True, "data": <stage 4 output - json >}
+            with "data_compression" when the data is compressed.
+            {"success": False, "error": <error message - string>}
+            {"success": True, "warmup": True, "cold": <whether the container was
+             cold - boolean>} for a warm-up ping.
+    """
+    # A warm-up ping from the wrangler only needs the container to be loaded.
+    warmup_reply = stage_warmup.handle_warmup(event)
+    if warmup_reply is not None:
+        return warmup_reply
+
+    current_module = "Disclosure Stage 4 Method"
+    error_message = ""
+    # Set-up variables for status message
+    bpm_queue_url = None
+    # Define run_id outside of try block
+    run_id = 0
+    try:
+        # Retrieve run_id before input validation
+        # Because it is used in exception handling
+        run_id = event["RuntimeVariables"]["run_id"]
+        runtime_variables = RuntimeSchema().load(event["RuntimeVariables"])
+
+        # Runtime Variables
+        bpm_queue_url = runtime_variables["bpm_queue_url"]
+        cell_total_column = runtime_variables["cell_total_column"]
+        disclosivity_marker = runtime_variables["disclosivity_marker"]
+        environment = runtime_variables["environment"]
+        explanation = runtime_variables["explanation"]
+        grouping_columns = runtime_variables["grouping_columns"]
+        publishable_indicator = runtime_variables["publishable_indicator"]
+        survey = runtime_variables["survey"]
+        total_columns = runtime_variables["total_columns"]
+
+        input_dataframe = columnar_json.decode_records(
+            payload_compression.unpack(s3_payload.fetch(runtime_variables)))
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        return {"success": False, "error": error_message}
+
+    try:
+        logger = general_functions.get_logger(survey, current_module, environment,
+                                              run_id)
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+        return {"success": False, "error": error_message}
+
+    try:
+        logger.info("Started - retrieved wrangler configuration variables.")
+        input_dataframe, memory_before, memory_after = dtype_plan.apply_dtype_plan(
+            input_dataframe, dtype_plan.build_dtype_plan(runtime_variables))
+        logger.info(f"Applied dtype plan - memory usage reduced from {memory_before}"
+                    f" to {memory_after} bytes")
+        stage_4_output = disclose_total_columns(input_dataframe,
+                                                disclosivity_marker,
+                                                publishable_indicator,
+                                                explanation,
+                                                total_columns,
+                                                cell_total_column,
+                                                grouping_columns,
+                                                logger)
+        logger.info("Successfully completed Disclosure")
+        output = payload_compression.pack(stage_4_output.to_json(orient="records"),
+                                          runtime_variables.get("data_compression"),
+                                          runtime_variables.get("compression_level"),
+                                          logger)
+        final_output = s3_payload.store(output, runtime_variables.get("output_location"))
+
+    except Exception as e:
+        error_message = general_functions.handle_exception(e, current_module,
+                                                           run_id, context=context,
+                                                           bpm_queue_url=bpm_queue_url)
+    finally:
+        if (len(error_message)) > 0:
+            logger.error(error_message)
+            return {"success": False, "error": error_message}
+
+    logger.info("Successfully completed module: " + current_module)
+    final_output["success"] = True
+    return final_output
+
+
+def disclose_total_columns(input_dataframe, disclosivity_marker, publishable_indicator,
+                           explanation, total_columns, cell_total_column,
+                           grouping_columns, logger):
+    """
+    Applies the stage4 complementary suppression for each of the total columns. The
+    cell index is built once and shared by every total column.
+    :param input_dataframe: input data.
+    :param disclosivity_marker: The name of the column to put "disclosive" marker.
+    :param publishable_indicator: The name of the column to put "publish" marker.
+    :param explanation: The name of the column to put reason for pass/fail.
+    :param total_columns: The names of the columns holding the cell totals.
+    :param cell_total_column: The name of the column holding the cell total.
+    :param grouping_columns: The columns which identify a cell of the published table.
+    :param logger: The logger to report progress to.
+    :return stage_4_output: Input dataframe with the addition of stage4 disclosure
+            info for every total column.
+    """
+    cell_index = build_cell_index(input_dataframe, grouping_columns)
+    logger.info(f"Built the cell index - {len(cell_index.first_rows)} cells in"
+                f" {len(grouping_columns)} dimensions")
+
+    stage_4_output = input_dataframe
+    for total_column in total_columns:
+        stage_4_output = disclosure(stage_4_output,
+                                    disclosivity_marker + "_" + total_column,
+                                    publishable_indicator + "_" + total_column,
+                                    explanation + "_" + total_column,
+                                    cell_total_column + "_" + total_column,
+                                    grouping_columns,
+                                    cell_index)
+
+        logger.info("Successfully completed Disclosure stage 4 for:"
+                    + str(total_column))
+
+    return stage_4_output
+
+
+def build_cell_index(input_df, grouping_columns):
+    """
+    Numbers the cells of the table and, for every grouping column, the lines the cells
+    are published in, so suppression never has to search for a cell's siblings.
+    :param input_df: input data.
+    :param grouping_columns: The columns which identify a cell of the published table.
+    :return: The cell index - Type: CellIndex
+    """
+    cell_of_row = group_numbers.number_groups(input_df, grouping_columns)
+    _, first_rows = np.unique(cell_of_row, return_index=True)
+    cells = input_df[grouping_columns].iloc[first_rows]
+
+    lines = []
+    for grouping_column in grouping_columns:
+        other_columns = [column for column in grouping_columns
+                         if column != grouping_column]
+        if other_columns:
+            lines.append(group_numbers.number_groups(cells, other_columns))
+        else:
+            # The only line is the grand total.
+            lines.append(np.zeros(len(cells), dtype=np.int64))
+
+    return CellIndex(cell_of_row, first_rows, lines)
+
+
+def disclosure(input_df, disclosivity_marker, publishable_indicator,
+               explanation, cell_total_column, grouping_columns, cell_index=None):
+    """
+    Takes in a dataframe and applies the stage4 complementary suppression. A cell
+    suppressed by the earlier stages could be worked out from the total of any line it
+    is in if it were the only suppressed cell of that line, so the smallest published
+    cell of each such line is suppressed as well, until no line has exactly one.
+    :param input_df: input data.
+    :param disclosivity_marker: The name of the column to put "disclosive" marker.
+    :param publishable_indicator: The name of the column to put "publish" marker.
+    :param explanation: The name of the column to put reason for pass/fail.
+    :param cell_total_column: The name of the column holding the cell total.
+    :param grouping_columns: The columns which identify a cell of the published table.
+    :param cell_index: The index from build_cell_index, built here if not given.
+    :return output_df: Input dataframe with the addition of stage4 disclosure info.
+    """
+    output_df = input_df.copy()
+    if cell_index is None:
+        cell_index = build_cell_index(output_df, grouping_columns)
+    cell_count = len(cell_index.first_rows)
+    if cell_count == 0:
+        return output_df
+
+    if disclosivity_marker in output_df.columns:
+        disclosive_rows = pending_rows(output_df, disclosivity_marker,
+                                       publishable_indicator)
+    else:
+        disclosive_rows = np.zeros(len(output_df), dtype=bool)
+    suppressed = np.bincount(cell_index.cell_of_row[disclosive_rows],
+                             minlength=cell_count) > 0
+    values = output_df[cell_total_column].to_numpy(dtype=float)[cell_index.first_rows]
+
+    complementary = _complementary_suppression(values, suppressed, cell_index.lines)
+    if not complementary.any():
+        return output_df
+
+    rows = complementary[cell_index.cell_of_row]
+    output_df[disclosivity_marker] = stage_columns.update(
+        output_df, disclosivity_marker, rows, "Yes")
+    if publishable_indicator in output_df.columns:
+        output_df[publishable_indicator] = stage_columns.update(
+            output_df, publishable_indicator, rows, "No")
+    output_df[explanation] = stage_columns.update(
+        output_df, explanation,
+        rows, "Stage 4 - Suppressed to protect a disclosive cell in the same total")
+
+    return output_df
+
+
+def pending_rows(input_df, disclosivity_marker, publishable_indicator):
+    """
+    Finds the rows stage4 protects: the disclosive ones. Stage 4 needs the whole table
+    when any row is disclosive, and has nothing to do otherwise.
+    :param input_df: input data.
+    :param disclosivity_marker: The name of the column holding the "disclosive" marker.
+    :param publishable_indicator: The name of the column holding the "publish" marker.
+    :return: Whether each row is disclosive - Type: Numpy Array
+    """
+    return (input_df[disclosivity_marker] == "Yes").to_numpy()
+
+
+def _complementary_suppression(values, suppressed, lines):
+    """
+    Finds the cells to suppress so that no line has exactly one suppressed cell.
+    The cells of each line are sorted by value once, so every pass over the lines is
+    linear in the number of cells. Cells with a value of 0 or less protect nothing, so
+    they are only used when a line has no other published cell.
+    :param values: The value of each cell - Type: Numpy Array
+    :param suppressed: Whether each cell is already suppressed - Type: Numpy Array
+    :param lines: The line of each cell, for each grouping column - Type: List
+    :return: Whether each cell needs complementary suppression - Type: Numpy Array
+    """
+    all_suppressed = suppressed.copy()
+    orders = [np.lexsort((values, ~(values > 0), line)) for line in lines]
+
+    changed = True
+    while changed:
+        changed = False
+        for line, order in zip(lines, orders):
+            exposed = np.bincount(line[all_suppressed], minlength=line.max() + 1) == 1
+            if not exposed.any():
+                continue
+
+            # The published cells of the exposed lines, in line then value order, so
+            # the first cell of each line is its cheapest one to suppress.
+            candidates = order[~all_suppressed[order]]
+            candidates = candidates[exposed[line[candidates]]]
+            if len(candidates) == 0:
+                continue
+            candidate_lines = line[candidates]
+            first = np.ones(len(candidates), dtype=bool)
+            first[1:] = candidate_lines[1:] != candidate_lines[:-1]
+
+            all_suppressed[candidates[first]] = True
+            changed = True
+
+    return all_suppressed & ~suppressed
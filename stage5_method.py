@@ -1,9 +1,19 @@
-import json
 import logging
 
-import pandas as pd
+import numpy as np
 from es_aws_functions import general_functions
-from marshmallow import EXCLUDE, Schema, fields
+from marshmallow import EXCLUDE, Schema, fields, validate
+
+import columnar_json
+import contributor_topk
+import disclosure_layout
+import dtype_plan
+import payload_compression
+import profiling
+import s3_payload
+import stage_chain
+import stage_columns
+import stage_warmup
 
 
 class RuntimeSchema(Schema):
@@ -16,10 +26,22 @@ class RuntimeSchema(Schema):
 
     bpm_queue_url = fields.Str(required=True)
     cell_total_column = fields.Str(required=True)
-    data = fields.Str(required=True)
+    compression_level = fields.Int(required=False)
+    data = fields.Str(required=False)
+    data_compression = fields.Str(required=False,
+                                  validate=validate.OneOf(payload_compression.CODECS))
+    data_location = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
     disclosivity_marker = fields.Str(required=True)
+    dtype_overrides = fields.Dict(keys=fields.Str(), values=fields.Str(), required=False)
     environment = fields.Str(required=True)
     explanation = fields.Str(required=True)
+    grouping_columns = fields.List(fields.Str(), required=False)
+    output_layout = fields.Str(required=False)
+    output_location = fields.Dict(keys=fields.Str(), values=fields.Str(),
+                                  required=False)
+    profile = fields.Str(required=False, validate=validate.OneOf(profiling.PROFILERS))
+    profile_allocations = fields.Bool(required=False)
+    profile_bucket = fields.Str(required=False)
     publishable_indicator = fields.Str(required=True)
     run_id = fields.Str(required=True)
     survey = fields.Str(required=True)
@@ -27,18 +49,38 @@ class RuntimeSchema(Schema):
     top1_column = fields.Str(required=True)
     top2_column = fields.Str(required=True)
     total_columns = fields.List(fields.Str(), required=True)
-    unique_identifier = fields.List(fields.Str(), required=True)
 
 
+@stage_chain.chained
+@profiling.profiled("stage_5")
 def lambda_handler(event, context):
     """
     Main entry point into method
     :param event: json payload containing:
-            data: input data.
+            chain: Optional. The rest of a chained run, which the output is handed
+                        on to rather than returned (see stage_chain).
+            compression_level: Optional. The level to compress the output with.
+            data: input data. Left out when data_location is given.
+            data_compression: Optional. The codec data is compressed with, which the
+                        output is compressed with too.
+            data_location: Optional. The s3 object ({"bucket", "key"}) holding the
+                        data, in place of data.
             bpm_queue_url: Queue url to send BPM status message.
             disclosivity_marker: The name of the column to put "disclosive" marker.
+            dtype_overrides: Optional per column dtype rules for the dtype plan.
             environment: The operating environment to use in the spp logger.
             explanation: The name of the column to put reason for pass/fail.
+            grouping_columns: Optional. The columns which identify a cell, used to
+                        find the top contributors when their columns are not given.
+            output_layout: Optional. "long" keeps the score of every total column,
+                        for the long output layout.
+            output_location: Optional. The s3 object ({"bucket", "key"}) to write the
+                        output to, which is then returned as data_location.
+            profile: Optional. "cprofile" or "sampling" to profile the invocation
+                        (see profiling).
+            profile_allocations: Optional. Whether to trace the allocations of
+                        the invocation.
+            profile_bucket: Optional. The bucket to write the profile to.
             publishable_indicator: The name of the column to put "publish" marker.
             survey: The survey selected to be used in the logger.
             threshold: The threshold used in the disclosure calculation.
@@ -47,12 +89,20 @@ def lambda_handler(event, context):
             total_column: The name of the column holding the cell total.
             total_columns: The names of the columns holding the cell totals.
                         Included so that correct disclosure columns used.
-            unique_identifier: The name of the column holding the contributor id.
+            Or the wrangler's warm-up ping, {"warmup": True}.
     :param context: AWS Context Object.
     :return final_output: Dict containing either:
             {"success": True, "data": <stage 5 output - json >}
+            with "data_compression" when the data is compressed.
             {"success": False, "error": <error message - string>}
+            {"success": True, "warmup": True, "cold": <whether the container was
+             cold - boolean>} for a warm-up ping.
     """
+    # A warm-up ping from the wrangler only needs the container to be loaded.
+    warmup_reply = stage_warmup.handle_warmup(event)
+    if warmup_reply is not None:
+        return warmup_reply
+
     current_module = "Disclosure Stage 5 Method"
     error_message = ""
     # Set-up variables for status message
@@ -71,15 +121,17 @@ def lambda_handler(event, context):
         disclosivity_marker = runtime_variables["disclosivity_marker"]
         environment = runtime_variables["environment"]
         explanation = runtime_variables["explanation"]
+        grouping_columns = runtime_variables.get("grouping_columns")
+        output_layout = runtime_variables.get("output_layout")
         publishable_indicator = runtime_variables["publishable_indicator"]
         survey = runtime_variables["survey"]
         threshold = runtime_variables["threshold"]
         top1_column = runtime_variables["top1_column"]
         top2_column = runtime_variables["top2_column"]
         total_columns = runtime_variables["total_columns"]
-        unique_identifier = runtime_variables["unique_identifier"]
 
-        input_json = json.loads(runtime_variables["data"])
+        input_dataframe = columnar_json.decode_records(
+            payload_compression.unpack(s3_payload.fetch(runtime_variables)))
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
@@ -97,47 +149,29 @@ def lambda_handler(event, context):
 
     try:
         logger.info("Started - retrieved wrangler configuration variables.")
-        input_dataframe = pd.DataFrame(input_json)
-        stage_5_output = pd.DataFrame()
-        publish_columns = []
-        first_loop = True
-        for total_column in total_columns:
-            this_disclosivity_marker = disclosivity_marker + "_" + total_column
-            this_publishable_indicator = publishable_indicator + "_" + total_column
-            publish_columns.append(this_publishable_indicator)
-            this_explanation = explanation + "_" + total_column
-            this_top1_column = total_column + "_" + top1_column
-            this_top2_column = total_column + "_" + top2_column
-            this_cell_total_column = cell_total_column + "_" + total_column
-            disclosure_output = disclosure(input_dataframe,
-                                           this_disclosivity_marker,
-                                           this_publishable_indicator,
-                                           this_explanation,
-                                           this_cell_total_column,
-                                           this_top1_column, this_top2_column,
-                                           threshold)
-            if first_loop:
-                stage_5_output = disclosure_output
-                first_loop = False
-            else:
-                these_disclosure_columns = [this_disclosivity_marker,
-                                            this_explanation,
-                                            this_publishable_indicator]
-                keep_columns = these_disclosure_columns + unique_identifier
-                stage_5_output.drop(these_disclosure_columns, axis=1, inplace=True)
-                stage_5_output = stage_5_output.merge(disclosure_output[keep_columns],
-                                                      on=unique_identifier,
-                                                      how="left")
-
-            logger.info("Successfully completed Disclosure stage 5 for:"
-                        + str(total_column))
-
+        input_dataframe, memory_before, memory_after = dtype_plan.apply_dtype_plan(
+            input_dataframe, dtype_plan.build_dtype_plan(runtime_variables))
+        logger.info(f"Applied dtype plan - memory usage reduced from {memory_before}"
+                    f" to {memory_after} bytes")
+        stage_5_output = disclose_total_columns(input_dataframe,
+                                                disclosivity_marker,
+                                                publishable_indicator,
+                                                explanation,
+                                                total_columns,
+                                                cell_total_column,
+                                                top1_column,
+                                                top2_column,
+                                                threshold,
+                                                grouping_columns,
+                                                output_layout,
+                                                logger)
         logger.info("Successfully completed Disclosure")
 
-        # Removes the publish columns as not needed on final output.
-        stage_5_output.drop(publish_columns, axis=1, inplace=True)
-
-        final_output = {"data": stage_5_output.to_json(orient="records")}
+        output = payload_compression.pack(stage_5_output.to_json(orient="records"),
+                                          runtime_variables.get("data_compression"),
+                                          runtime_variables.get("compression_level"),
+                                          logger)
+        final_output = s3_payload.store(output, runtime_variables.get("output_location"))
     except Exception as e:
         error_message = general_functions.handle_exception(e, current_module,
                                                            run_id, context=context,
@@ -152,6 +186,82 @@ def lambda_handler(event, context):
     return final_output
 
 
+def disclose_total_columns(input_dataframe, disclosivity_marker, publishable_indicator,
+                           explanation, total_columns, cell_total_column, top1_column,
+                           top2_column, threshold, grouping_columns, output_layout,
+                           logger):
+    """
+    Applies the stage5 disclosure rule for each of the total columns.
+    :param input_dataframe: input data.
+    :param disclosivity_marker: The name of the column to put "disclosive" marker.
+    :param publishable_indicator: The name of the column to put "publish" marker.
+    :param explanation: The name of the column to put reason for pass/fail.
+    :param total_columns: The names of the columns holding the cell totals.
+    :param cell_total_column: The name of the column holding the cell total.
+    :param top1_column: The name of the column largest contributor to the cell.
+    :param top2_column: The name of the column second largest contributor to the cell.
+    :param threshold: The threshold used in the disclosure calculation.
+    :param grouping_columns: The columns which identify a cell, used to find the top
+                             contributors of any total column whose top1 and top2
+                             columns are not in the data. May be None.
+    :param output_layout: With "long", every total column's score is kept in its own
+                          column, otherwise only the first total column's score is
+                          kept, in Score. May be None.
+    :param logger: The logger to report progress to.
+    :return stage_5_output: Input dataframe with the addition of stage5 disclosure
+            info for every total column.
+    """
+    missing_columns = [
+        total_column for total_column in total_columns
+        if total_column + "_" + top1_column not in input_dataframe.columns
+        or total_column + "_" + top2_column not in input_dataframe.columns]
+    if missing_columns:
+        if not grouping_columns:
+            raise KeyError(f"The top contributor columns for {missing_columns} are"
+                           " not in the data and there are no grouping_columns to"
+                           " find them with")
+        input_dataframe = input_dataframe.assign(**contributor_topk.contributor_columns(
+            input_dataframe, grouping_columns, missing_columns,
+            [top1_column, top2_column]))
+        logger.info("Found the top contributors for:" + str(missing_columns))
+
+    stage_5_output = input_dataframe
+    scores = {}
+    for total_column in total_columns:
+        if scores:
+            # Each total column gets a fresh score rather than carrying on the last.
+            stage_5_output = stage_5_output.drop(columns="Score", errors="ignore")
+        stage_5_output = disclosure(stage_5_output,
+                                    disclosivity_marker + "_" + total_column,
+                                    publishable_indicator + "_" + total_column,
+                                    explanation + "_" + total_column,
+                                    cell_total_column + "_" + total_column,
+                                    total_column + "_" + top1_column,
+                                    total_column + "_" + top2_column,
+                                    threshold)
+        scores[disclosure_layout.score_column(total_column)] = \
+            stage_5_output.get("Score")
+
+        logger.info("Successfully completed Disclosure stage 5 for:"
+                    + str(total_column))
+
+    stage_5_output = stage_5_output.drop(columns="Score", errors="ignore")
+    if output_layout == disclosure_layout.LONG:
+        stage_5_output = stage_5_output.assign(
+            **{name: score for name, score in scores.items() if score is not None})
+    elif total_columns and scores[disclosure_layout.score_column(total_columns[0])] \
+            is not None:
+        stage_5_output["Score"] = \
+            scores[disclosure_layout.score_column(total_columns[0])]
+
+    # Removes the publish columns as not needed on final output.
+    stage_5_output = stage_5_output.drop(
+        columns=[publishable_indicator + "_" + total_column
+                 for total_column in total_columns])
+
+    return stage_5_output
+
+
 def disclosure(input_df, disclosivity_marker, publishable_indicator,
                explanation, cell_total_column, top1_column, top2_column, threshold):
     """
@@ -166,25 +276,51 @@ def disclosure(input_df, disclosivity_marker, publishable_indicator,
     :param threshold: The threshold used in the disclosure calculation.
     :return output_df: Input dataframe with the addition of stage5 disclosure info.
     """
-    def run_disclosure(row):
-        if row[publishable_indicator] not in ("Publish", "No"):
-            row["Score"] = \
-                (row[cell_total_column] - row[top1_column] - row[top2_column]) \
-                / row[top1_column]
-            if row["Score"] >= float(threshold):
-                row[disclosivity_marker] = "No"
-                row[publishable_indicator] = "Publish"
-                row[explanation] = "Stage 5 - Score is " + str(row["Score"])\
-                                   + ". This meets threshold of (>=" + threshold\
-                                   + ")"
-            else:
-                row[disclosivity_marker] = "Yes"
-                row[publishable_indicator] = "No"
-                row[explanation] = "Stage 5 - Score is " + str(row["Score"])\
-                                   + ". This does not meet threshold of (>=" \
-                                   + threshold + ")"
-        return row
-
-    output_df = input_df.apply(run_disclosure, axis=1)
+    output_df = input_df.copy()
+    to_check = pending_rows(output_df, disclosivity_marker, publishable_indicator)
+    if not to_check.any():
+        return output_df
+
+    cell_total = output_df[cell_total_column][to_check]
+    top1 = output_df[top1_column][to_check]
+    top2 = output_df[top2_column][to_check]
+    # A largest contributor of 0 scores inf, or NaN when the cell total is 0 too.
+    score = (cell_total - top1 - top2) / top1
+
+    if "Score" in output_df.columns:
+        scores = output_df["Score"].to_numpy(dtype=float, copy=True)
+    else:
+        scores = np.full(len(output_df), np.nan)
+    scores[to_check] = score
+    output_df["Score"] = scores
+
+    meets = np.zeros(len(output_df), dtype=bool)
+    meets[to_check] = (score >= float(threshold)).to_numpy()
+    fails = to_check & ~meets
+
+    score_text = "Stage 5 - Score is " + score.astype(str)
+    reasons = np.empty(len(output_df), dtype=object)
+    reasons[to_check] = score_text.to_numpy()
+    reasons[meets] = reasons[meets] + ". This meets threshold of (>=" + threshold + ")"
+    reasons[fails] = reasons[fails] + ". This does not meet threshold of (>=" \
+        + threshold + ")"
+
+    output_df[disclosivity_marker] = stage_columns.update(
+        output_df, disclosivity_marker, meets, "No", fails, "Yes")
+    output_df[publishable_indicator] = stage_columns.update(
+        output_df, publishable_indicator, meets, "Publish", fails, "No")
+    output_df[explanation] = stage_columns.update(
+        output_df, explanation, to_check, reasons[to_check])
 
     return output_df
+
+
+def pending_rows(input_df, disclosivity_marker, publishable_indicator):
+    """
+    Finds the rows the stage5 rule can change: those not yet published or suppressed.
+    :param input_df: input data.
+    :param disclosivity_marker: The name of the column holding the "disclosive" marker.
+    :param publishable_indicator: The name of the column holding the "publish" marker.
+    :return: Whether each row can change - Type: Numpy Array
+    """
+    return (~input_df[publishable_indicator].isin(["Publish", "No"])).to_numpy()
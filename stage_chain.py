@@ -0,0 +1,243 @@
+import collections
+import functools
+import io
+import json
+import time
+
+import boto3
+
+import s3_payload
+
+# The payload field holding the rest of a chained run.
+CHAIN = "chain"
+PROGRESS_PREFIX = "disclosure-progress/"
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINALISER = "finaliser"
+
+# The invoker the stages hand off with, in place of a lambda client, when the chain
+# is run locally.
+_invoker = None
+
+
+def client():
+    """
+    The client to invoke the next lambda in a chain with.
+    :return: The installed LocalInvoker, or a lambda client - Type: Service client
+    """
+    return _invoker or boto3.client("lambda", "eu-west-2")
+
+
+def progress_location(bucket_name, run_id):
+    """
+    The s3 object a chained run's progress is kept in. It is outside the run's payload
+    objects, so it is kept when they are removed.
+    :param bucket_name: The bucket - Type: String
+    :param run_id: The run id - Type: String
+    :return: {"bucket", "key"} - Type: Dict
+    """
+    return {"bucket": bucket_name, "key": f"{PROGRESS_PREFIX}{run_id}.json"}
+
+
+def read_progress(bucket_name, run_id, s3_client=None):
+    """
+    Reads a chained run's progress.
+    :param bucket_name: The bucket - Type: String
+    :param run_id: The run id - Type: String
+    :param s3_client: The client to read with - Type: Service client
+    :return: {"run_id", "stages", "completed", "current", "status", "error",
+             "updated"} - Type: Dict
+    """
+    s3_client = s3_client or boto3.client("s3", region_name="eu-west-2")
+    location = progress_location(bucket_name, run_id)
+    s3_object = s3_client.get_object(Bucket=location["bucket"], Key=location["key"])
+
+    return json.loads(s3_object["Body"].read().decode("UTF-8"))
+
+
+def record_progress(chain, status=RUNNING, completed=None, current=None, error=None,
+                    fresh=False, s3_client=None):
+    """
+    Updates a chained run's progress. The links of a chain run one after another, so
+    each can read, change and write the progress without racing.
+    :param chain: The chain - Type: Dict
+    :param status: RUNNING, DONE or FAILED - Type: String
+    :param completed: The stage which has just completed - Type: String
+    :param current: The stage (or FINALISER) which is running next - Type: String
+    :param error: Why the run failed - Type: String
+    :param fresh: Whether the run is starting, so any progress kept under its run_id
+                  is from before - Type: Boolean
+    :param s3_client: The client to write with - Type: Service client
+    :return: progress - Type: Dict
+    """
+    s3_client = s3_client or boto3.client("s3", region_name="eu-west-2")
+    if fresh:
+        progress = {"run_id": chain["run_id"],
+                    "stages": [step["stage"] for step in chain["steps"]],
+                    "completed": []}
+    else:
+        progress = read_progress(chain["bucket_name"], chain["run_id"], s3_client)
+    if completed is not None:
+        progress["completed"].append(completed)
+    progress.update({"current": current, "status": status, "error": error,
+                     "updated": time.time()})
+
+    location = progress_location(chain["bucket_name"], chain["run_id"])
+    s3_client.put_object(Bucket=location["bucket"], Key=location["key"],
+                         Body=json.dumps(progress).encode("UTF-8"))
+
+    return progress
+
+
+def build_chain(steps, finaliser_name, finaliser_payload, bucket_name, run_id):
+    """
+    Builds the chain a run's first stage is invoked with.
+    :param steps: {"stage", "function_name", "payload"} for each stage in the order
+                  they run, where the payload is the stage's RuntimeVariables less the
+                  data - Type: List of Dict
+    :param finaliser_name: The lambda which finishes the run - Type: String
+    :param finaliser_payload: The finaliser's RuntimeVariables less the data
+                              - Type: Dict
+    :param bucket_name: The bucket the data is passed through - Type: String
+    :param run_id: The run id - Type: String
+    :return: chain - Type: Dict
+    """
+    return {"run_id": run_id, "bucket_name": bucket_name, "steps": steps,
+            "position": 0, "started": time.time(),
+            "finaliser": {"function_name": finaliser_name,
+                          "payload": finaliser_payload}}
+
+
+def start(chain, envelope, lambda_client):
+    """
+    Starts a chained run by invoking its first stage, without waiting for it.
+    :param chain: The chain from build_chain - Type: Dict
+    :param envelope: The run's input, stored in s3 - Type: Dict
+    :param lambda_client: The client to invoke with - Type: Service client
+    :return: The name of the lambda invoked - Type: String
+    """
+    record_progress(chain, current=chain["steps"][0]["stage"], fresh=True)
+    return _invoke_link(chain, 0, envelope, lambda_client)
+
+
+def hand_off(chain, reply, lambda_client=None):
+    """
+    Passes a stage's reply on to the next link of the chain: the next stage, the
+    finaliser once every stage has run, or the finaliser with the error if the stage
+    failed, so the run's failure is still reported.
+    :param chain: The chain the stage was invoked with - Type: Dict
+    :param reply: The stage's reply - Type: Dict
+    :param lambda_client: The client to invoke with - Type: Service client
+    :return: The stage's reply less the data, with "next", the lambda handed off to
+             - Type: Dict
+    """
+    lambda_client = lambda_client or client()
+    stage = chain["steps"][chain["position"]]["stage"]
+    position = chain["position"] + 1
+    if not reply.get("success"):
+        record_progress(chain, FAILED, current=FINALISER,
+                        error=reply.get("error"))
+        next_name = _invoke_link(chain, len(chain["steps"]),
+                                 {"error": reply.get("error")}, lambda_client)
+    else:
+        current = chain["steps"][position]["stage"] \
+            if position < len(chain["steps"]) else FINALISER
+        record_progress(chain, completed=stage, current=current)
+        next_name = _invoke_link(chain, position, s3_payload.envelope(reply),
+                                 lambda_client)
+
+    handed_off = {key: value for key, value in reply.items() if key != "data"}
+    handed_off["next"] = next_name
+
+    return handed_off
+
+
+def _invoke_link(chain, position, envelope, lambda_client):
+    """
+    Invokes the link of a chain at a position, the finaliser coming after the stages.
+    :return: The name of the lambda invoked - Type: String
+    """
+    link = chain["steps"][position] if position < len(chain["steps"]) \
+        else chain["finaliser"]
+    payload = dict(link["payload"], **envelope)
+    payload[CHAIN] = dict(chain, position=position)
+
+    lambda_client.invoke(FunctionName=link["function_name"], InvocationType="Event",
+                         Payload=json.dumps({"RuntimeVariables": payload}))
+
+    return link["function_name"]
+
+
+def chained(lambda_handler):
+    """
+    Lets a stage's lambda_handler take part in a chained run. When the event carries
+    a chain, the stage's reply is handed off to the next link rather than waited for
+    by the wrangler. Other events, like a direct invocation or a warm-up ping, are
+    handled as before.
+    :param lambda_handler: The stage's handler - Type: Function
+    :return: The handler - Type: Function
+    """
+    @functools.wraps(lambda_handler)
+    def handler(event, context):
+        reply = lambda_handler(event, context)
+        chain = event.get("RuntimeVariables", {}).get(CHAIN) \
+            if isinstance(event, dict) else None
+        if not chain:
+            return reply
+
+        return hand_off(chain, reply)
+
+    return handler
+
+
+class LocalInvoker:
+    """
+    Stands in for the lambda client, so a chained run can be run locally. Synchronous
+    invocations call the handler straight away; asynchronous ones are queued and run,
+    in order, by run. While in a with block, the stages hand off through it too.
+    """
+
+    def __init__(self, handlers):
+        """
+        :param handlers: The handler for each lambda name - Type: Dict
+        """
+        self.handlers = handlers
+        self.invoked = []
+        self.replies = []
+        self._queue = collections.deque()
+
+    def __enter__(self):
+        global _invoker
+        self._previous, _invoker = _invoker, self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _invoker
+        _invoker = self._previous
+
+    def invoke(self, FunctionName, Payload, InvocationType="RequestResponse"):
+        self.invoked.append(FunctionName)
+        if InvocationType == "Event":
+            self._queue.append((FunctionName, Payload))
+            return {"StatusCode": 202}
+        reply = self.handlers[FunctionName](json.loads(Payload), None)
+
+        return {"StatusCode": 200,
+                "Payload": io.BytesIO(json.dumps(reply).encode("UTF-8"))}
+
+    def run(self):
+        """
+        Runs the queued invocations, and any they queue, until none are left.
+        :return: The replies, in the order they were run - Type: List of Dict
+        """
+        while self._queue:
+            function_name, payload = self._queue.popleft()
+            try:
+                reply = self.handlers[function_name](json.loads(payload), None)
+            except Exception as e:
+                reply = {"success": False, "error": str(e) or type(e).__name__}
+            self.replies.append(reply)
+
+        return self.replies
@@ -0,0 +1,20 @@
+import numpy as np
+
+
+def update(output_df, column, *masked_values):
+    """
+    Returns the values of a column with the rows in each mask replaced, for the stages
+    to write their marker, publish and explanation columns with.
+    :param output_df: The dataframe holding the column.
+    :param column: The name of the column to update.
+    :param masked_values: Pairs of boolean mask, value(s) for the masked rows.
+    :return: The updated values - Type: Numpy Array
+    """
+    if column in output_df.columns:
+        values = output_df[column].to_numpy(dtype=object, copy=True)
+    else:
+        values = np.full(len(output_df), np.nan, dtype=object)
+    for mask, value in zip(masked_values[::2], masked_values[1::2]):
+        values[mask] = value
+
+    return values
@@ -0,0 +1,366 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+import group_numbers
+import stage1_method
+import stage2_method
+import stage3_method
+import stage4_method
+import stage5_method
+
+REMOTE = "remote"
+IN_PROCESS = "in_process"
+
+# What a stage needs to see at once: each row on its own, whole cells, or the whole
+# table.
+ROW = "row"
+CELL = "cell"
+TABLE = "table"
+
+# The runtime variables every stage receives, as well as its own parameters.
+GENERIC_PARAMETERS = ["bpm_queue_url", "disclosivity_marker", "environment",
+                      "explanation", "publishable_indicator", "survey", "total_columns"]
+OPTIONAL_GENERIC_PARAMETERS = ["compression_level", "dtype_overrides", "profile",
+                               "profile_allocations", "profile_bucket"]
+
+# stage: The stage number, as used in disclosure_stages.
+# module: The stage's method module, or None if it can only be run remotely.
+# parameters: (payload name, wrangler runtime variable, in process type) for each
+#             stage specific parameter, in the order disclose_total_columns takes them.
+# reads/writes: The columns the stage reads and writes for each total column, as
+#               templates filled in from the runtime variables and the total column.
+# rule: The vectorised rule the stage applies to each total column.
+# target: Where the stage runs unless the run's stage_targets say otherwise.
+# scope: ROW, CELL or TABLE, the least of the data the stage can run on correctly.
+# optional: The payload names of the parameters which may be left out, in which case
+#           None is passed in process.
+# pending: pending_rows(data, disclosivity_marker, publishable_indicator), finding
+#          the rows of a total column the stage can still change, or None if it
+#          changes every row.
+# drops: The columns the stage removes, as templates like reads and writes.
+# derived: The reads the stage works out from the data when they are missing, given
+#          grouping_columns, each with the reads it works them out from.
+# grouped: Whether the stage always reads the grouping_columns, as well as its reads.
+StageSpec = collections.namedtuple(
+    "StageSpec",
+    ["stage", "module", "parameters", "reads", "writes", "rule", "target", "scope",
+     "optional", "pending", "drops", "derived", "grouped"],
+    defaults=[(), None, (), None, False])
+
+DISCLOSURE_OUTPUT_COLUMNS = ["{disclosivity_marker}_{total_column}",
+                             "{publishable_indicator}_{total_column}",
+                             "{explanation}_{total_column}"]
+
+STAGES = collections.OrderedDict((spec.stage, spec) for spec in [
+    StageSpec(
+        stage="1",
+        module=stage1_method,
+        parameters=[("cell_total_column", "cell_total_column", str)],
+        reads=["{cell_total_column}_{total_column}"],
+        writes=DISCLOSURE_OUTPUT_COLUMNS,
+        rule=stage1_method.disclosure,
+        target=REMOTE,
+        scope=ROW),
+    StageSpec(
+        stage="2",
+        module=stage2_method,
+        parameters=[("parent_column", "parent_column", str),
+                    ("threshold", "threshold", int)],
+        reads=["{parent_column}", "{publishable_indicator}_{total_column}"],
+        writes=DISCLOSURE_OUTPUT_COLUMNS,
+        rule=stage2_method.disclosure,
+        pending=stage2_method.pending_rows,
+        target=REMOTE,
+        scope=ROW),
+    StageSpec(
+        stage="3",
+        module=stage3_method,
+        parameters=[("dominance_n", "dominance_n", int),
+                    ("dominance_k", "dominance_k", float),
+                    ("grouping_columns", "grouping_columns", list)],
+        reads=["{total_column}", "{publishable_indicator}_{total_column}"],
+        writes=DISCLOSURE_OUTPUT_COLUMNS,
+        rule=stage3_method.disclosure,
+        pending=stage3_method.pending_rows,
+        target=REMOTE,
+        scope=CELL,
+        grouped=True),
+    StageSpec(
+        stage="5",
+        module=stage5_method,
+        parameters=[("cell_total_column", "cell_total_column", str),
+                    ("top1_column", "top1_column", str),
+                    ("top2_column", "top2_column", str),
+                    ("threshold", "stage5_threshold", str),
+                    ("grouping_columns", "grouping_columns", list),
+                    ("output_layout", "output_layout", str)],
+        reads=["{cell_total_column}_{total_column}", "{total_column}_{top1_column}",
+               "{total_column}_{top2_column}", "{publishable_indicator}_{total_column}"],
+        writes=DISCLOSURE_OUTPUT_COLUMNS + ["Score"],
+        rule=stage5_method.disclosure,
+        pending=stage5_method.pending_rows,
+        target=REMOTE,
+        scope=CELL,
+        optional=("grouping_columns", "output_layout"),
+        drops=["{publishable_indicator}_{total_column}"],
+        derived={"{total_column}_{top1_column}": ["{total_column}"],
+                 "{total_column}_{top2_column}": ["{total_column}"]}),
+    # Stage 4 protects the cells suppressed by every other stage, so it runs last.
+    StageSpec(
+        stage="4",
+        module=stage4_method,
+        parameters=[("cell_total_column", "cell_total_column", str),
+                    ("grouping_columns", "grouping_columns", list)],
+        reads=["{cell_total_column}_{total_column}",
+               "{disclosivity_marker}_{total_column}"],
+        writes=DISCLOSURE_OUTPUT_COLUMNS,
+        rule=stage4_method.disclosure,
+        pending=stage4_method.pending_rows,
+        target=REMOTE,
+        scope=TABLE,
+        grouped=True)
+])
+
+# A step of an execution plan: consecutive stages that run on the same target.
+PlanStep = collections.namedtuple("PlanStep", ["target", "stages"])
+
+
+def get_stage(stage):
+    try:
+        return STAGES[stage]
+    except KeyError:
+        raise ValueError(f"Unknown disclosure stage {stage}")
+
+
+def stage_columns(stage, runtime_variables, which="reads"):
+    """
+    Lists the columns a stage reads or writes for a run.
+    :param stage: The stage number - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param which: "reads", "writes" or "drops" - Type: String
+    :return: The column names - Type: List
+    """
+    spec = get_stage(stage)
+    columns = []
+    for total_column in runtime_variables["total_columns"]:
+        for template in getattr(spec, which):
+            column = template.format(total_column=total_column, **runtime_variables)
+            if column not in columns:
+                columns.append(column)
+    if which == "reads" and spec.grouped:
+        grouping_columns = runtime_variables.get("grouping_columns") or []
+        columns.extend(column for column in grouping_columns if column not in columns)
+
+    return columns
+
+
+def run_order(disclosure_stages):
+    """
+    The order disclosure_stages run in, which is the order they are registered
+    whatever order they are given in: 1, 2, 3, 5 and then 4, as stage 4 protects the
+    cells suppressed by every other stage.
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :return: The stages in the order they run - Type: List of String
+    """
+    stages = [get_stage(stage).stage for stage in disclosure_stages.split()]
+    return sorted(stages, key=list(STAGES).index)
+
+
+def compile_plan(disclosure_stages, stage_targets=None):
+    """
+    Compiles disclosure_stages into an execution plan. Stages run in the order they
+    are registered (see run_order), and consecutive stages which run in process are
+    fused into one step so the data is not serialised between them.
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param stage_targets: Overrides of the stages' targets e.g. {"1": "in_process"}
+                          - Type: Dict
+    :return: plan - Type: List of PlanStep
+    """
+    stage_targets = stage_targets or {}
+    plan = []
+    for stage in run_order(disclosure_stages):
+        spec = STAGES[stage]
+        target = stage_targets.get(stage, spec.target)
+        if target not in (REMOTE, IN_PROCESS):
+            raise ValueError(f"Unknown target {target} for stage {stage}")
+        if target == IN_PROCESS and spec.module is None:
+            raise ValueError(f"Stage {stage} can not be run in process")
+
+        if plan and plan[-1].target == target == IN_PROCESS:
+            plan[-1].stages.append(stage)
+        else:
+            plan.append(PlanStep(target, [stage]))
+
+    return plan
+
+
+def lambda_name(method_name, stage):
+    """
+    Builds the name of a stage's lambda from the wrangler's method_name, which has an
+    empty stage number e.g. es-disclosure-stage--method.
+    :param method_name: The method_name environment variable - Type: String
+    :param stage: The stage number - Type: String
+    :return: The lambda name - Type: String
+    """
+    index = method_name.find("-method")
+    return method_name[:index] + stage + method_name[index:]
+
+
+def build_payload(stage, runtime_variables, run_id, data):
+    """
+    Builds the payload for a remote stage invocation from the wrangler runtime
+    variables and the stage's declared parameters.
+    :param stage: The stage number - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param run_id: The run id - Type: String
+    :param data: The data to send, as JSON or as the envelope from
+                 payload_compression.pack - Type: String/Dict
+    :return: The lambda payload - Type: Dict
+    """
+    payload = {parameter: runtime_variables[parameter]
+               for parameter in GENERIC_PARAMETERS}
+    payload.update({parameter: runtime_variables[parameter]
+                    for parameter in OPTIONAL_GENERIC_PARAMETERS
+                    if runtime_variables.get(parameter) is not None})
+    payload.update(data if isinstance(data, dict) else {"data": data})
+    payload["run_id"] = run_id
+    spec = get_stage(stage)
+    for payload_name, runtime_name, _ in spec.parameters:
+        if runtime_variables.get(runtime_name) is None and payload_name in spec.optional:
+            continue
+        if runtime_name not in runtime_variables:
+            raise ValueError(f"Stage {stage} requires the runtime variable"
+                             f" '{runtime_name}'")
+        payload[payload_name] = runtime_variables[runtime_name]
+
+    return {"RuntimeVariables": payload}
+
+
+def in_process_arguments(stage, runtime_variables):
+    """
+    Picks the stage specific arguments for disclose_total_columns out of the wrangler's
+    runtime variables, converted the same way the stage lambda converts them.
+    :param stage: The stage number - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The stage specific arguments - Type: List
+    """
+    spec = get_stage(stage)
+    if spec.module is None:
+        raise ValueError(f"Stage {stage} can not be run in process")
+    arguments = []
+    for payload_name, runtime_name, to_type in spec.parameters:
+        if runtime_variables.get(runtime_name) is not None:
+            arguments.append(to_type(runtime_variables[runtime_name]))
+        elif payload_name in spec.optional:
+            arguments.append(None)
+        else:
+            raise ValueError(f"Stage {stage} requires the runtime variable"
+                             f" '{runtime_name}'")
+
+    return arguments
+
+
+def run_in_process(data, runtime_variables, stages, logger):
+    """
+    Runs a fused step of stages in process on a dataframe.
+    :param data: The input data - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :param stages: The stages to run, in order - Type: List
+    :param logger: The logger to report progress to.
+    :return: The disclosed data - Type: DataFrame
+    """
+    for stage in stages:
+        data = get_stage(stage).module.disclose_total_columns(
+            data,
+            runtime_variables["disclosivity_marker"],
+            runtime_variables["publishable_indicator"],
+            runtime_variables["explanation"],
+            runtime_variables["total_columns"],
+            *in_process_arguments(stage, runtime_variables),
+            logger)
+        logger.info("Successfully ran stage " + stage + " in process")
+
+    return data
+
+
+def pending_rows(stage, data, runtime_variables):
+    """
+    Finds the rows a stage needs to be sent: those it can still change for any total
+    column, widened to whole cells for stages which work on cells and to the whole
+    table for stages which need it.
+    :param stage: The stage number - Type: String
+    :param data: The data so far - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The positions of the rows, or None for every row - Type: Numpy Array
+    """
+    spec = get_stage(stage)
+    # A stage which works out a missing column from the data is sent all of it.
+    if spec.pending is None or any(column not in data.columns for column in
+                                   stage_columns(stage, runtime_variables)):
+        return None
+
+    pending = np.zeros(len(data), dtype=bool)
+    for total_column in runtime_variables["total_columns"]:
+        pending |= spec.pending(
+            data, runtime_variables["disclosivity_marker"] + "_" + total_column,
+            runtime_variables["publishable_indicator"] + "_" + total_column)
+
+    grouping_columns = runtime_variables.get("grouping_columns")
+    if spec.scope == CELL and grouping_columns and pending.any():
+        cell_of_row = group_numbers.number_groups(data, grouping_columns)
+        pending = np.bincount(cell_of_row[pending],
+                              minlength=cell_of_row.max() + 1)[cell_of_row] > 0
+    elif spec.scope == TABLE and pending.any():
+        return None
+    if pending.all():
+        return None
+
+    return np.flatnonzero(pending)
+
+
+def skip_stage(stage, data, runtime_variables):
+    """
+    Stands in for a stage which has no rows left to change, leaving the data as the
+    stage would have: its parameters are still checked and its drops removed.
+    :param stage: The stage number - Type: String
+    :param data: The data so far - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The data - Type: DataFrame
+    """
+    in_process_arguments(stage, runtime_variables)
+    drops = [column for column in stage_columns(stage, runtime_variables, "drops")
+             if column in data.columns]
+
+    return data.drop(columns=drops)
+
+
+def patch_rows(stage, data, rows, output, runtime_variables):
+    """
+    Writes the output of a stage run on some of the rows back into all of them. The
+    columns the stage writes are updated, the columns it adds are added, missing for
+    the other rows, and its drops are removed.
+    :param stage: The stage number - Type: String
+    :param data: The data the rows were taken from - Type: DataFrame
+    :param rows: The positions of the rows the stage was run on - Type: Numpy Array
+    :param output: The stage's output for those rows - Type: DataFrame
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The patched data - Type: DataFrame
+    """
+    writes = stage_columns(stage, runtime_variables, "writes")
+    patched = data.copy()
+    for column in output.columns:
+        if column in data.columns and column not in writes:
+            continue
+        if column in data.columns:
+            values = data[column].to_numpy(dtype=object, copy=True)
+        else:
+            values = np.full(len(data), np.nan, dtype=object)
+        values[rows] = output[column].to_numpy(dtype=object)
+        patched[column] = pd.Series(values, index=data.index).infer_objects()
+
+    drops = [column for column in stage_columns(stage, runtime_variables, "drops")
+             if column in patched.columns]
+
+    return patched.drop(columns=drops)
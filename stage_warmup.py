@@ -0,0 +1,96 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The payload of a warm-up ping.
+WARMUP = "warmup"
+COLD = "cold"
+WARM = "warm"
+FAILED = "failed"
+
+# Whether this container has yet to handle an invocation.
+_cold = True
+
+
+def handle_warmup(event):
+    """
+    Called first by each stage's lambda_handler. Notes that the container has been
+    used and, when the event is a warm-up ping, answers it.
+    :param event: The lambda event - Type: Dict
+    :return: The reply to a ping, {"success": True, "warmup": True, "cold": Boolean},
+             or None if the event is not a ping - Type: Dict
+    """
+    global _cold
+    cold, _cold = _cold, False
+    if not isinstance(event, dict) or not event.get(WARMUP):
+        return None
+
+    return {"success": True, WARMUP: True, COLD: cold}
+
+
+def ping(lambda_client, function_name):
+    """
+    Sends a warm-up ping to a lambda, never raising, as a failed ping only means the
+    stage may start cold.
+    :param lambda_client: The client to invoke with - Type: Service client
+    :param function_name: The lambda to ping - Type: String
+    :return: (COLD, WARM or FAILED, the time it finished) - Type: Tuple
+    """
+    try:
+        returned_data = lambda_client.invoke(FunctionName=function_name,
+                                             Payload=json.dumps({WARMUP: True}))
+        reply = json.loads(returned_data.get("Payload").read().decode("UTF-8"))
+        if not isinstance(reply, dict) or not reply.get(WARMUP):
+            status = FAILED
+        else:
+            status = COLD if reply.get(COLD) else WARM
+    except Exception:
+        status = FAILED
+
+    return status, time.perf_counter()
+
+
+class Warmup:
+    """
+    Pings lambdas side by side in the background, so their cold starts overlap the
+    work the caller does in the meantime.
+    """
+
+    def __init__(self, lambda_client, function_names):
+        self.started = time.perf_counter()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(function_names)))
+        self._futures = {name: self._executor.submit(ping, lambda_client, name)
+                         for name in function_names}
+
+    def wait(self, overlapped_until=None):
+        """
+        Waits for the pings to finish.
+        :param overlapped_until: When the work the pings overlap finished, from
+                                 time.perf_counter - Type: Float
+        :return: {"stages": {function name: COLD, WARM or FAILED}, "seconds": how long
+                 the pings took, "overlap_seconds": how much of that overlapped the
+                 work} - Type: Dict
+        """
+        try:
+            results = {name: future.result() for name, future in self._futures.items()}
+        finally:
+            self.close()
+        finished = max([finished for _, finished in results.values()],
+                       default=self.started)
+        if overlapped_until is None:
+            overlapped_until = finished
+
+        return {
+            "stages": {name: status for name, (status, _) in results.items()},
+            "seconds": round(finished - self.started, 3),
+            "overlap_seconds": round(
+                max(0.0, min(finished, overlapped_until) - self.started), 3)
+        }
+
+    def close(self):
+        """
+        Stops the pool the pings run on, without waiting for them, so a run which
+        fails before waiting for them does not leave it behind. Closing again does
+        nothing.
+        """
+        self._executor.shutdown(wait=False)
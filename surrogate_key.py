@@ -0,0 +1,68 @@
+import numpy as np
+
+import group_numbers
+import input_validation
+
+# The column holding the key which stands in for the unique_identifier columns.
+KEY = "identifier_key"
+
+
+def encode(data, disclosure_stages, runtime_variables):
+    """
+    Encodes the unique_identifier columns into one dense integer key, numbering the
+    identifiers in the order they first appear, so the stages carry and are sent a
+    single integer column in place of several object or int64 ones. The identifier
+    columns a stage reads, such as those which are also grouping_columns, are kept.
+    :param data: The validated input - Type: DataFrame
+    :param disclosure_stages: The stages to run e.g. "1 2 5" - Type: String
+    :param runtime_variables: The wrangler runtime variables - Type: Dict
+    :return: The data with KEY in place of the identifier columns no stage reads, those
+             columns' values for each key, in key order, and the runtime variables for
+             the stages, with unique_identifier [KEY]. When every identifier column is
+             read the data and runtime variables are returned as they are, with None.
+             - Type: Tuple(DataFrame, DataFrame, Dict)
+    """
+    unique_identifier = runtime_variables["unique_identifier"]
+    if KEY in data.columns:
+        raise ValueError(f"The input can not have a {KEY} column with surrogate_key")
+
+    reads, _ = input_validation.required_columns(
+        disclosure_stages, dict(runtime_variables, unique_identifier=[]), data.columns)
+    read = set(reads) | set(runtime_variables.get("grouping_columns") or [])
+    dropped = [column for column in data.columns
+               if column in unique_identifier and column not in read]
+    if not dropped:
+        return data, None, runtime_variables
+
+    keys = group_numbers.number_groups(data, unique_identifier)
+    if len(keys) and keys.max() < np.iinfo(np.int32).max:
+        keys = keys.astype(np.int32)
+    _, first_rows = np.unique(keys, return_index=True)
+    identifiers = data[dropped].iloc[first_rows].reset_index(drop=True)
+
+    position = min(data.columns.get_loc(column) for column in dropped)
+    keyed = data.drop(columns=dropped)
+    keyed.insert(position, KEY, keys)
+
+    return keyed, identifiers, dict(runtime_variables, unique_identifier=[KEY])
+
+
+def decode(data, identifiers):
+    """
+    Reverses encode, putting the identifier columns back in the key's place, in the
+    order they were in.
+    :param data: The output of the stages, with KEY - Type: DataFrame
+    :param identifiers: The identifier columns' values for each key, from encode
+                        - Type: DataFrame
+    :return: The output with the identifier columns in place of KEY - Type: DataFrame
+    """
+    keys = data[KEY].to_numpy(dtype=np.int64)
+    position = data.columns.get_loc(KEY)
+    restored = data.drop(columns=[KEY])
+    for offset, column in enumerate(identifiers.columns):
+        # Taken as a series so the column keeps its dtype, e.g. a categorical.
+        values = identifiers[column].iloc[keys]
+        values.index = restored.index
+        restored.insert(position + offset, column, values)
+
+    return restored
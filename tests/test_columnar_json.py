@@ -0,0 +1,52 @@
+import json
+from unittest import mock
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import columnar_json
+
+
+@pytest.mark.parametrize("accelerate", [True, False])
+@pytest.mark.parametrize(
+    "which_input_file",
+    ["tests/fixtures/test_method_input.json",
+     "tests/fixtures/test_method_2_multi_prepared_output.json",
+     "tests/fixtures/test_method_5_prepared_output.json"])
+def test_decode_records_matches_dataframe(which_input_file, accelerate):
+    with open(which_input_file, "r") as file_1:
+        file_data = pd.DataFrame(json.loads(file_1.read())).to_json(orient="records")
+
+    produced_data = columnar_json.decode_records(file_data, accelerate)
+
+    assert_frame_equal(produced_data, pd.DataFrame(json.loads(file_data)))
+
+
+@pytest.mark.parametrize("accelerate", [True, False])
+def test_decode_records_ragged_and_nested(accelerate):
+    ragged = '[{"a": 1, "b": "x"}, {"a": null}, {"c": 2.5, "a": 3}]'
+    assert_frame_equal(columnar_json.decode_records(ragged, accelerate),
+                       pd.DataFrame(json.loads(ragged)))
+
+    nested = '[{"a": 1, "b": {"c": 1}}, {"a": 2, "b": [1, 2]}]'
+    assert_frame_equal(columnar_json.decode_records(nested, accelerate),
+                       pd.DataFrame(json.loads(nested)))
+
+    # orjson can not read NaN, so the json module does.
+    not_a_number = '[{"a": NaN, "b": true}, {"a": 1.5, "b": null}]'
+    assert_frame_equal(columnar_json.decode_records(not_a_number, accelerate),
+                       pd.DataFrame(json.loads(not_a_number)))
+
+
+@pytest.mark.parametrize("accelerate", [True, False])
+def test_decode_records_rejects_non_array(accelerate):
+    with pytest.raises(ValueError):
+        columnar_json.decode_records('{"a": 1}', accelerate)
+
+
+@mock.patch("columnar_json.orjson", None)
+def test_decode_records_without_orjson():
+    records = b'[{"a": 1, "b": "x"}, {"a": null, "b": "y"}]'
+    assert_frame_equal(columnar_json.decode_records(memoryview(records)),
+                       pd.DataFrame(json.loads(records)))
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+import contributor_topk
+
+responder_data = pd.DataFrame({
+    "responder_id": [1, 2, 3, 4, 5, 6],
+    "region": [1, 1, 1, 2, 2, 3],
+    "Q608_total": [5, 40, 20, 7, np.nan, 3],
+    "Q606_other_gravel": [1, 2, 3, 4, 5, 6]
+})
+
+
+def test_top_contributors():
+    contributors = contributor_topk.top_contributors(
+        responder_data, ["region"], ["Q608_total", "Q606_other_gravel"], k=2)
+
+    assert contributors.cell_of_row.tolist() == [0, 0, 0, 1, 1, 2]
+    assert contributors.top.tolist() == [[[40, 20], [3, 2]],
+                                         [[7, 0], [5, 4]],
+                                         [[3, 0], [6, 0]]]
+    assert contributors.totals.tolist() == [[65, 6], [7, 9], [3, 6]]
+
+
+def test_contributor_columns():
+    columns = contributor_topk.contributor_columns(
+        responder_data, ["region"], ["Q608_total"],
+        ["largest_contributor", "second_largest_contributor"])
+
+    assert list(columns) == ["Q608_total_largest_contributor",
+                             "Q608_total_second_largest_contributor"]
+    assert columns["Q608_total_largest_contributor"].tolist() == [40, 40, 40, 7, 7, 3]
+    assert columns["Q608_total_second_largest_contributor"].tolist() == \
+        [20, 20, 20, 0, 0, 0]
+
+
+def test_merge_top():
+    contributors = contributor_topk.top_contributors(
+        responder_data, ["responder_id"], ["Q608_total", "Q606_other_gravel"], k=2)
+
+    # Each responder is a part of its region.
+    merged = contributor_topk.merge_top(responder_data["region"].to_numpy() - 1,
+                                        contributors.top, 3)
+    assert merged.tolist() == contributor_topk.top_contributors(
+        responder_data, ["region"], ["Q608_total", "Q606_other_gravel"], k=2).top.tolist()
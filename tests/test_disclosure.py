@@ -1,16 +1,24 @@
+import io
 import json
+import os
 from unittest import mock
 
+import boto3
 import pandas as pd
 import pytest
 from es_aws_functions import exception_classes, test_generic_library
 from moto import mock_s3
 from pandas.testing import assert_frame_equal
 
+import disclosure_layout
+import disclosure_pipeline
 import disclosure_wrangler as lambda_wrangler_function
+import payload_compression
 import stage1_method as lambda_method_function_1
 import stage2_method as lambda_method_function_2
 import stage5_method as lambda_method_function_5
+import stage_registry
+import stage_warmup
 
 wrangler_environment_variables = {
     "bucket_name": "test_bucket",
@@ -97,6 +105,41 @@ wrangler_runtime_variables = {
 }
 
 
+def stage_handler_invoke(payloads):
+    """
+    Builds a replacement for the lambda client's invoke which runs the stage lambda's
+    handler, recording the RuntimeVariables of each payload, but not the warm-up
+    pings, in payloads.
+    """
+    def invoke(FunctionName, Payload):
+        if "RuntimeVariables" in json.loads(Payload):
+            payloads.append(json.loads(Payload)["RuntimeVariables"])
+        stage = FunctionName.split("-")[3]
+        output = stage_registry.get_stage(stage).module.lambda_handler(
+            json.loads(Payload), test_generic_library.context_object)
+        return {"Payload": io.BytesIO(json.dumps(output).encode("UTF-8"))}
+
+    return invoke
+
+
+def stage_output_invoke(output):
+    """
+    Builds a replacement for the lambda client's invoke which answers every stage
+    with the rows of output it is sent, by unique_identifier.
+    """
+    def invoke(FunctionName, Payload):
+        runtime_variables = json.loads(Payload).get("RuntimeVariables", {})
+        response = {"success": True, "anomalies": []}
+        if "data" in runtime_variables:
+            sent = pd.DataFrame(json.loads(runtime_variables["data"]))
+            response["data"] = output.set_index("responder_id")\
+                .loc[sent["responder_id"]].reset_index()[output.columns]\
+                .to_json(orient="records")
+        return {"Payload": io.BytesIO(json.dumps(response).encode("UTF-8"))}
+
+    return invoke
+
+
 ##########################################################################################
 #                                     Generic                                            #
 ##########################################################################################
@@ -147,8 +190,12 @@ def test_general_error(which_lambda, which_runtime_variables,
 def test_incomplete_read_error():
     file_list = ["test_wrangler_input.json"]
 
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+
     test_generic_library.incomplete_read_error(lambda_wrangler_function,
-                                               wrangler_runtime_variables,
+                                               runtime_variables,
                                                wrangler_environment_variables,
                                                file_list,
                                                "disclosure_wrangler",
@@ -192,8 +239,12 @@ def test_key_error(mock_send_bpm_status, which_lambda, which_environment_variabl
 def test_method_error():
     file_list = ["test_wrangler_input.json"]
 
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+
     test_generic_library.wrangler_method_error(lambda_wrangler_function,
-                                               wrangler_runtime_variables,
+                                               runtime_variables,
                                                wrangler_environment_variables,
                                                file_list,
                                                "disclosure_wrangler")
@@ -337,7 +388,6 @@ def test_method_success(which_lambda, which_runtime, which_input_file, which_out
 def test_wrangler_success_passed():
     """
     Runs the wrangler function.
-    :param None
     :return Test Pass/Fail
     """
     bucket_name = wrangler_environment_variables["bucket_name"]
@@ -347,6 +397,10 @@ def test_wrangler_success_passed():
 
     test_generic_library.upload_files(client, bucket_name, file_list)
 
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+
     with mock.patch.dict(lambda_wrangler_function.os.environ,
                          wrangler_environment_variables):
         with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
@@ -362,7 +416,7 @@ def test_wrangler_success_passed():
             # the test.
             with pytest.raises(exception_classes.LambdaFailure):
                 lambda_wrangler_function.lambda_handler(
-                    wrangler_runtime_variables, test_generic_library.context_object
+                    runtime_variables, test_generic_library.context_object
                 )
 
         with open("tests/fixtures/test_method_input.json", "r") as file_1:
@@ -383,7 +437,8 @@ def test_wrangler_success_passed():
 
         # Ensures data is not in the RuntimeVariables and then compares.
         method_runtime_variables_1["RuntimeVariables"]["data"] = None
-        assert produced_dict == method_runtime_variables_1["RuntimeVariables"]
+        assert produced_dict == dict(method_runtime_variables_1["RuntimeVariables"],
+                                     total_columns=["Q608_total"])
 
 
 @mock_s3
@@ -404,6 +459,10 @@ def test_wrangler_success_returned(mock_s3_put, mock_s3_csv):
 
     test_generic_library.upload_files(client, bucket_name, file_list)
 
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+
     with open("tests/fixtures/test_method_5_prepared_output.json", "r") as file_1:
         test_data_5_out = file_1.read()
 
@@ -413,15 +472,12 @@ def test_wrangler_success_returned(mock_s3_put, mock_s3_csv):
             mock_client_object = mock.Mock()
             mock_client.return_value = mock_client_object
 
-            mock_client_object.invoke.return_value.get.return_value.read \
-                .return_value.decode.return_value = json.dumps({
-                 "data": test_data_5_out,
-                 "success": True,
-                 "anomalies": []
-                })
+            # Each stage returns the final output of the rows it is sent.
+            mock_client_object.invoke.side_effect = \
+                stage_output_invoke(pd.DataFrame(json.loads(test_data_5_out)))
 
             output = lambda_wrangler_function.lambda_handler(
-                wrangler_runtime_variables, test_generic_library.context_object
+                runtime_variables, test_generic_library.context_object
             )
 
     with open("tests/fixtures/test_wrangler_prepared_output.json", "r") as file_2:
@@ -435,4 +491,532 @@ def test_wrangler_success_returned(mock_s3_put, mock_s3_csv):
     produced_data = pd.DataFrame(json.loads(test_data_produced))
 
     assert output
-    assert_frame_equal(produced_data, prepared_data)
+    # Stage 1's output leaves stage 5 no rows to change, so it is skipped, but the
+    # publish column it drops is still dropped.
+    assert_frame_equal(produced_data, prepared_data.drop(columns="publish_Q608_total"))
+
+
+@mock_s3
+def test_wrangler_read_error_stops_warmup():
+    """
+    Runs the wrangler function without its input in s3, checking the warm-up pings'
+    pool is stopped although the run fails before they are waited for.
+    :param None
+    :return Test Pass/Fail
+    """
+    test_generic_library.create_bucket(wrangler_environment_variables["bucket_name"])
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+
+            with mock.patch.object(stage_warmup.Warmup, "close", autospec=True,
+                                   side_effect=stage_warmup.Warmup.close) as mock_close:
+                with pytest.raises(exception_classes.LambdaFailure):
+                    lambda_wrangler_function.lambda_handler(
+                        wrangler_runtime_variables, test_generic_library.context_object
+                    )
+
+    assert mock_close.call_count == 1
+    assert mock_close.call_args[0][0]._executor._shutdown
+
+
+@mock_s3
+def test_wrangler_invalid_input():
+    """
+    Runs the wrangler function on an input missing columns the stages read, which
+    fails before any stage is invoked.
+    :param None
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+
+            with pytest.raises(exception_classes.LambdaFailure) as exc_info:
+                lambda_wrangler_function.lambda_handler(
+                    wrangler_runtime_variables, test_generic_library.context_object
+                )
+
+    assert "Column cell_total_Q606_other_gravel, read by stage 1, 5, is missing" \
+        in str(exc_info.value)
+    assert "Column Q606_other_gravel_largest_contributor, read by stage 5, is missing" \
+        in str(exc_info.value)
+    # Only the warm-up pings are sent.
+    assert all("RuntimeVariables" not in json.loads(call[1]["Payload"])
+               for call in mock_client_object.invoke.call_args_list)
+
+
+@mock_s3
+@mock.patch('disclosure_wrangler.aws_functions.save_to_s3',
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch('disclosure_wrangler.aws_functions.save_dataframe_to_csv')
+@pytest.mark.parametrize("output_layout", ["wide", "long"])
+def test_wrangler_success_in_process(mock_s3_csv, mock_s3_put, output_layout):
+    """
+    Runs the wrangler function with every stage run in process, so no stage lambda is
+    invoked.
+    :param mock_s3_put - Replacement Function For The Data Saving AWS Functionality.
+    :param mock_s3_csv - Mock Out Secondary Save As Unneeded.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    runtime_variables["RuntimeVariables"]["stage_targets"] = {
+        "1": "in_process", "2": "in_process", "5": "in_process"}
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+    runtime_variables["RuntimeVariables"]["output_layout"] = output_layout
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+
+            output = lambda_wrangler_function.lambda_handler(
+                runtime_variables, test_generic_library.context_object
+            )
+
+    assert not mock_client_object.invoke.called
+
+    # The completion message carries the summary of what was suppressed.
+    message = json.loads(mock_client_object.publish.call_args[1]["Message"])
+    assert message["module"] == "Disclosure"
+    assert message["summary"]["responders"] == len(
+        pd.read_json("tests/fixtures/test_wrangler_input.json"))
+
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+    prepared_data, _ = disclosure_pipeline.run_stages(
+        in_data, runtime_variables["RuntimeVariables"], "1 2 5")
+    prepared_data = disclosure_layout.apply_layout(
+        prepared_data, runtime_variables["RuntimeVariables"])
+
+    with open("tests/fixtures/" +
+              wrangler_runtime_variables["RuntimeVariables"]["out_file_name"],
+              "r") as file_2:
+        test_data_produced = file_2.read()
+    produced_data = pd.DataFrame(json.loads(test_data_produced))
+
+    assert output
+    assert_frame_equal(produced_data.sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False,
+                       check_categorical=False)
+    assert_frame_equal(mock_s3_csv.call_args[0][0].sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False,
+                       check_categorical=False)
+
+
+@mock_s3
+@mock.patch('disclosure_wrangler.aws_functions.save_to_s3',
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch('disclosure_wrangler.aws_functions.save_dataframe_to_csv')
+def test_wrangler_success_compressed(mock_s3_csv, mock_s3_put):
+    """
+    Runs the wrangler function with data_compression, invoking the stage lambdas'
+    handlers in place of the lambdas.
+    :param mock_s3_put - Replacement Function For The Data Saving AWS Functionality.
+    :param mock_s3_csv - Mock Out Secondary Save As Unneeded.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+    runtime_variables["RuntimeVariables"]["data_compression"] = "zlib"
+    runtime_variables["RuntimeVariables"]["compression_level"] = 9
+    # Forced, as the invokes are counted.
+    runtime_variables["RuntimeVariables"]["execution_mode"] = "inline"
+
+    payloads = []
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.side_effect = stage_handler_invoke(payloads)
+
+            output = lambda_wrangler_function.lambda_handler(
+                runtime_variables, test_generic_library.context_object
+            )
+
+    assert [payload["data_compression"] for payload in payloads] == ["zlib"] * 3
+    assert [payload["compression_level"] for payload in payloads] == [9] * 3
+    # Every stage was pinged before it was invoked.
+    metrics = json.loads(mock_client_object.publish.call_args[1]["Message"])["metrics"]
+    assert set(metrics["warmup"]["stages"]) == {
+        "es-disclosure-stage-1-method", "es-disclosure-stage-2-method",
+        "es-disclosure-stage-5-method"}
+    assert set(metrics["warmup"]["stages"].values()) <= {"cold", "warm"}
+    assert metrics["execution_mode"] == "inline"
+
+    # Stage 2 is sent stage 1's output, less the row stage 1 published.
+    stage_2_input = json.loads(payload_compression.unpack(payloads[1]))
+    assert len(stage_2_input) == 9
+    assert all(row["publish_Q608_total"] != "Publish" for row in stage_2_input)
+
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+    prepared_data, _ = disclosure_pipeline.run_stages(
+        in_data, runtime_variables["RuntimeVariables"], "1 2 5")
+
+    with open("tests/fixtures/" +
+              wrangler_runtime_variables["RuntimeVariables"]["out_file_name"],
+              "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+
+    assert output
+    assert_frame_equal(produced_data.sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False)
+
+
+@mock_s3
+@mock.patch('disclosure_wrangler.aws_functions.save_to_s3',
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch('disclosure_wrangler.aws_functions.save_dataframe_to_csv')
+def test_wrangler_success_indexed(mock_s3_csv, mock_s3_put):
+    """
+    Runs the wrangler function with indexed_output, checking the output is written
+    sorted by cell with an index of its row groups.
+    :param mock_s3_put - Replacement Function For The Data Saving AWS Functionality.
+    :param mock_s3_csv - Mock Out Secondary Save As Unneeded.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+    runtime_variables["RuntimeVariables"]["grouping_columns"] = ["region", "strata"]
+    runtime_variables["RuntimeVariables"]["indexed_output"] = True
+    runtime_variables["RuntimeVariables"]["row_group_rows"] = 4
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.side_effect = stage_handler_invoke([])
+
+            output = lambda_wrangler_function.lambda_handler(
+                runtime_variables, test_generic_library.context_object
+            )
+
+    assert output
+
+    saved = [call[0][1] for call in mock_s3_put.call_args_list]
+    assert saved == ["test_wrangler_output.index.json", "test_wrangler_output.json"]
+
+    with open("tests/fixtures/test_wrangler_output.json", "r") as file_1:
+        body = file_1.read()
+    with open("tests/fixtures/test_wrangler_output.index.json", "r") as file_2:
+        index = json.loads(file_2.read())
+    os.remove("tests/fixtures/test_wrangler_output.index.json")
+    produced_data = pd.DataFrame(json.loads(body))
+
+    cells = produced_data[["region", "strata"]].apply(tuple, axis=1)
+    assert cells.is_monotonic_increasing
+    assert sum(row_group["rows"] for row_group in index["row_groups"]) == \
+        len(produced_data)
+    for row_group in index["row_groups"]:
+        rows = json.loads("[" + body[row_group["start"]:row_group["end"]] + "]")
+        assert len(rows) == row_group["rows"]
+    assert_frame_equal(mock_s3_csv.call_args[0][0].reset_index(drop=True),
+                       produced_data, check_dtype=False, check_categorical=False)
+
+
+@mock_s3
+@mock.patch('disclosure_wrangler.aws_functions.save_to_s3',
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch('disclosure_wrangler.aws_functions.save_dataframe_to_csv')
+@mock.patch('disclosure_wrangler.stage_registry.pending_rows', return_value=None)
+def test_wrangler_passes_compressed_output_on(mock_pending_rows, mock_s3_csv,
+                                              mock_s3_put):
+    """
+    Runs the wrangler function with data_compression and every stage given all the
+    rows, so each stage is sent the previous stage's output as it came back.
+    :param mock_pending_rows - Sends Every Stage All The Rows.
+    :param mock_s3_put - Replacement Function For The Data Saving AWS Functionality.
+    :param mock_s3_csv - Mock Out Secondary Save As Unneeded.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+    runtime_variables["RuntimeVariables"]["data_compression"] = "zlib"
+    # Forced, as the invokes are counted.
+    runtime_variables["RuntimeVariables"]["execution_mode"] = "inline"
+
+    payloads = []
+    responses = []
+    stage_invoke = stage_handler_invoke(payloads)
+
+    def invoke(FunctionName, Payload):
+        response = stage_invoke(FunctionName, Payload)
+        if "RuntimeVariables" in json.loads(Payload):
+            responses.append(json.loads(response["Payload"].getvalue()))
+        return response
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.side_effect = invoke
+
+            with mock.patch("disclosure_wrangler.payload_compression.repack",
+                            wraps=payload_compression.repack) as mock_repack:
+                output = lambda_wrangler_function.lambda_handler(
+                    runtime_variables, test_generic_library.context_object
+                )
+
+    assert output
+    assert len(payloads) == 3
+    assert mock_repack.call_count == 2
+    for payload, response in zip(payloads[1:], responses):
+        assert payload["data_compression"] == response["data_compression"] == "zlib"
+        assert payload["data"] == response["data"]
+
+
+@mock_s3
+@mock.patch('disclosure_wrangler.aws_functions.save_to_s3',
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch('disclosure_wrangler.aws_functions.save_dataframe_to_csv')
+@pytest.mark.parametrize(
+    "execution_mode,data_compression,expected_invokes",
+    [("s3", None, 3), ("s3", "zlib", 3), ("chunked", None, 25), ("in_process", None, 0),
+     ("auto", None, 3)])
+def test_wrangler_success_execution_mode(mock_s3_csv, mock_s3_put, execution_mode,
+                                         data_compression, expected_invokes):
+    """
+    Runs the wrangler function in each execution mode, invoking the stage lambdas'
+    handlers in place of the lambdas.
+    :param mock_s3_put - Replacement Function For The Data Saving AWS Functionality.
+    :param mock_s3_csv - Mock Out Secondary Save As Unneeded.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+    runtime_variables["RuntimeVariables"]["execution_mode"] = execution_mode
+    runtime_variables["RuntimeVariables"]["grouping_columns"] = ["region", "strata"]
+    # Small enough chunks for the 9 cells of the input to go in separate chunks.
+    runtime_variables["RuntimeVariables"]["planner_thresholds"] = {
+        "chunk_max_bytes": 100}
+    if data_compression:
+        runtime_variables["RuntimeVariables"]["data_compression"] = data_compression
+
+    payloads = []
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.side_effect = stage_handler_invoke(payloads)
+            # The payload data goes through the mocked s3.
+            mock_client.side_effect = lambda service, *args, **kwargs: \
+                s3_client if service == "s3" else mock_client_object
+
+            output = lambda_wrangler_function.lambda_handler(
+                runtime_variables, test_generic_library.context_object
+            )
+
+    # In chunked mode, stage 1 decides every row of one chunk, so its stages 2 and 5
+    # are skipped.
+    assert len(payloads) == expected_invokes
+    if execution_mode == "s3":
+        assert all("data" not in payload and payload["data_location"]
+                   for payload in payloads)
+        # The run's payload data is removed when the run completes.
+        assert "Contents" not in client.list_objects_v2(
+            Bucket=bucket_name, Prefix="disclosure-payloads/")
+    if execution_mode == "chunked":
+        cells = [{(row["region"], row["strata"]) for row in json.loads(payload["data"])}
+                 for payload in payloads
+                 if "parent_column" not in payload and "top1_column" not in payload]
+        assert sum(len(chunk) for chunk in cells) == len(set.union(*cells)) == 9
+
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+    prepared_data, _ = disclosure_pipeline.run_stages(
+        in_data, runtime_variables["RuntimeVariables"], "1 2 5")
+
+    with open("tests/fixtures/" +
+              wrangler_runtime_variables["RuntimeVariables"]["out_file_name"],
+              "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+
+    assert output
+    assert_frame_equal(produced_data.sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False)
+
+
+@mock_s3
+@mock.patch('disclosure_wrangler.aws_functions.save_to_s3',
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch('disclosure_wrangler.aws_functions.save_dataframe_to_csv')
+@pytest.mark.parametrize(
+    "planner_thresholds,disclosure_stages,expected_mode",
+    [({}, "1 2 5", "inline"),
+     ({"inline_max_bytes": 100, "chunk_max_bytes": 100}, "1 2 5", "chunked"),
+     ({"inline_max_bytes": 100}, "1 2 4 5", "s3")])
+def test_wrangler_auto_execution_mode(mock_s3_csv, mock_s3_put, planner_thresholds,
+                                      disclosure_stages, expected_mode):
+    """
+    Runs the wrangler function with the default execution_mode, checking the mode is
+    chosen from the profile of the input.
+    :param mock_s3_put - Replacement Function For The Data Saving AWS Functionality.
+    :param mock_s3_csv - Mock Out Secondary Save As Unneeded.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+
+    runtime_variables = json.loads(json.dumps(wrangler_runtime_variables))
+    # The wrangler input only has the aggregated columns for the first total column.
+    runtime_variables["RuntimeVariables"]["total_columns"] = ["Q608_total"]
+    runtime_variables["RuntimeVariables"]["disclosure_stages"] = disclosure_stages
+    runtime_variables["RuntimeVariables"]["grouping_columns"] = ["region", "strata"]
+    runtime_variables["RuntimeVariables"]["planner_thresholds"] = planner_thresholds
+
+    payloads = []
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            mock_client_object = mock.Mock()
+            mock_client.return_value = mock_client_object
+            mock_client_object.invoke.side_effect = stage_handler_invoke(payloads)
+            # The payload data goes through the mocked s3.
+            mock_client.side_effect = lambda service, *args, **kwargs: \
+                s3_client if service == "s3" else mock_client_object
+
+            output = lambda_wrangler_function.lambda_handler(
+                runtime_variables, test_generic_library.context_object
+            )
+
+    metrics = json.loads(mock_client_object.publish.call_args[1]["Message"])["metrics"]
+    assert metrics["execution_mode"] == expected_mode
+    assert payloads
+    assert all(("data" not in payload) == (expected_mode == "s3")
+               for payload in payloads)
+
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+    prepared_data, _ = disclosure_pipeline.run_stages(
+        in_data, runtime_variables["RuntimeVariables"], disclosure_stages)
+
+    with open("tests/fixtures/" +
+              wrangler_runtime_variables["RuntimeVariables"]["out_file_name"],
+              "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+
+    assert output
+    assert_frame_equal(produced_data.sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False)
+
+
+@mock_s3
+@mock.patch('disclosure_wrangler.aws_functions.send_bpm_status')
+@mock.patch('disclosure_wrangler.aws_functions.save_to_s3')
+@mock.patch('disclosure_wrangler.aws_functions.save_dataframe_to_csv')
+def test_batch_wrangler(mock_s3_csv, mock_s3_put, mock_bpm_status):
+    """
+    Runs the batch wrangler with two good runs and one without its out_file_name.
+    :param mock_s3_csv - Mock Out The CSV Save.
+    :param mock_s3_put - Mock Out The JSON Save.
+    :param mock_bpm_status - Mock Out The BPM Status Message.
+    :return Test Pass/Fail
+    """
+    bucket_name = wrangler_environment_variables["bucket_name"]
+    client = test_generic_library.create_bucket(bucket_name)
+
+    file_list = ["test_wrangler_input.json"]
+
+    test_generic_library.upload_files(client, bucket_name, file_list)
+
+    shared = json.loads(json.dumps(wrangler_runtime_variables["RuntimeVariables"]))
+    shared["total_columns"] = ["Q608_total"]
+    shared["stage_targets"] = {"1": "in_process", "2": "in_process", "5": "in_process"}
+    runs = [{"run_id": "1", "out_file_name": "out_1.json"},
+            {"run_id": "2", "out_file_name": None},
+            {"run_id": "3", "out_file_name": "out_3.json", "output_layout": "long"}]
+    batch_runtime_variables = {
+        "RuntimeVariables": {
+            "bpm_queue_url": "fake_queue_url",
+            "environment": "sandbox",
+            "max_concurrency": 2,
+            "run_id": "666",
+            "runs": runs,
+            "shared": shared,
+            "survey": "BMI_SG",
+            "total_steps": 6
+        }
+    }
+
+    with mock.patch.dict(lambda_wrangler_function.os.environ,
+                         wrangler_environment_variables):
+        with mock.patch("disclosure_wrangler.boto3.client") as mock_client:
+            output = lambda_wrangler_function.batch_lambda_handler(
+                batch_runtime_variables, test_generic_library.context_object)
+
+    assert [call[0][0] for call in mock_client.call_args_list].count("lambda") == 1
+    # The start status is only sent once, for the batch.
+    statuses = [call[0][2] for call in mock_bpm_status.call_args_list]
+    assert statuses.count("IN PROGRESS") == 1
+    assert not output["success"]
+    assert [run["run_id"] for run in output["runs"]] == ["1", "2", "3"]
+    assert [run["success"] for run in output["runs"]] == [True, False, True]
+    assert "out_file_name" in output["runs"][1]["error"]
+    assert sorted(call[0][1] for call in mock_s3_put.call_args_list) == \
+        ["out_1.json", "out_3.json"]
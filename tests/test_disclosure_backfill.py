@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import disclosure_backfill
+
+runtime_variables = {
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "explanation": "reason",
+    "final_output_location": "disclosure_output_{period}.csv",
+    "out_file_name": "disclosure_output.json",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "stage5_threshold": "1",
+    "threshold": "7",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "unique_identifier": ["responder_id"]
+}
+
+
+def test_period_key():
+    assert disclosure_backfill.period_key("out_{period}.json", "201809") == \
+        "out_201809.json"
+    assert disclosure_backfill.period_key("disclosure/out.json", "201809") == \
+        "201809/disclosure/out.json"
+
+
+def test_run_backfill(tmpdir):
+    inputs = []
+    for period in ["201803", "201806"]:
+        inputs.append(str(tmpdir.join(period + ".json")))
+        shutil.copy("tests/fixtures/test_method_multi_input.json", inputs[-1])
+    # A period with a missing column fails without stopping the others.
+    inputs.append(str(tmpdir.join("201809.json")))
+    shutil.copy("tests/fixtures/test_method_bad_input.json", inputs[-1])
+
+    output_dir = str(tmpdir.mkdir("output"))
+    jobs = disclosure_backfill.build_jobs(runtime_variables, inputs=inputs)
+    results = disclosure_backfill.run_backfill(jobs, runtime_variables, 2, output_dir)
+
+    assert [result["period"] for result in results] == ["201803", "201806", "201809"]
+    assert [result["success"] for result in results] == [True, True, False]
+    assert "KeyError" in results[2]["error"]
+
+    with open("tests/fixtures/test_method_5_multi_prepared_output.json", "r") as file_1:
+        prepared_data = pd.DataFrame(json.loads(file_1.read()))
+    for period in ["201803", "201806"]:
+        with open(os.path.join(output_dir, period, "disclosure_output.json")) as file_2:
+            produced_data = pd.DataFrame(json.loads(file_2.read()))
+        assert_frame_equal(produced_data.sort_index(axis=1), prepared_data)
+        assert os.path.exists(
+            os.path.join(output_dir, "disclosure_output_" + period + ".csv"))
@@ -0,0 +1,113 @@
+import json
+
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_s3
+from pandas.testing import assert_frame_equal
+
+import disclosure_index
+
+grouping_columns = ["region", "strata"]
+unique_identifier = ["responder_id"]
+
+
+def read_input():
+    return pd.read_json("tests/fixtures/test_wrangler_input.json", dtype=False)
+
+
+def put_indexed(s3_client, body, index):
+    s3_client.create_bucket(
+        Bucket="test_bucket",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"})
+    s3_client.put_object(Bucket="test_bucket", Key="output.json", Body=body)
+    s3_client.put_object(Bucket="test_bucket", Key="output.index.json",
+                         Body=json.dumps(index))
+
+
+def test_index_file_name():
+    assert disclosure_index.index_file_name("output.json") == "output.index.json"
+    assert disclosure_index.index_file_name("output") == "output.index.json"
+
+
+def test_write_indexed():
+    data, body, index = disclosure_index.write_indexed(
+        read_input(), grouping_columns, unique_identifier, 3)
+
+    expected = read_input().sort_values(grouping_columns, kind="mergesort")\
+        .reset_index(drop=True)
+    assert_frame_equal(data, expected)
+    assert_frame_equal(pd.DataFrame(json.loads(body)), expected)
+
+    encoded = body.encode("UTF-8")
+    first_row = 0
+    for row_group in index["row_groups"]:
+        rows = json.loads(b"[" + encoded[row_group["start"]:row_group["end"]] + b"]")
+        assert len(rows) == row_group["rows"]
+        group_data = pd.DataFrame(rows)
+        assert_frame_equal(group_data, expected.iloc[
+            first_row:first_row + len(rows)].reset_index(drop=True))
+        first_row += len(rows)
+    assert first_row == len(expected)
+
+    cells = expected.groupby(grouping_columns).ngroups
+    assert len(index["cells"]) == cells
+    assert len(index["identifiers"]) == expected["responder_id"].nunique()
+    # Every row of a cell is in the row group the index gives for it.
+    for row_number, row in expected.iterrows():
+        key = disclosure_index.lookup_key([row["region"], row["strata"]])
+        group = index["cells"][key]
+        group_start = sum(row_group["rows"]
+                          for row_group in index["row_groups"][:group])
+        assert group_start <= row_number < \
+            group_start + index["row_groups"][group]["rows"]
+
+
+def test_write_indexed_no_grouping_columns():
+    with pytest.raises(ValueError):
+        disclosure_index.write_indexed(read_input(), [], unique_identifier)
+
+
+@mock_s3
+def test_lookup():
+    data, body, index = disclosure_index.write_indexed(
+        read_input(), grouping_columns, unique_identifier, 1)
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+    put_indexed(s3_client, body, index)
+
+    cell = [int(data["region"][0]), data["strata"][0]]
+    last = data.iloc[-1]
+    identifier = int(last["responder_id"])
+    get_object = s3_client.get_object
+    calls = []
+
+    def counted_get_object(**kwargs):
+        calls.append(kwargs)
+        return get_object(**kwargs)
+
+    s3_client.get_object = counted_get_object
+    output = disclosure_index.lookup("test_bucket", "output.json", cells=[cell],
+                                     identifiers=[identifier], s3_client=s3_client)
+
+    wanted = ((data["region"] == cell[0]) & (data["strata"] == cell[1])) | \
+        (data["responder_id"] == identifier)
+    assert_frame_equal(output, data[wanted].reset_index(drop=True),
+                       check_dtype=False)
+    # The index, then one ranged read for each of the two row groups, which are not
+    # next to each other.
+    assert len(calls) == 3
+    assert all("Range" in call for call in calls[1:])
+
+    # Adjacent row groups are read together.
+    calls.clear()
+    cells = [[int(region), strata] for region, strata
+             in data[grouping_columns].drop_duplicates().head(2).values]
+    output = disclosure_index.lookup("test_bucket", "output.json", cells=cells,
+                                     index=index, s3_client=s3_client)
+    assert len(calls) == 1
+    assert_frame_equal(output, data.merge(pd.DataFrame(cells, columns=grouping_columns)),
+                       check_dtype=False)
+
+    missing = disclosure_index.lookup("test_bucket", "output.json", cells=[[0, "X"]],
+                                      index=index, s3_client=s3_client)
+    assert missing.empty
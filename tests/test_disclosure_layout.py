@@ -0,0 +1,111 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import disclosure_layout
+import disclosure_pipeline
+
+runtime_variables = {
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "explanation": "reason",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "stage5_threshold": "1",
+    "threshold": "7",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "unique_identifier": ["responder_id"]
+}
+
+
+def run_stages(disclosure_stages, **extra_runtime_variables):
+    with open("tests/fixtures/test_method_multi_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+    data, _ = disclosure_pipeline.run_stages(
+        in_data, {**runtime_variables, **extra_runtime_variables}, disclosure_stages)
+    return data
+
+
+def test_to_long():
+    wide_data = run_stages("1 2")
+    long_data = disclosure_layout.to_long(wide_data, runtime_variables)
+
+    # Without grouping_columns every row is a cell.
+    assert list(long_data.columns) == ["responder_id", "total_column", "disclosive",
+                                       "publish", "reason_code", "Score"]
+    assert len(long_data) == 2 * len(wide_data)
+    for total_column in runtime_variables["total_columns"]:
+        question = long_data[long_data["total_column"] == total_column]
+        for value_name in ["disclosive", "publish"]:
+            assert question[value_name].tolist() == \
+                wide_data[value_name + "_" + total_column].tolist()
+        assert question["reason_code"].tolist() == \
+            ("S" + wide_data["reason_" + total_column].str.extract(
+                r"Stage (\d)", expand=False)).tolist()
+    assert long_data["Score"].isna().all()
+
+
+def test_to_long_cells():
+    wide_data = pd.DataFrame({
+        "responder_id": [1, 2, 3, 4, 5],
+        "region": [2, 1, 2, 1, 3],
+        "disclosive_Q608_total": ["No", "No", "Yes", "No", "No"],
+        "reason_Q608_total": ["Passed Stage 2", "Passed Stage 2",
+                              "Stage 2 - Only 1 parent references in cell",
+                              "Passed Stage 2", "Stage 1 - Total column is 0"],
+        "disclosive_Q606_other_gravel": ["No", "Yes", "No", "No", "No"],
+        "reason_Q606_other_gravel": [
+            "Passed Stage 5", "Stage 5 - Score is 0.5", "Passed Stage 5",
+            "Passed Stage 5", "Passed Stage 5"],
+        "Score": [0.1, 0.5, 0.2, 0.3, 0.4]
+    })
+
+    long_data = disclosure_layout.to_long(
+        wide_data, {**runtime_variables, "grouping_columns": ["region"]})
+
+    # One row per cell and total column, with the values of the cell's first
+    # disclosive row, or of its first row.
+    assert list(long_data.columns) == ["region", "total_column", "disclosive",
+                                       "reason_code", "Score"]
+    assert long_data["region"].tolist() == [2, 1, 3] * 2
+    assert long_data["total_column"].tolist() == ["Q608_total"] * 3 \
+        + ["Q606_other_gravel"] * 3
+    assert long_data["disclosive"].tolist() == ["Yes", "No", "No", "No", "Yes", "No"]
+    assert long_data["reason_code"].tolist() == ["S2", "S2", "S1", "S5", "S5", "S5"]
+    assert long_data["Score"].tolist()[:3] == [0.2, 0.5, 0.4]
+    assert long_data["Score"].iloc[3:].isna().all()
+
+
+def test_to_long_keeps_every_score():
+    wide_data = run_stages("1 2 5")
+    long_run = run_stages("1 2 5", output_layout="long")
+    long_data = disclosure_layout.to_long(long_run, runtime_variables)
+
+    assert "publish" not in long_data.columns
+    first_question = long_data[long_data["total_column"] == "Q608_total"]
+    np.testing.assert_array_equal(first_question["Score"].to_numpy(),
+                                  wide_data["Score"].to_numpy())
+    second_question = long_data[long_data["total_column"] == "Q606_other_gravel"]
+    assert second_question["Score"].notna().any()
+
+    # The long run only differs from the wide one in its score columns.
+    assert_frame_equal(
+        long_run.drop(columns=["Score_Q608_total", "Score_Q606_other_gravel"]),
+        wide_data.drop(columns="Score"))
+
+
+def test_apply_layout():
+    wide_data = run_stages("1")
+
+    assert disclosure_layout.apply_layout(wide_data, runtime_variables) is wide_data
+    assert len(disclosure_layout.apply_layout(
+        wide_data, {**runtime_variables, "output_layout": "long"})) == \
+        2 * len(wide_data)
+    with pytest.raises(ValueError, match="Unknown output_layout tall"):
+        disclosure_layout.apply_layout(wide_data,
+                                       {**runtime_variables, "output_layout": "tall"})
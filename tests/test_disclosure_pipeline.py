@@ -0,0 +1,104 @@
+import json
+import logging
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import columnar_json
+import disclosure_cli
+import disclosure_pipeline
+
+runtime_variables = {
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "explanation": "reason",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "stage5_threshold": "1",
+    "threshold": "7",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "unique_identifier": ["responder_id"]
+}
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_run_stages(workers, caplog):
+    with open("tests/fixtures/test_method_multi_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+
+    with caplog.at_level(logging.INFO):
+        produced_data, timings = disclosure_pipeline.run_stages(
+            in_data, runtime_variables, "5 1 2", workers=workers)
+
+    with open("tests/fixtures/test_method_5_multi_prepared_output.json", "r") as file_2:
+        prepared_data = pd.DataFrame(json.loads(file_2.read()))
+
+    assert sorted(timings) == ["1", "2", "5"]
+    assert "Running the stages in the order 1 2 5, rather than as given (5 1 2)" \
+        in caplog.text
+    assert_frame_equal(produced_data.sort_index(axis=1), prepared_data)
+
+
+def test_run_stages_whole_cells():
+    # Cells of different sizes, in no order, so contiguous chunks would cut them.
+    generator = np.random.RandomState(0)
+    cell = generator.permutation(np.repeat(np.arange(40), generator.randint(1, 8, 40)))
+    in_data = pd.DataFrame({"responder_id": np.arange(len(cell)), "cell": cell,
+                            "ent_ref_count": 1})
+    for total_column in runtime_variables["total_columns"]:
+        in_data[total_column] = generator.randint(0, 100, len(in_data))
+        in_data["cell_total_" + total_column] = \
+            in_data.groupby("cell")[total_column].transform("sum")
+    # Stage 5 works the largest contributors out for each cell.
+    variables = dict(runtime_variables, grouping_columns=["cell"], dominance_n="1",
+                     dominance_k="60", stage5_threshold="0.2")
+
+    produced_data, _ = disclosure_pipeline.run_stages(in_data, variables, "1 3 5",
+                                                      workers=3)
+    prepared_data, _ = disclosure_pipeline.run_stages(in_data, variables, "1 3 5")
+
+    assert_frame_equal(produced_data, prepared_data)
+    with pytest.raises(ValueError, match="a stage needs the whole table"):
+        disclosure_pipeline.run_stages(in_data, variables, "1 4", workers=3)
+
+
+def test_run_stages_unsupported_stage():
+    with pytest.raises(ValueError,
+                       match="Stage 3 requires the runtime variable 'dominance_n'"):
+        disclosure_pipeline.run_stages(pd.DataFrame(), runtime_variables, "1 3")
+
+
+def test_cli_main(tmpdir):
+    runtime_file = str(tmpdir.join("runtime.json"))
+    with open(runtime_file, "w") as file_1:
+        json.dump({"RuntimeVariables": runtime_variables}, file_1)
+    output_file = str(tmpdir.join("output.json"))
+
+    assert disclosure_cli.main(["tests/fixtures/test_method_multi_input.json",
+                                output_file, "--stages", "1 2 5",
+                                "--runtime-variables", runtime_file,
+                                "--memory-map", "--timings"]) == 0
+
+    with open(output_file, "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+    with open("tests/fixtures/test_method_5_multi_prepared_output.json", "r") as file_3:
+        prepared_data = pd.DataFrame(json.loads(file_3.read()))
+
+    assert_frame_equal(produced_data.sort_index(axis=1), prepared_data)
+
+
+@pytest.mark.parametrize("accelerator", [columnar_json.orjson, None])
+def test_read_input_memory_map(accelerator):
+    file_name = "tests/fixtures/test_method_multi_input.json"
+    with open(file_name, "r") as file:
+        prepared_data = pd.DataFrame(json.loads(file.read()))
+
+    with mock.patch("columnar_json.orjson", accelerator):
+        produced_data = disclosure_cli.read_input(file_name, memory_map=True)
+
+    assert_frame_equal(produced_data, prepared_data)
@@ -0,0 +1,161 @@
+import json
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+from es_aws_functions import test_generic_library
+
+import disclosure_pipeline
+import disclosure_preview
+import disclosure_wrangler
+
+runtime_variables = {
+    "bpm_queue_url": "fake_queue_url",
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "environment": "sandbox",
+    "explanation": "reason",
+    "final_output_location": "fixtures/",
+    "grouping_columns": ["region", "cell"],
+    "in_file_name": "test_preview_input",
+    "out_file_name": "test_preview_output.json",
+    "parent_column": "ent_ref_count",
+    "preview": True,
+    "preview_seed": 7,
+    "publishable_indicator": "publish",
+    "run_id": "666",
+    "sns_topic_arn": "fake_sns_arn",
+    "stage5_threshold": "0.5",
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "total_steps": 6,
+    "unique_identifier": ["responder_id"]
+}
+
+
+def make_data(cell_count, seed=0):
+    """
+    Responders in cells of regions of different sizes, with the cell aggregates the
+    stages read.
+    """
+    generator = np.random.RandomState(seed)
+    sizes = generator.randint(1, 8, cell_count)
+    cell = np.repeat(np.arange(cell_count), sizes)
+    data = pd.DataFrame({
+        "responder_id": np.arange(len(cell)),
+        "region": (np.sqrt(cell) % 5).astype(int).astype(str),
+        "cell": cell})
+    grouped = data.groupby("cell")
+    data["ent_ref_count"] = grouped["responder_id"].transform("size")
+    for total_column in runtime_variables["total_columns"]:
+        data[total_column] = generator.randint(0, 100, len(data)) \
+            * (generator.random_sample(len(data)) > 0.1)
+        totals = data.groupby("cell")[total_column]
+        data["cell_total_" + total_column] = totals.transform("sum")
+        data[total_column + "_largest_contributor"] = totals.transform("max")
+        data[total_column + "_second_largest_contributor"] = totals.transform(
+            lambda values: values.nlargest(2).iloc[-1] if len(values) > 1 else 0)
+        data.loc[data[total_column + "_largest_contributor"] == 0,
+                 total_column + "_largest_contributor"] = 1
+
+    return data
+
+
+def suppressed_shares(data):
+    """
+    The share of cells the stages suppress in each total column, from a full run.
+    """
+    output, _ = disclosure_pipeline.run_stages(data, runtime_variables,
+                                               runtime_variables["disclosure_stages"])
+    return {total_column: output.groupby("cell")["disclosive_" + total_column]
+            .apply(lambda markers: (markers == "Yes").any()).mean()
+            for total_column in runtime_variables["total_columns"]}
+
+
+def test_preview_every_cell():
+    data = make_data(60)
+
+    preview = disclosure_preview.preview(
+        data, dict(runtime_variables, preview_cells=1000))
+
+    assert preview["sampled_cells"] == preview["cells"] == 60
+    assert preview["sampled_rows"] == len(data)
+    for total_column, share in suppressed_shares(data).items():
+        estimate = preview["total_columns"][total_column]
+        assert estimate["rate"] == estimate["low"] == estimate["high"] == \
+            round(share, 4)
+        assert sum(stage["rate"] for stage in estimate["stages"].values()) == \
+            pytest.approx(estimate["rate"], abs=1e-3)
+        assert set(estimate["stages"]) <= {"2", "5"}
+
+
+def test_preview_sample():
+    data = make_data(5000)
+
+    preview = disclosure_preview.preview(data, dict(runtime_variables,
+                                                    preview_cells=300))
+    again = disclosure_preview.preview(data, dict(runtime_variables,
+                                                  preview_cells=300))
+
+    # Whole cells are sampled.
+    sampled_cells = preview["sampled_cells"]
+    assert 300 <= sampled_cells <= 300 + 2 * preview["strata"]
+    assert preview["strata"] == data["region"].nunique()
+    assert preview["sampled_rows"] < len(data)
+    for total_column, share in suppressed_shares(data).items():
+        estimate = preview["total_columns"][total_column]
+        assert estimate["low"] < share < estimate["high"]
+        assert estimate["high"] - estimate["low"] < 0.15
+    # The same seed gives the same sample.
+    assert {key: value for key, value in again.items() if key != "seconds"} == \
+        {key: value for key, value in preview.items() if key != "seconds"}
+
+
+def test_allocate():
+    allocated = disclosure_preview._allocate(np.array([100, 5, 1, 300]), 40)
+
+    assert allocated.tolist() == [10, 2, 1, 30]
+    assert disclosure_preview._allocate(np.array([3, 4]), 10).tolist() == [3, 4]
+
+
+@pytest.mark.parametrize("changes,message", [
+    ({"disclosure_stages": "1 2 4"}, "Stage 4 needs the whole table"),
+    ({"preview_strata": ["county"]}, "preview_strata ['county'] are not"
+                                     " grouping_columns")])
+def test_preview_errors(changes, message):
+    with pytest.raises(ValueError) as exc_info:
+        disclosure_preview.preview(make_data(10), dict(runtime_variables, **changes))
+
+    assert message in str(exc_info.value)
+
+
+@mock.patch("disclosure_wrangler.send_summary_message")
+@mock.patch("disclosure_wrangler.aws_functions.save_to_s3")
+@mock.patch("disclosure_wrangler.aws_functions.send_bpm_status")
+@mock.patch("disclosure_wrangler.aws_functions.read_dataframe_from_s3",
+            return_value=make_data(200))
+def test_wrangler_preview(mock_read, mock_bpm, mock_s3_put, mock_sns):
+    lambda_client = mock.Mock()
+
+    with mock.patch.dict(disclosure_wrangler.os.environ,
+                         {"bucket_name": "test_bucket",
+                          "method_name": "es-disclosure-stage--method"}):
+        output = disclosure_wrangler.run_disclosure(
+            {"RuntimeVariables": runtime_variables}, test_generic_library.context_object,
+            lambda_client=lambda_client)
+
+    assert output["success"]
+    assert output["preview"]["cells"] == 200
+    assert sorted(output["preview"]["total_columns"]) == ["Q606_other_gravel",
+                                                          "Q608_total"]
+    json.dumps(output)
+    # Nothing is invoked, written or sent.
+    assert not lambda_client.invoke.called
+    assert not mock_s3_put.called
+    assert not mock_sns.called
+    assert not mock_bpm.called
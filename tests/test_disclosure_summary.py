@@ -0,0 +1,85 @@
+import pandas as pd
+
+import disclosure_summary
+
+runtime_variables = {
+    "disclosivity_marker": "disclosive",
+    "explanation": "reason",
+    "grouping_columns": ["region"],
+    "publishable_indicator": "publish",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "unique_identifier": ["responder_id"]
+}
+
+wide_data = pd.DataFrame({
+    "responder_id": [1, 2, 3],
+    "region": [1, 1, 2],
+    "disclosive_Q608_total": ["Yes", "Yes", "No"],
+    "reason_Q608_total": ["Stage 2 - Only 1 parent references in cell"] * 2
+    + ["Stage 5 - Score is 2.0. This meets threshold of (>=1)"],
+    "disclosive_Q606_other_gravel": ["No", "No", "Yes"],
+    "reason_Q606_other_gravel": [
+        "Stage 1 - Total column is 0", "Stage 1 - Total column is 0",
+        "Stage 4 - Suppressed to protect a disclosive cell in the same total"],
+    "Score": [None, None, 2.0]
+})
+
+
+def test_summarise():
+    summary = disclosure_summary.summarise(wide_data, runtime_variables)
+
+    assert summary["responders"] == 3
+    assert summary["counts"] == [
+        {"total_column": "Q606_other_gravel", "status": "No", "stage": "4",
+         "responders": 1, "cells": 1},
+        {"total_column": "Q606_other_gravel", "status": "Publish", "stage": "1",
+         "responders": 2, "cells": 1},
+        {"total_column": "Q608_total", "status": "No", "stage": "2",
+         "responders": 2, "cells": 1},
+        {"total_column": "Q608_total", "status": "Publish", "stage": "5",
+         "responders": 1, "cells": 1}]
+    assert summary["scores"] == {"Q608_total": {
+        "count": 1, "min": 2.0, "p10": 2.0, "p25": 2.0, "p50": 2.0, "p75": 2.0,
+        "p90": 2.0, "max": 2.0}}
+
+
+def test_summarise_without_grouping_columns():
+    summary = disclosure_summary.summarise(
+        wide_data.assign(publish_Q608_total=["No", "No", "Publish"],
+                         publish_Q606_other_gravel=["Publish", "Publish", "No"]),
+        {**runtime_variables, "grouping_columns": None})
+
+    assert [count["cells"] for count in summary["counts"]] == [None] * 4
+    assert [count["status"] for count in summary["counts"]] == \
+        ["No", "Publish", "No", "Publish"]
+
+
+def test_summarise_long_scores():
+    summary = disclosure_summary.summarise(
+        wide_data.drop(columns="Score").assign(Score_Q608_total=[None, None, 2.0],
+                                               Score_Q606_other_gravel=[1.0, 3.0, None]),
+        runtime_variables)
+
+    assert summary["scores"]["Q608_total"]["count"] == 1
+    assert summary["scores"]["Q606_other_gravel"] == {
+        "count": 2, "min": 1.0, "p10": 1.2, "p25": 1.5, "p50": 2.0, "p75": 2.5,
+        "p90": 2.8, "max": 3.0}
+
+
+def test_summarise_not_applicable():
+    passed_data = wide_data.assign(
+        reason_Q608_total=["Passed Stage 2"] * 2
+        + ["Stage 5 - Score is 2.0. This meets threshold of (>=1)"],
+        disclosive_Q608_total=["No", "No", "No"])
+
+    for data in [passed_data,
+                 passed_data.assign(publish_Q608_total=["Not Applicable"] * 2
+                                    + ["Publish"])]:
+        summary = disclosure_summary.summarise(
+            data, {**runtime_variables, "total_columns": ["Q608_total"]})
+
+        assert summary["counts"] == [
+            {"total_column": "Q608_total", "status": "Not Applicable", "stage": "2",
+             "responders": 2, "cells": 1},
+            {"total_column": "Q608_total", "status": "Publish", "stage": "5",
+             "responders": 1, "cells": 1}]
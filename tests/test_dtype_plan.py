@@ -0,0 +1,72 @@
+import json
+import logging
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+import disclosure_wrangler
+import dtype_plan
+import stage_registry
+
+runtime_variables = {
+    "cell_total_column": "cell_total",
+    "parent_column": "ent_ref_count",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "unique_identifier": ["responder_id"]
+}
+
+
+def test_build_dtype_plan():
+    plan = dtype_plan.build_dtype_plan(
+        {**runtime_variables, "dtype_overrides": {"county_name": "category"}})
+
+    assert plan["default"] == dtype_plan.AUTO
+    for column in ["responder_id", "Q608_total", "cell_total_Q606_other_gravel",
+                   "Q608_total_largest_contributor", "ent_ref_count"]:
+        assert plan["columns"][column] == dtype_plan.EXACT
+    assert plan["columns"]["county_name"] == "category"
+
+
+def test_apply_dtype_plan():
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+
+    produced_data, memory_before, memory_after = dtype_plan.apply_dtype_plan(
+        in_data, dtype_plan.build_dtype_plan(runtime_variables))
+
+    assert memory_after < memory_before
+    assert produced_data["county"].dtype == "int8"
+    assert produced_data["marine"].dtype == "category"
+    assert produced_data["responder_id"].dtype == "int64"
+    assert produced_data["cell_total_Q608_total"].dtype == "int64"
+    # The wire format is unaffected by the conversion.
+    assert produced_data.to_json(orient="records") == in_data.to_json(orient="records")
+
+
+@pytest.mark.parametrize("stage_targets,applied", [
+    ({"1": stage_registry.REMOTE, "2": stage_registry.REMOTE}, 0),
+    ({"1": stage_registry.IN_PROCESS, "2": stage_registry.IN_PROCESS}, 1),
+    ({"1": stage_registry.REMOTE, "2": stage_registry.IN_PROCESS}, 1)])
+def test_wrangler_applies_plan_in_process(stage_targets, applied):
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+    variables = {**runtime_variables, "disclosivity_marker": "disclosive",
+                 "explanation": "reason", "publishable_indicator": "publish",
+                 "stage5_threshold": "0.1", "threshold": "3",
+                 "total_columns": ["Q608_total"]}
+    plan = stage_registry.compile_plan("1 2", stage_targets)
+
+    def invoke_stage(data, disclosure_step, *args):
+        return stage_registry.run_in_process(data, variables, [disclosure_step],
+                                             logging.getLogger())
+
+    with mock.patch("disclosure_wrangler._invoke_stage", side_effect=invoke_stage), \
+            mock.patch("disclosure_wrangler.dtype_plan.apply_dtype_plan",
+                       wraps=dtype_plan.apply_dtype_plan) as mock_apply:
+        disclosure_wrangler._run_plan(in_data, plan, variables, "666", "method",
+                                      None, logging.getLogger())
+
+    assert mock_apply.call_count == applied
@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import execution_planner
+
+with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+    input_data = pd.DataFrame(json.loads(file_1.read()))
+
+
+def profile(rows, memory_bytes, payload_bytes):
+    return execution_planner.DataProfile(rows, 24, memory_bytes, payload_bytes)
+
+
+@pytest.mark.parametrize(
+    "data_profile,disclosure_stages,expected_mode,expected_chunks",
+    [(profile(1000, 10 ** 6, 10 ** 6), "1 2 5", "inline", 1),
+     (profile(10 ** 5, 10 ** 8, 4 * 10 ** 6), "1 2 5", "inline", 1),
+     (profile(10 ** 6, 10 ** 9, 10 ** 8), "1 2 3 5", "chunked", 24),
+     (profile(10 ** 6, 10 ** 9, 10 ** 8), "1 2 4 5", "s3", 1)])
+def test_choose_mode(data_profile, disclosure_stages, expected_mode, expected_chunks):
+    decision = execution_planner.choose_mode(data_profile, disclosure_stages, {})
+
+    assert (decision.mode, decision.chunks) == (expected_mode, expected_chunks)
+    assert len(decision.reasons) == 2
+
+
+def test_choose_mode_thresholds():
+    # Small runs are only run in the wrangler when the thresholds allow it.
+    runtime_variables = {"planner_thresholds": {"in_process_max_rows": 20000}}
+    decision = execution_planner.choose_mode(profile(1000, 10 ** 6, 10 ** 6), "1 2 5",
+                                             runtime_variables)
+
+    assert decision.mode == "in_process"
+    decision = execution_planner.choose_mode(profile(10 ** 5, 10 ** 8, 10 ** 6),
+                                             "1 2 5", runtime_variables)
+
+    assert decision.mode == "inline"
+
+    runtime_variables = {"planner_thresholds": {"inline_max_bytes": 10 ** 5}}
+    decision = execution_planner.choose_mode(profile(1000, 10 ** 6, 10 ** 6),
+                                             "1 2 4 5", runtime_variables)
+
+    assert decision.mode == "s3"
+
+    with pytest.raises(ValueError, match="Unknown planner threshold inline_max_rows"):
+        execution_planner.choose_mode(profile(1000, 10 ** 6, 10 ** 6), "1 2 5",
+                                      {"planner_thresholds": {"inline_max_rows": 1}})
+
+
+def test_choose_mode_forced():
+    decision = execution_planner.choose_mode(profile(1000, 10 ** 6, 10 ** 6), "1 2 5",
+                                             {"execution_mode": "s3"})
+
+    assert decision.mode == "s3"
+    assert decision.reasons[-1] == "execution_mode is forced to s3"
+
+    with pytest.raises(ValueError, match="can not run in chunks"):
+        execution_planner.choose_mode(profile(1000, 10 ** 6, 10 ** 6), "1 4",
+                                      {"execution_mode": "chunked"})
+
+
+def test_profile_data():
+    data_profile = execution_planner.profile_data(input_data, {}, sample_rows=5)
+    compressed_profile = execution_planner.profile_data(
+        input_data, {"data_compression": "zlib"}, sample_rows=5)
+
+    assert data_profile.rows == 10
+    assert data_profile.columns == 24
+    # Every other row is serialised and the size scaled up.
+    assert data_profile.payload_bytes == 2 * len(input_data.iloc[::2].to_json(
+        orient="records"))
+    assert compressed_profile.payload_bytes < data_profile.payload_bytes
+
+
+@pytest.mark.parametrize("grouping_columns", [None, ["region"], ["region", "strata"]])
+def test_split_and_combine_chunks(grouping_columns):
+    chunks = execution_planner.split_chunks(input_data, grouping_columns, 3)
+
+    assert len(chunks) <= 3
+    assert sum(len(chunk) for _, chunk in chunks) == len(input_data)
+    if grouping_columns:
+        cells = [set(map(tuple, chunk[grouping_columns].to_numpy().tolist()))
+                 for _, chunk in chunks]
+        assert sum(map(len, cells)) == len(set.union(*cells))
+
+    combined = execution_planner.combine_chunks(
+        [chunk for _, chunk in reversed(chunks)],
+        [positions for positions, _ in reversed(chunks)])
+
+    assert_frame_equal(combined, input_data)
+    assert np.array_equal(np.sort(np.concatenate([p for p, _ in chunks])),
+                          np.arange(len(input_data)))
@@ -0,0 +1,134 @@
+import json
+from unittest import mock
+
+import pandas as pd
+import pytest
+from es_aws_functions import test_generic_library
+from moto import mock_s3
+from pandas.testing import assert_frame_equal
+
+import disclosure_pipeline
+import disclosure_wrangler
+import geography_levels
+import stage_chain
+import stage_registry
+
+environment_variables = {
+    "bucket_name": "test_bucket",
+    "method_name": "es-disclosure-stage--method"
+}
+
+runtime_variables = {
+    "bpm_queue_url": "fake_queue_url",
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "environment": "sandbox",
+    "execution_mode": "inline",
+    "explanation": "reason",
+    "final_output_location": "fixtures/",
+    "grouping_levels": {"region": ["region"], "county": ["county"],
+                        "gor_strata": ["gor_code", "strata"]},
+    "in_file_name": "test_wrangler_input",
+    "out_file_name": "test_wrangler_output.json",
+    "parent_column": "ent_ref_count",
+    "parent_reference_column": "enterprise_reference",
+    "publishable_indicator": "publish",
+    "run_id": "666",
+    "sns_topic_arn": "fake_sns_arn",
+    "stage5_threshold": "0.1",
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "total_steps": 6,
+    "unique_identifier": ["responder_id"]
+}
+
+
+def read_input():
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        return pd.DataFrame(json.loads(file_1.read()))
+
+
+def test_build_cells():
+    data = read_input()
+
+    cells = geography_levels.build_cells(data, runtime_variables)
+    assert list(cells.columns[:5]) == ["level", "region", "county", "gor_code",
+                                       "strata"]
+
+    # Each level is as if its cells were aggregated from the responders on their own.
+    for level, grouping_columns in runtime_variables["grouping_levels"].items():
+        level_cells = cells[cells["level"] == level].reset_index(drop=True)
+        grouped = data.groupby(grouping_columns, sort=True)
+        assert level_cells[grouping_columns].values.tolist() == \
+            list(map(list, grouped.size().index.to_frame().values))
+        assert level_cells["ent_ref_count"].tolist() == \
+            grouped["enterprise_reference"].nunique().tolist()
+        for total_column in runtime_variables["total_columns"]:
+            assert level_cells["cell_total_" + total_column].tolist() == \
+                grouped[total_column].sum().tolist()
+            assert level_cells[total_column + "_largest_contributor"].tolist() == \
+                grouped[total_column].max().tolist()
+            assert level_cells[total_column + "_second_largest_contributor"]\
+                .tolist() == grouped[total_column].apply(
+                    lambda totals: totals.nlargest(2).iloc[-1] if len(totals) > 1
+                    else 0).tolist()
+        other_columns = [column for column in geography_levels.level_columns(
+            runtime_variables["grouping_levels"]) if column not in grouping_columns]
+        assert level_cells[other_columns].isna().all().all()
+
+
+@pytest.mark.parametrize("changes,message", [
+    ({"disclosure_stages": "1 3 5"}, "Stage 3 can not be run with grouping_levels"),
+    ({"parent_reference_column": None}, "requires the runtime variable"
+                                        " 'parent_reference_column'"),
+    ({"grouping_levels": {"county": ["county"], "level": ["level"]}},
+     "level can not be a level's grouping column"),
+    ({"grouping_levels": {"district": ["district"]}},
+     "Columns ['district'] are needed")])
+def test_build_cells_errors(changes, message):
+    with pytest.raises(ValueError) as exc_info:
+        geography_levels.build_cells(read_input(), dict(runtime_variables, **changes))
+
+    assert message in str(exc_info.value)
+
+
+@mock_s3
+@mock.patch("disclosure_wrangler.send_summary_message")
+@mock.patch("disclosure_wrangler.aws_functions.save_to_s3",
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch("disclosure_wrangler.aws_functions.save_dataframe_to_csv")
+def test_wrangler_levels(mock_s3_csv, mock_s3_put, mock_sns):
+    s3_client = test_generic_library.create_bucket(environment_variables["bucket_name"])
+    test_generic_library.upload_files(s3_client, environment_variables["bucket_name"],
+                                      ["test_wrangler_input.json"])
+    invoker = stage_chain.LocalInvoker({
+        stage_registry.lambda_name(environment_variables["method_name"], stage):
+            spec.module.lambda_handler for stage, spec in stage_registry.STAGES.items()})
+
+    with mock.patch.dict(disclosure_wrangler.os.environ, environment_variables):
+        with invoker:
+            output = disclosure_wrangler.lambda_handler(
+                {"RuntimeVariables": runtime_variables},
+                test_generic_library.context_object)
+
+    assert output["success"]
+    # Every level is disclosed by one invocation of each stage, after the warm-ups.
+    assert invoker.invoked[3:] == ["es-disclosure-stage-1-method",
+                                   "es-disclosure-stage-2-method",
+                                   "es-disclosure-stage-5-method"]
+
+    cells = geography_levels.build_cells(read_input(), runtime_variables)
+    prepared_data, _ = disclosure_pipeline.run_stages(
+        cells, geography_levels.cell_runtime_variables(runtime_variables), "1 2 5")
+    with open("tests/fixtures/test_wrangler_output.json", "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+    assert_frame_equal(produced_data, prepared_data, check_dtype=False)
+    assert produced_data["level"].value_counts().to_dict() == \
+        {"region": 6, "county": 8, "gor_strata": 9}
+
+    summary = mock_sns.call_args[0][2]
+    assert summary["responders"] == len(cells)
@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+import group_numbers
+
+
+def test_number_groups():
+    data = pd.DataFrame({"region": ["b", "a", "b", None, "a", None],
+                         "strata": [1, 2, 1, 2, np.nan, 2]})
+    data["county"] = pd.Categorical(["x", "y", "x", "y", "y", "y"],
+                                    categories=["z", "y", "x"])
+
+    # Groups are numbered as they first appear, and missing values are kept.
+    assert group_numbers.number_groups(data, ["region", "strata"]).tolist() == \
+        [0, 1, 0, 2, 3, 2]
+    assert group_numbers.number_groups(data, ["county"]).tolist() == [0, 1, 0, 1, 1, 1]
+    assert group_numbers.number_groups(data, []).tolist() == [0] * 6
+    assert group_numbers.number_groups(data.iloc[:0], ["region"]).tolist() == []
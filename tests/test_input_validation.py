@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import input_validation
+
+runtime_variables = {
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "explanation": "reason",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "stage5_threshold": "0.1",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total"],
+    "unique_identifier": ["responder_id"]
+}
+
+
+def read_input():
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        return pd.DataFrame(json.loads(file_1.read()))
+
+
+def test_required_columns():
+    data = read_input()
+
+    required, written = input_validation.required_columns(
+        "1 2 5", runtime_variables, data.columns)
+    assert list(required.items()) == [
+        ("responder_id", []),
+        ("cell_total_Q608_total", ["1", "5"]),
+        ("ent_ref_count", ["2"]),
+        ("Q608_total_largest_contributor", ["5"]),
+        ("Q608_total_second_largest_contributor", ["5"])]
+    assert "disclosive_Q608_total" in written
+
+    # Given the grouping columns, stage 5 works out a missing largest contributor.
+    grouped = dict(runtime_variables, grouping_columns=["region", "strata"])
+    required, _ = input_validation.required_columns(
+        "1 5", grouped, data.drop(columns=["Q608_total_largest_contributor"]).columns)
+    assert list(required) == [
+        "responder_id", "cell_total_Q608_total", "Q608_total", "region", "strata",
+        "Q608_total_second_largest_contributor"]
+
+    # Stages 3 and 4 always read the grouping columns.
+    required, _ = input_validation.required_columns(
+        "1 3 4", dict(grouped, dominance_n="2", dominance_k="80"), data.columns)
+    assert list(required.items()) == [
+        ("responder_id", []),
+        ("cell_total_Q608_total", ["1", "4"]),
+        ("Q608_total", ["3"]),
+        ("region", ["3", "4"]),
+        ("strata", ["3", "4"])]
+    problems = input_validation.find_problems(
+        data.drop(columns=["strata"]), "1 3",
+        dict(grouped, dominance_n="2", dominance_k="80"))
+    assert problems == ["Column strata, read by stage 3, is missing"]
+
+
+def test_valid_input():
+    assert input_validation.find_problems(read_input(), "1 2 5", runtime_variables) \
+        == []
+
+
+def test_every_problem_at_once():
+    data = read_input().drop(columns=["ent_ref_count"])
+    data["cell_total_Q608_total"] = data["cell_total_Q608_total"].astype(str)
+    data.loc[[1, 2], "Q608_total_largest_contributor"] = np.nan
+    data.loc[3, "Q608_total_second_largest_contributor"] = -1
+    misspelt = dict(runtime_variables, total_columns=["Q608_total", "Q608_totl"])
+
+    problems = input_validation.find_problems(data, "1 2 5", misspelt)
+    assert problems[:2] == ["Column cell_total_Q608_totl, read by stage 1, 5, is missing",
+                            "Column ent_ref_count, read by stage 2, is missing"]
+    assert "Column cell_total_Q608_total is object, not numeric" in problems
+    responders = list(data["responder_id"])
+    assert f"Column Q608_total_largest_contributor has 2 missing values, e.g. for" \
+           f" [{responders[1]}], [{responders[2]}]" in problems
+    assert f"Column Q608_total_second_largest_contributor has 1 negative values," \
+           f" e.g. for [{responders[3]}]" in problems
+
+    with pytest.raises(ValueError) as exc_info:
+        input_validation.validate(data, "1 2 5", misspelt)
+    assert f"The input has {len(problems)} problems" in str(exc_info.value)
+
+
+def test_missing_parameter():
+    variables = {key: value for key, value in runtime_variables.items()
+                 if key != "stage5_threshold"}
+
+    problems = input_validation.find_problems(read_input(), "1 5", variables)
+    assert len(problems) == 1
+    assert "stage5_threshold" in problems[0]
+
+
+def test_largest_contributor_zero():
+    data = read_input()
+    data.loc[1, "Q608_total_largest_contributor"] = 0
+
+    # Stage 5 scores a largest contributor of 0 rather than dividing by it.
+    assert input_validation.find_problems(data, "1 5", runtime_variables) == []
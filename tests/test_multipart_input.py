@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+from unittest import mock
+
+import boto3
+import pandas as pd
+import pytest
+from es_aws_functions import test_generic_library
+from moto import mock_s3
+from pandas.testing import assert_frame_equal
+
+import disclosure_pipeline
+import disclosure_wrangler
+import multipart_input
+
+environment_variables = {
+    "bucket_name": "test_bucket",
+    "method_name": "es-disclosure-stage--method"
+}
+
+runtime_variables = {
+    "bpm_queue_url": "fake_queue_url",
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "environment": "sandbox",
+    "execution_mode": "in_process",
+    "explanation": "reason",
+    "final_output_location": "fixtures/",
+    "in_file_name": "parts/666/",
+    "input_parts": "prefix",
+    "out_file_name": "test_wrangler_output.json",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "read_concurrency": 2,
+    "run_id": "666",
+    "sns_topic_arn": "fake_sns_arn",
+    "stage5_threshold": "0.1",
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    # The wrangler input only has the aggregated columns for the first total column.
+    "total_columns": ["Q608_total"],
+    "total_steps": 6,
+    "unique_identifier": ["responder_id"]
+}
+
+
+def read_input():
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        return pd.DataFrame(json.loads(file_1.read()))
+
+
+def upload_parts(data, part_count=4):
+    """
+    Writes the data to the bucket as parts under parts/666/, with a manifest listing
+    them last part first, and an object outside the prefix.
+    :return: The s3 client - Type: Service client
+    """
+    s3_client = test_generic_library.create_bucket(environment_variables["bucket_name"])
+    keys = []
+    for part in range(part_count):
+        key = f"parts/666/part-{part:04d}.json"
+        s3_client.put_object(Bucket="test_bucket", Key=key,
+                             Body=data.iloc[part::part_count].to_json(orient="records"))
+        keys.append(key)
+    s3_client.put_object(Bucket="test_bucket", Key="parts/666/", Body=b"")
+    s3_client.put_object(Bucket="test_bucket", Key="parts/667/part-0000.json",
+                         Body=data.iloc[:1].to_json(orient="records"))
+    s3_client.put_object(Bucket="test_bucket", Key="parts/666.manifest",
+                         Body=json.dumps({"parts": keys[::-1]}))
+
+    return s3_client
+
+
+class CountingClient:
+    """
+    Wraps an s3 client, recording the most object reads in flight at once.
+    """
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+        self.reading = 0
+        self.most_reading = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.s3_client, name)
+
+    def get_object(self, **kwargs):
+        with self.lock:
+            self.reading += 1
+            self.most_reading = max(self.most_reading, self.reading)
+        time.sleep(0.05)
+        try:
+            return self.s3_client.get_object(**kwargs)
+        finally:
+            with self.lock:
+                self.reading -= 1
+
+
+@mock_s3
+def test_read_parts():
+    data = read_input()
+    s3_client = CountingClient(upload_parts(data))
+
+    produced_data = multipart_input.read_parts("test_bucket", "parts/666/",
+                                               multipart_input.PREFIX, 3, s3_client)
+
+    # The parts are put together in key order, however they were interleaved.
+    expected = pd.concat([data.iloc[part::4] for part in range(4)], ignore_index=True)
+    assert_frame_equal(produced_data, expected)
+    assert s3_client.most_reading == 3
+
+    produced_data = multipart_input.read_parts("test_bucket", "parts/666.manifest",
+                                               multipart_input.MANIFEST, 8, s3_client)
+
+    expected = pd.concat([data.iloc[part::4] for part in range(3, -1, -1)],
+                         ignore_index=True)
+    assert_frame_equal(produced_data, expected)
+
+
+@mock_s3
+def test_read_parts_errors():
+    upload_parts(read_input())
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+
+    with pytest.raises(ValueError, match="No input parts found for prefix parts/668/"):
+        multipart_input.read_parts("test_bucket", "parts/668/", multipart_input.PREFIX,
+                                   s3_client=s3_client)
+    with pytest.raises(ValueError, match="input_parts must be one of"):
+        multipart_input.read_parts("test_bucket", "parts/666/", "glob",
+                                   s3_client=s3_client)
+
+
+@mock_s3
+@mock.patch("disclosure_wrangler.send_summary_message")
+@mock.patch("disclosure_wrangler.aws_functions.read_dataframe_from_s3")
+@mock.patch("disclosure_wrangler.aws_functions.save_to_s3",
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch("disclosure_wrangler.aws_functions.save_dataframe_to_csv")
+def test_wrangler_parts(mock_s3_csv, mock_s3_put, mock_s3_read, mock_sns):
+    data = read_input()
+    upload_parts(data)
+
+    with mock.patch.dict(disclosure_wrangler.os.environ, environment_variables):
+        output = disclosure_wrangler.lambda_handler(
+            {"RuntimeVariables": runtime_variables}, test_generic_library.context_object)
+
+    assert output["success"]
+    assert not mock_s3_read.called
+    prepared_data, _ = disclosure_pipeline.run_stages(
+        pd.concat([data.iloc[part::4] for part in range(4)], ignore_index=True),
+        runtime_variables, "1 2 5")
+    with open("tests/fixtures/test_wrangler_output.json", "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+    assert_frame_equal(produced_data.sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False)
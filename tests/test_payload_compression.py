@@ -0,0 +1,38 @@
+import pytest
+
+import payload_compression
+
+with open("tests/fixtures/test_method_5_prepared_output.json", "r") as file_1:
+    records = file_1.read()
+
+
+@pytest.mark.parametrize("codec", sorted(payload_compression.CODECS))
+@pytest.mark.parametrize("level", [None, 1])
+def test_round_trip(codec, level):
+    envelope = payload_compression.pack(records, codec, level)
+
+    assert envelope["data_compression"] == codec
+    assert len(envelope["data"]) < len(records)
+    assert payload_compression.unpack(envelope) == records
+
+
+def test_uncompressed():
+    envelope = payload_compression.pack(records)
+
+    assert envelope == {"data": records}
+    assert payload_compression.unpack({"data": records, "success": True}) == records
+
+
+def test_repack():
+    envelope = payload_compression.pack(records, "zlib")
+
+    # Already in the wanted codec, so passed on as it is.
+    assert payload_compression.repack({**envelope, "success": True}, "zlib") == envelope
+    assert payload_compression.repack(envelope, None) == {"data": records}
+    assert payload_compression.unpack(
+        payload_compression.repack(envelope, "lzma")) == records
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError, match="Unknown data_compression codec snappy"):
+        payload_compression.pack(records, "snappy")
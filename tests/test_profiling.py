@@ -0,0 +1,122 @@
+import contextlib
+import json
+import marshal
+import pstats
+from unittest import mock
+
+import boto3
+import pytest
+from es_aws_functions import test_generic_library
+from moto import mock_s3
+
+import profiling
+import stage1_method
+
+method_runtime_variables = {
+    "RuntimeVariables": {
+        "bpm_queue_url": "fake_queue_url",
+        "cell_total_column": "cell_total",
+        "data": json.dumps([{"responder_id": 1, "cell_total_Q608_total": 0},
+                            {"responder_id": 2, "cell_total_Q608_total": 5}]),
+        "disclosivity_marker": "disclosive",
+        "environment": "sandbox",
+        "explanation": "reason",
+        "profile_bucket": "test_bucket",
+        "publishable_indicator": "publish",
+        "run_id": "666",
+        "survey": "BMI_SG",
+        "total_columns": ["Q608_total"],
+        "unique_identifier": ["responder_id"],
+    }
+}
+
+
+def busy():
+    return sum(len(sorted(str(number) for number in range(10000))) for _ in range(10))
+
+
+def read_profile(s3_client, key):
+    return s3_client.get_object(Bucket="test_bucket", Key=key)["Body"].read()
+
+
+@mock_s3
+def test_capture_cprofile():
+    s3_client = test_generic_library.create_bucket("test_bucket")
+
+    with profiling.capture({"profile": "cprofile"}, "test_bucket", "666",
+                           "stage_1") as capture:
+        busy()
+
+    assert len(capture.keys) == 1
+    assert capture.keys[0].startswith("disclosure-profiles/666/stage_1-")
+    assert capture.keys[0].endswith(".prof")
+    stats = pstats.Stats()
+    stats.stats = marshal.loads(read_profile(s3_client, capture.keys[0]))
+    assert any(function == "busy" for _, _, function in stats.stats)
+
+
+@mock_s3
+def test_capture_sampling_and_allocations():
+    s3_client = test_generic_library.create_bucket("test_bucket")
+
+    with profiling.capture({"profile": "sampling", "profile_allocations": True},
+                           "test_bucket", "666", "wrangler") as capture:
+        kept = [str(number) for number in range(10000)]
+        busy()
+
+    assert kept
+    assert sorted(key.split(".", 1)[1] for key in capture.keys) == \
+        ["allocations.folded", "folded"]
+    for key in capture.keys:
+        lines = read_profile(s3_client, key).decode("UTF-8").splitlines()
+        assert lines
+        # Each line of a folded stack file is "frame;frame;... count".
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            assert stack and int(count) > 0
+        if key.endswith(".allocations.folded"):
+            assert lines[0].startswith("peak ")
+        else:
+            assert any("busy (test_profiling.py" in line for line in lines)
+
+
+def test_capture_off():
+    with mock.patch("profiling.boto3.client") as mock_client:
+        assert isinstance(profiling.capture({}, "test_bucket", "666", "stage_1"),
+                          contextlib.nullcontext)
+        with pytest.raises(ValueError):
+            profiling.capture({"profile": "perf"}, "test_bucket", "666", "stage_1")
+
+    assert not mock_client.called
+
+
+def test_capture_write_failure():
+    s3_client = mock.Mock()
+    s3_client.put_object.side_effect = ValueError("No such bucket")
+
+    with profiling.Capture("cprofile", False, "test_bucket", "666", "stage_1",
+                           s3_client) as capture:
+        busy()
+
+    assert capture.keys == []
+
+
+@mock_s3
+def test_profiled_stage():
+    s3_client = test_generic_library.create_bucket("test_bucket")
+    runtime_variables = json.loads(json.dumps(method_runtime_variables))
+
+    output = stage1_method.lambda_handler(runtime_variables,
+                                          test_generic_library.context_object)
+    assert output["success"]
+    assert "Contents" not in s3_client.list_objects_v2(Bucket="test_bucket")
+
+    runtime_variables["RuntimeVariables"]["profile"] = "cprofile"
+    profiled_output = stage1_method.lambda_handler(runtime_variables,
+                                                   test_generic_library.context_object)
+    assert profiled_output == output
+
+    keys = [s3_object["Key"] for s3_object in boto3.client(
+        "s3", region_name="eu-west-2").list_objects_v2(Bucket="test_bucket")["Contents"]]
+    assert len(keys) == 1
+    assert keys[0].startswith("disclosure-profiles/666/stage_1-")
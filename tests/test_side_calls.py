@@ -0,0 +1,118 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+from es_aws_functions import exception_classes, test_generic_library
+from moto import mock_s3
+
+import disclosure_wrangler
+import side_calls
+
+environment_variables = {
+    "bucket_name": "test_bucket",
+    "method_name": "es-disclosure-stage--method"
+}
+
+runtime_variables = {
+    "bpm_queue_url": "fake_queue_url",
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "environment": "sandbox",
+    "explanation": "reason",
+    "final_output_location": "fixtures/",
+    "in_file_name": "test_wrangler_input",
+    "out_file_name": "test_wrangler_output.json",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "run_id": "666",
+    "sns_topic_arn": "fake_sns_arn",
+    "stage5_threshold": "0.1",
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    # The wrangler input has no aggregated columns for Q606_other_gravel, so the run
+    # fails its input validation.
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "total_steps": 6,
+    "unique_identifier": ["responder_id"]
+}
+
+
+def test_dispatcher_order():
+    calls = []
+    lock = threading.Lock()
+
+    def slow_call(name):
+        time.sleep(0.05)
+        with lock:
+            calls.append(name)
+
+    dispatcher = side_calls.Dispatcher()
+    start = time.perf_counter()
+    for name in ["first", "second", "third"]:
+        dispatcher.submit(side_calls.BPM, slow_call, name)
+    dispatcher.submit(side_calls.SNS, slow_call, "message")
+    # Submitting does not wait for the calls.
+    assert time.perf_counter() - start < 0.05
+
+    assert dispatcher.close() == []
+    assert [name for name in calls if name != "message"] == ["first", "second", "third"]
+    # The channels' calls are made alongside each other.
+    assert calls.index("message") < 2
+
+    dispatcher.submit(side_calls.BPM, calls.append, "after")
+    assert calls[-1] == "after"
+
+
+def test_dispatcher_retries():
+    call = mock.Mock(side_effect=[ValueError("Throttled"), ValueError("Throttled"), None,
+                                  None])
+    broken = mock.Mock(side_effect=ValueError("Queue does not exist"))
+    broken.__name__ = "send_bpm_status"
+    logger = mock.Mock()
+
+    with side_calls.Dispatcher(logger, retry_seconds=0) as dispatcher:
+        dispatcher.submit(side_calls.BPM, call, "retried")
+        dispatcher.submit(side_calls.BPM, broken, "fake_queue_url", "DONE")
+        dispatcher.submit(side_calls.BPM, call, "after")
+
+    assert call.call_args_list == [mock.call("retried")] * 3 + [mock.call("after")]
+    assert broken.call_count == side_calls.ATTEMPTS
+    # The call given up on is kept and logged with its arguments.
+    assert dispatcher.failed == [("send_bpm_status", ("fake_queue_url", "DONE"),
+                                  "Queue does not exist")]
+    assert "send_bpm_status('fake_queue_url', 'DONE')" in logger.error.call_args[0][0]
+
+
+@mock_s3
+def test_wrangler_failure_flushes():
+    s3_client = test_generic_library.create_bucket(environment_variables["bucket_name"])
+    test_generic_library.upload_files(s3_client, environment_variables["bucket_name"],
+                                      ["test_wrangler_input.json"])
+    events = []
+
+    def send_bpm_status(queue_url, module, status, *args):
+        time.sleep(0.1)
+        events.append(status)
+
+    def handle_exception(e, *args, **kwargs):
+        events.append("handle_exception")
+        return str(e)
+
+    with mock.patch.dict(disclosure_wrangler.os.environ, environment_variables), \
+            mock.patch("disclosure_wrangler.boto3.client"), \
+            mock.patch("disclosure_wrangler.aws_functions.send_bpm_status",
+                       side_effect=send_bpm_status), \
+            mock.patch("disclosure_wrangler.general_functions.handle_exception",
+                       side_effect=handle_exception):
+        with pytest.raises(exception_classes.LambdaFailure) as exc_info:
+            disclosure_wrangler.lambda_handler({"RuntimeVariables": runtime_variables},
+                                               test_generic_library.context_object)
+
+    assert "The input has" in str(exc_info.value)
+    # The start status was sent before the failure was handled, and before the
+    # wrangler raised.
+    assert events == ["IN PROGRESS", "handle_exception"]
@@ -0,0 +1,104 @@
+import json
+import logging
+
+import pandas as pd
+import pytest
+from es_aws_functions import test_generic_library
+from pandas.testing import assert_frame_equal
+
+import stage3_method
+import stage5_method
+
+method_runtime_variables_3 = {
+    "RuntimeVariables": {
+        "bpm_queue_url": "fake_queue_url",
+        "data": None,
+        "disclosivity_marker": "disclosive",
+        "dominance_k": "80",
+        "dominance_n": "2",
+        "environment": "sandbox",
+        "explanation": "reason",
+        "grouping_columns": ["region"],
+        "publishable_indicator": "publish",
+        "run_id": "666",
+        "survey": "BMI_SG",
+        "total_columns": ["Q608_total"],
+        "unique_identifier": ["responder_id"]
+    }
+}
+
+responder_data = pd.DataFrame({
+    "responder_id": [1, 2, 3, 4, 5, 6, 7],
+    "region": [1, 1, 1, 2, 2, 2, 3],
+    "Q608_total": [5, 40, 20, 10, 10, 10, 0],
+    "publish_Q608_total": ["Not Applicable"] * 6 + ["Publish"]
+})
+
+
+def test_disclosure():
+    output = stage3_method.disclosure(
+        responder_data, "disclosive_Q608_total", "publish_Q608_total",
+        "reason_Q608_total", "Q608_total", ["region"], 2, 80.0)
+
+    # Region 1's top two make up 60 of 65, region 2's 20 of 30, and region 3 was
+    # already published by stage 1.
+    assert output["disclosive_Q608_total"].tolist()[:6] == ["Yes"] * 3 + ["No"] * 3
+    assert output["publish_Q608_total"].tolist() == \
+        ["No"] * 3 + ["Not Applicable"] * 3 + ["Publish"]
+    assert output["reason_Q608_total"].tolist()[:4] == \
+        ["Stage 3 - Top 2 contributors make up 92.3% of the cell"] * 3 + \
+        ["Passed Stage 3"]
+    assert pd.isna(output["reason_Q608_total"].iloc[6])
+
+
+def test_method_success():
+    runtime_variables = json.loads(json.dumps(method_runtime_variables_3))
+    runtime_variables["RuntimeVariables"]["data"] = \
+        responder_data.to_json(orient="records")
+
+    output = stage3_method.lambda_handler(runtime_variables,
+                                          test_generic_library.context_object)
+
+    assert output["success"]
+    produced_data = pd.DataFrame(json.loads(output["data"]))
+    assert produced_data["publish_Q608_total"].tolist() == \
+        ["No"] * 3 + ["Not Applicable"] * 3 + ["Publish"]
+
+
+def test_stage5_finds_missing_top_contributors():
+    data = responder_data.assign(cell_total_Q608_total=[65, 65, 65, 30, 30, 30, 0])
+    given = data.assign(Q608_total_largest_contributor=[40, 40, 40, 10, 10, 10, 0],
+                        Q608_total_second_largest_contributor=[20, 20, 20, 10, 10,
+                                                               10, 0])
+    arguments = ["disclosive", "publish", "reason", ["Q608_total"], "cell_total",
+                 "largest_contributor", "second_largest_contributor", "0.1"]
+
+    expected = stage5_method.disclose_total_columns(given, *arguments, None, None,
+                                                    logging.getLogger())
+    produced = stage5_method.disclose_total_columns(data, *arguments, ["region"], None,
+                                                    logging.getLogger())
+
+    assert_frame_equal(produced.sort_index(axis=1), expected.sort_index(axis=1),
+                       check_dtype=False)
+
+
+def test_stage5_needs_grouping_columns_without_top_contributors():
+    with pytest.raises(KeyError, match="no grouping_columns"):
+        stage5_method.disclose_total_columns(
+            responder_data.assign(cell_total_Q608_total=1), "disclosive", "publish",
+            "reason", ["Q608_total"], "cell_total", "largest_contributor",
+            "second_largest_contributor", "0.1", None, None, logging.getLogger())
+
+
+def test_stage5_largest_contributor_zero():
+    data = pd.DataFrame({"cell_total": [5, 0], "largest": [0, 0], "second": [0, 0],
+                         "publish": ["Not Applicable"] * 2})
+
+    output = stage5_method.disclosure(data, "disclosive", "publish", "reason",
+                                      "cell_total", "largest", "second", "0.1")
+
+    # As when the rule was applied row by row, the score is inf, or NaN when the
+    # cell total is 0 too, which does not meet the threshold.
+    assert output["Score"].tolist()[0] == float("inf")
+    assert pd.isna(output["Score"].iloc[1])
+    assert output["publish"].tolist() == ["Publish", "No"]
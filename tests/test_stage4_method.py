@@ -0,0 +1,160 @@
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+from es_aws_functions import test_generic_library
+
+import stage4_method
+
+method_runtime_variables_4 = {
+    "RuntimeVariables": {
+        "bpm_queue_url": "fake_queue_url",
+        "cell_total_column": "cell_total",
+        "data": None,
+        "disclosivity_marker": "disclosive",
+        "environment": "sandbox",
+        "explanation": "reason",
+        "grouping_columns": ["region", "strata"],
+        "publishable_indicator": "publish",
+        "run_id": "666",
+        "survey": "BMI_SG",
+        "total_columns": ["Q608_total"],
+        "unique_identifier": ["responder_id"]
+    }
+}
+
+
+def make_table(values, disclosive_cells):
+    """
+    Builds one row per cell of a region by strata table.
+    :param values: {(region, strata): cell total} - Type: Dict
+    :param disclosive_cells: The cells suppressed by the earlier stages - Type: List
+    :return: The table - Type: DataFrame
+    """
+    return pd.DataFrame({
+        "responder_id": np.arange(len(values)),
+        "region": [region for region, _ in values],
+        "strata": [strata for _, strata in values],
+        "cell_total_Q608_total": list(values.values()),
+        "disclosive_Q608_total": ["Yes" if cell in disclosive_cells else "No"
+                                  for cell in values],
+        "reason_Q608_total": ["Stage 5" if cell in disclosive_cells else "Passed"
+                              for cell in values]
+    })
+
+
+def suppressed_cells(output):
+    suppressed = output[output["disclosive_Q608_total"] == "Yes"]
+    return set(zip(suppressed["region"], suppressed["strata"]))
+
+
+def test_disclosure_protects_every_line():
+    values = {(1, "A"): 10, (1, "B"): 50,
+              (2, "A"): 30, (2, "B"): 5,
+              (3, "A"): 7, (3, "B"): 8}
+    output = stage4_method.disclosure(
+        make_table(values, [(1, "A")]), "disclosive_Q608_total", "publish_Q608_total",
+        "reason_Q608_total", "cell_total_Q608_total", ["region", "strata"])
+
+    # (3, A) is the smallest published cell in strata A and (1, B) the only one left in
+    # region 1, which leaves region 3 and strata B to be protected by (3, B).
+    assert suppressed_cells(output) == {(1, "A"), (1, "B"), (3, "A"), (3, "B")}
+    assert output["reason_Q608_total"].tolist() == [
+        "Stage 5",
+        "Stage 4 - Suppressed to protect a disclosive cell in the same total",
+        "Passed", "Passed",
+        "Stage 4 - Suppressed to protect a disclosive cell in the same total",
+        "Stage 4 - Suppressed to protect a disclosive cell in the same total"]
+    assert "publish_Q608_total" not in output.columns
+
+
+def test_disclosure_prefers_non_zero_cells():
+    values = {(1, "A"): 10, (1, "B"): 0, (1, "C"): 20}
+    output = stage4_method.disclosure(
+        make_table(values, [(1, "A")]), "disclosive_Q608_total", "publish_Q608_total",
+        "reason_Q608_total", "cell_total_Q608_total", ["region", "strata"])
+
+    assert suppressed_cells(output) == {(1, "A"), (1, "C")}
+
+
+def test_disclosure_nothing_to_protect():
+    values = {(1, "A"): 10, (1, "B"): 50, (2, "A"): 30, (2, "B"): 5}
+    input_data = make_table(values, [])
+    output = stage4_method.disclosure(
+        input_data, "disclosive_Q608_total", "publish_Q608_total",
+        "reason_Q608_total", "cell_total_Q608_total", ["region", "strata"])
+
+    pd.testing.assert_frame_equal(output, input_data)
+
+
+def test_disclosure_random_tables():
+    random = np.random.RandomState(3)
+    for _ in range(20):
+        data = pd.DataFrame({
+            "region": random.randint(0, 6, 400),
+            "strata": random.randint(0, 5, 400),
+            "county": random.randint(0, 3, 400)
+        }).drop_duplicates()
+        data["cell_total_Q608_total"] = random.randint(0, 100, len(data))
+        data["disclosive_Q608_total"] = np.where(random.rand(len(data)) < 0.1,
+                                                 "Yes", "No")
+        output = stage4_method.disclosure(
+            data, "disclosive_Q608_total", "publish_Q608_total", "reason_Q608_total",
+            "cell_total_Q608_total", ["region", "strata", "county"])
+
+        # Cells are only ever added, and every line which has a published cell left
+        # does not have exactly one suppressed cell.
+        assert (output["disclosive_Q608_total"] == "Yes").sum() >= \
+            (data["disclosive_Q608_total"] == "Yes").sum()
+        for grouping_column in ["region", "strata", "county"]:
+            others = [column for column in ["region", "strata", "county"]
+                      if column != grouping_column]
+            lines = output.groupby(others)["disclosive_Q608_total"]
+            suppressed = lines.apply(lambda line: (line == "Yes").sum())
+            sizes = lines.size()
+            assert not ((suppressed == 1) & (sizes > 1)).any()
+
+
+def test_disclose_total_columns_multiple_rows_per_cell():
+    data = pd.DataFrame({
+        "responder_id": [1, 2, 3, 4, 5],
+        "region": [1, 1, 1, 2, 2],
+        "cell_total_Q608_total": [15, 15, 40, 7, 7],
+        "disclosive_Q608_total": ["Yes", "No", "No", "No", "No"]
+    })
+    output = stage4_method.disclose_total_columns(
+        data, "disclosive", "publish", "reason", ["Q608_total"], "cell_total",
+        ["region"], logging.getLogger())
+
+    # Region 1 is marked on one of its rows only, but the whole cell is suppressed
+    # along with the other region, which is the only cell left to protect it.
+    assert output["disclosive_Q608_total"].tolist() == ["Yes", "No", "No", "Yes", "Yes"]
+
+
+def test_method_success():
+    data = make_table({(1, "A"): 10, (1, "B"): 50, (2, "A"): 30, (2, "B"): 5},
+                      [(2, "B")])
+    runtime_variables = json.loads(json.dumps(method_runtime_variables_4))
+    runtime_variables["RuntimeVariables"]["data"] = data.to_json(orient="records")
+
+    output = stage4_method.lambda_handler(runtime_variables,
+                                          test_generic_library.context_object)
+
+    assert output["success"]
+    assert suppressed_cells(pd.DataFrame(json.loads(output["data"]))) == \
+        {(1, "A"), (1, "B"), (2, "A"), (2, "B")}
+
+
+@pytest.mark.parametrize("missing_parameter", ["grouping_columns", "cell_total_column"])
+def test_method_missing_parameter(missing_parameter):
+    runtime_variables = json.loads(json.dumps(method_runtime_variables_4))
+    runtime_variables["RuntimeVariables"]["data"] = "[]"
+    runtime_variables["RuntimeVariables"].pop(missing_parameter)
+
+    output = stage4_method.lambda_handler(runtime_variables,
+                                          test_generic_library.context_object)
+
+    assert not output["success"]
+    assert "Error validating runtime params" in output["error"]
@@ -0,0 +1,178 @@
+import json
+from unittest import mock
+
+import boto3
+import pandas as pd
+import pytest
+from es_aws_functions import exception_classes, test_generic_library
+from moto import mock_s3
+from pandas.testing import assert_frame_equal
+
+import disclosure_pipeline
+import disclosure_wrangler
+import stage_chain
+import stage_registry
+
+environment_variables = {
+    "bucket_name": "test_bucket",
+    "finaliser_name": "es-disclosure-finaliser",
+    "method_name": "es-disclosure-stage--method"
+}
+
+runtime_variables = {
+    "bpm_queue_url": "fake_queue_url",
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "environment": "sandbox",
+    "execution_mode": "chained",
+    "explanation": "reason",
+    "final_output_location": "fixtures/",
+    "in_file_name": "test_wrangler_input",
+    "out_file_name": "test_wrangler_output.json",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "run_id": "666",
+    "sns_topic_arn": "fake_sns_arn",
+    "stage5_threshold": "0.1",
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    # The wrangler input only has the aggregated columns for the first total column.
+    "total_columns": ["Q608_total"],
+    "total_steps": 6,
+    "unique_identifier": ["responder_id"]
+}
+
+
+def local_invoker(handlers=None):
+    """
+    A LocalInvoker running the stage lambdas' handlers and the finaliser.
+    """
+    stage_handlers = {
+        stage_registry.lambda_name(environment_variables["method_name"], stage):
+            spec.module.lambda_handler for stage, spec in stage_registry.STAGES.items()}
+    stage_handlers[environment_variables["finaliser_name"]] = \
+        disclosure_wrangler.finalise_lambda_handler
+
+    return stage_chain.LocalInvoker(dict(stage_handlers, **(handlers or {})))
+
+
+def run_chain(invoker):
+    """
+    Runs the wrangler in chained mode against the invoker, then the chain it starts.
+    :return: (the wrangler's reply, the s3 client) - Type: Tuple
+    """
+    s3_client = test_generic_library.create_bucket(environment_variables["bucket_name"])
+    test_generic_library.upload_files(s3_client, environment_variables["bucket_name"],
+                                      ["test_wrangler_input.json"])
+
+    with mock.patch.dict(disclosure_wrangler.os.environ, environment_variables):
+        with invoker:
+            output = disclosure_wrangler.lambda_handler(
+                {"RuntimeVariables": runtime_variables},
+                test_generic_library.context_object)
+            invoker.run()
+
+    return output, s3_client
+
+
+@mock_s3
+@mock.patch("disclosure_wrangler.send_summary_message")
+@mock.patch("disclosure_wrangler.aws_functions.save_to_s3",
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch("disclosure_wrangler.aws_functions.save_dataframe_to_csv")
+def test_chained_run(mock_s3_csv, mock_s3_put, mock_sns):
+    invoker = local_invoker()
+    output, s3_client = run_chain(invoker)
+
+    assert output == {"success": True, "chained": True}
+    # The warm-up pings, then each link of the chain in turn.
+    assert invoker.invoked[3:] == [
+        "es-disclosure-stage-1-method", "es-disclosure-stage-2-method",
+        "es-disclosure-stage-5-method", "es-disclosure-finaliser"]
+    assert [reply["next"] for reply in invoker.replies[:3]] == invoker.invoked[4:]
+    assert invoker.replies[-1] == {"success": True}
+
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        in_data = pd.DataFrame(json.loads(file_1.read()))
+    prepared_data, _ = disclosure_pipeline.run_stages(in_data, runtime_variables,
+                                                      "1 2 5")
+    with open("tests/fixtures/test_wrangler_output.json", "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+    assert_frame_equal(produced_data.sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False)
+
+    metrics = mock_sns.call_args[0][3]
+    assert metrics["execution_mode"] == "chained"
+    assert metrics["chain_seconds"] >= 0
+
+    progress = stage_chain.read_progress("test_bucket", "666", s3_client)
+    assert progress["stages"] == ["1", "2", "5"]
+    assert progress["completed"] == ["1", "2", "5"]
+    assert progress["status"] == "done"
+    # The payloads are removed, but the progress is kept.
+    keys = [s3_object["Key"] for s3_object in s3_client.list_objects_v2(
+        Bucket="test_bucket")["Contents"]]
+    assert not [key for key in keys if key.startswith("disclosure-payloads/")]
+    assert "disclosure-progress/666.json" in keys
+
+
+@mock_s3
+@mock.patch("disclosure_wrangler.send_summary_message")
+@mock.patch("disclosure_wrangler.aws_functions.save_to_s3")
+@mock.patch("disclosure_wrangler.aws_functions.save_dataframe_to_csv")
+def test_chained_run_stage_failure(mock_s3_csv, mock_s3_put, mock_sns):
+    failing_stage = stage_chain.chained(
+        lambda event, context: {"success": False, "error": "Stage 2 broke"})
+    invoker = local_invoker({"es-disclosure-stage-2-method": failing_stage})
+    output, s3_client = run_chain(invoker)
+
+    assert output["chained"]
+    # Stage 5 is never run; the finaliser reports the failure.
+    assert invoker.invoked[3:] == [
+        "es-disclosure-stage-1-method", "es-disclosure-stage-2-method",
+        "es-disclosure-finaliser"]
+    assert not invoker.replies[-1]["success"]
+    assert "Stage 2 broke" in invoker.replies[-1]["error"]
+    assert not mock_s3_put.called
+    assert not mock_sns.called
+
+    progress = stage_chain.read_progress("test_bucket", "666", s3_client)
+    assert progress["completed"] == ["1"]
+    assert progress["status"] == "failed"
+    assert "Stage 2 broke" in progress["error"]
+
+
+def test_chained_passes_through():
+    handler = stage_chain.chained(
+        lambda event, context: {"success": True, "data": "[]"})
+
+    with mock.patch("stage_chain.hand_off") as mock_hand_off:
+        assert handler({"RuntimeVariables": {"data": "[]"}}, None) == \
+            {"success": True, "data": "[]"}
+        assert handler({"warmup": True}, None)["success"]
+
+    assert not mock_hand_off.called
+
+
+@mock_s3
+def test_chained_run_needs_finaliser():
+    s3_client = test_generic_library.create_bucket(environment_variables["bucket_name"])
+    test_generic_library.upload_files(s3_client, environment_variables["bucket_name"],
+                                      ["test_wrangler_input.json"])
+    environment = {key: value for key, value in environment_variables.items()
+                   if key != "finaliser_name"}
+
+    with mock.patch.dict(disclosure_wrangler.os.environ, environment):
+        with local_invoker() as invoker:
+            with pytest.raises(exception_classes.LambdaFailure) as exc_info:
+                disclosure_wrangler.lambda_handler(
+                    {"RuntimeVariables": runtime_variables},
+                    test_generic_library.context_object)
+
+    assert "finaliser_name" in str(exc_info.value)
+    assert len(invoker.invoked) == 3
+    assert not boto3.client("s3", region_name="eu-west-2").list_objects_v2(
+        Bucket="test_bucket", Prefix=stage_chain.PROGRESS_PREFIX).get("Contents")
@@ -0,0 +1,181 @@
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import stage_registry
+
+runtime_variables = {
+    "bpm_queue_url": "fake_queue_url",
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "environment": "sandbox",
+    "explanation": "reason",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "stage5_threshold": "0.1",
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    "total_columns": ["Q608_total", "Q606_other_gravel"],
+    "unique_identifier": ["responder_id"]
+}
+
+
+@pytest.mark.parametrize(
+    "disclosure_stages,stage_targets,expected_plan",
+    [("5 1 2", None,
+      [("remote", ["1"]), ("remote", ["2"]), ("remote", ["5"])]),
+     ("1 2 5", {"1": "in_process", "2": "in_process"},
+      [("in_process", ["1", "2"]), ("remote", ["5"])]),
+     ("1 2 5", {"1": "in_process", "5": "in_process"},
+      [("in_process", ["1"]), ("remote", ["2"]), ("in_process", ["5"])]),
+     ("4 5 1", {"5": "in_process", "4": "in_process"},
+      [("remote", ["1"]), ("in_process", ["5", "4"])]),
+     ("", None, [])])
+def test_compile_plan(disclosure_stages, stage_targets, expected_plan):
+    plan = stage_registry.compile_plan(disclosure_stages, stage_targets)
+
+    assert [(step.target, step.stages) for step in plan] == expected_plan
+
+
+@pytest.mark.parametrize(
+    "disclosure_stages,expected_order",
+    [("1 2 5", ["1", "2", "5"]), ("4 1 2 5", ["1", "2", "5", "4"]),
+     ("5 3 1", ["1", "3", "5"])])
+def test_run_order(disclosure_stages, expected_order):
+    assert stage_registry.run_order(disclosure_stages) == expected_order
+
+
+@pytest.mark.parametrize(
+    "disclosure_stages,stage_targets,expected_message",
+    [("1 6", None, "Unknown disclosure stage 6"),
+     ("1", {"1": "elsewhere"}, "Unknown target elsewhere for stage 1")])
+def test_compile_plan_invalid(disclosure_stages, stage_targets, expected_message):
+    with pytest.raises(ValueError, match=expected_message):
+        stage_registry.compile_plan(disclosure_stages, stage_targets)
+
+
+def test_build_payload():
+    payload = stage_registry.build_payload("5", runtime_variables, "666", "[]")
+
+    assert payload == {"RuntimeVariables": {
+        "bpm_queue_url": "fake_queue_url",
+        "cell_total_column": "cell_total",
+        "data": "[]",
+        "disclosivity_marker": "disclosive",
+        "environment": "sandbox",
+        "explanation": "reason",
+        "publishable_indicator": "publish",
+        "run_id": "666",
+        "survey": "BMI_SG",
+        "threshold": "0.1",
+        "top1_column": "largest_contributor",
+        "top2_column": "second_largest_contributor",
+        "total_columns": ["Q608_total", "Q606_other_gravel"]
+    }}
+
+
+def test_build_payload_compressed():
+    payload = stage_registry.build_payload(
+        "1", {**runtime_variables, "compression_level": 9}, "666",
+        {"data": "eJyLjgUAARUAuQ==", "data_compression": "zlib"})
+
+    assert payload["RuntimeVariables"]["compression_level"] == 9
+    assert payload["RuntimeVariables"]["data"] == "eJyLjgUAARUAuQ=="
+    assert payload["RuntimeVariables"]["data_compression"] == "zlib"
+
+
+def test_in_process_arguments():
+    assert stage_registry.in_process_arguments("5", runtime_variables) == \
+        ["cell_total", "largest_contributor", "second_largest_contributor", "0.1", None,
+         None]
+    assert stage_registry.in_process_arguments(
+        "3", {**runtime_variables, "dominance_n": "2", "dominance_k": "85",
+              "grouping_columns": ["region"]}) == [2, 85.0, ["region"]]
+
+    with pytest.raises(ValueError,
+                       match="Stage 3 requires the runtime variable 'dominance_n'"):
+        stage_registry.in_process_arguments("3", runtime_variables)
+
+
+def test_lambda_name():
+    assert stage_registry.lambda_name("es-disclosure-stage--method", "2") == \
+        "es-disclosure-stage-2-method"
+
+
+def test_stage_columns():
+    assert stage_registry.stage_columns("2", runtime_variables) == \
+        ["ent_ref_count", "publish_Q608_total", "publish_Q606_other_gravel"]
+    assert stage_registry.stage_columns(
+        "4", dict(runtime_variables, grouping_columns=["region", "strata"])) == \
+        ["cell_total_Q608_total", "disclosive_Q608_total",
+         "cell_total_Q606_other_gravel", "disclosive_Q606_other_gravel", "region",
+         "strata"]
+    assert stage_registry.stage_columns("1", runtime_variables, "writes") == \
+        ["disclosive_Q608_total", "publish_Q608_total", "reason_Q608_total",
+         "disclosive_Q606_other_gravel", "publish_Q606_other_gravel",
+         "reason_Q606_other_gravel"]
+
+
+def stage_1_output():
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        input_data = pd.DataFrame(json.loads(file_1.read()))
+    return stage_registry.run_in_process(
+        input_data, {**runtime_variables, "total_columns": ["Q608_total"]}, ["1"],
+        logging.getLogger())
+
+
+def test_pending_rows():
+    single_column = {**runtime_variables, "total_columns": ["Q608_total"]}
+    data = stage_1_output()
+
+    assert stage_registry.pending_rows("1", data, single_column) is None
+    assert list(stage_registry.pending_rows("2", data, single_column)) == \
+        list(range(1, 10))
+    # Stage 3 is sent the whole of any cell with a row it can change.
+    decided = data.assign(publish_Q608_total=np.where(data["region"] == 9, "No",
+                                                      "Not Applicable"))
+    assert list(stage_registry.pending_rows(
+        "3", decided, {**single_column, "grouping_columns": ["region"]})) == \
+        [0, 1, 2, 3, 6]
+    # Stage 4 needs the whole table, and only when a row is disclosive.
+    disclosive = {**single_column, "grouping_columns": ["region", "strata"]}
+    assert stage_registry.pending_rows("4", data, disclosive) is None
+    assert len(stage_registry.pending_rows(
+        "4", data.assign(disclosive_Q608_total="No"), disclosive)) == 0
+    # Stage 5 works out missing top contributor columns from every row.
+    assert stage_registry.pending_rows(
+        "5", data.drop(columns="Q608_total_largest_contributor"),
+        single_column) is None
+
+
+def test_patch_rows_matches_full_run():
+    single_column = {**runtime_variables, "total_columns": ["Q608_total"]}
+    data = stage_1_output()
+    for stage in ["2", "5"]:
+        rows = stage_registry.pending_rows(stage, data, single_column)
+        output = stage_registry.run_in_process(
+            data.iloc[rows].reset_index(drop=True), single_column, [stage],
+            logging.getLogger())
+        patched = stage_registry.patch_rows(stage, data, rows, output, single_column)
+        data = stage_registry.run_in_process(data, single_column, [stage],
+                                             logging.getLogger())
+
+        assert_frame_equal(patched, data)
+
+
+def test_skip_stage():
+    single_column = {**runtime_variables, "total_columns": ["Q608_total"]}
+    data = stage_1_output()
+
+    skipped = stage_registry.skip_stage("5", data, single_column)
+
+    assert list(skipped.columns) == [column for column in data.columns
+                                     if column != "publish_Q608_total"]
+    with pytest.raises(ValueError, match="requires the runtime variable"):
+        stage_registry.skip_stage("3", data, single_column)
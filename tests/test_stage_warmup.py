@@ -0,0 +1,38 @@
+import io
+import json
+from unittest import mock
+
+import stage_warmup
+
+
+def replacement_invoke(FunctionName, Payload):
+    if FunctionName == "broken":
+        raise ValueError("Function not found")
+    reply = stage_warmup.handle_warmup(json.loads(Payload)) \
+        if FunctionName != "old" else {"success": False, "error": "KeyError"}
+    return {"Payload": io.BytesIO(json.dumps(reply).encode("UTF-8"))}
+
+
+def test_handle_warmup():
+    with mock.patch("stage_warmup._cold", True):
+        assert stage_warmup.handle_warmup({"warmup": True}) == \
+            {"success": True, "warmup": True, "cold": True}
+        assert stage_warmup.handle_warmup({"warmup": True}) == \
+            {"success": True, "warmup": True, "cold": False}
+        assert stage_warmup.handle_warmup({"RuntimeVariables": {}}) is None
+
+
+def test_warmup():
+    lambda_client = mock.Mock()
+    lambda_client.invoke.side_effect = replacement_invoke
+
+    with mock.patch("stage_warmup._cold", True):
+        warmup = stage_warmup.Warmup(lambda_client, ["first", "broken", "old"])
+        result = warmup.wait(warmup.started)
+        second = stage_warmup.Warmup(lambda_client, ["first"]).wait()
+
+    assert result["stages"] == {"first": "cold", "broken": "failed", "old": "failed"}
+    assert result["overlap_seconds"] == 0
+    assert result["seconds"] >= 0
+    assert second["stages"] == {"first": "warm"}
+    assert second["overlap_seconds"] == second["seconds"]
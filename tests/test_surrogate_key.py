@@ -0,0 +1,141 @@
+import json
+from unittest import mock
+
+import pandas as pd
+import pytest
+from es_aws_functions import test_generic_library
+from moto import mock_s3
+from pandas.testing import assert_frame_equal
+
+import columnar_json
+import disclosure_pipeline
+import disclosure_wrangler
+import payload_compression
+import s3_payload
+import stage_chain
+import stage_registry
+import surrogate_key
+
+environment_variables = {
+    "bucket_name": "test_bucket",
+    "finaliser_name": "es-disclosure-finaliser",
+    "method_name": "es-disclosure-stage--method"
+}
+
+runtime_variables = {
+    "bpm_queue_url": "fake_queue_url",
+    "cell_total_column": "cell_total",
+    "disclosivity_marker": "disclosive",
+    "disclosure_stages": "1 2 5",
+    "environment": "sandbox",
+    "explanation": "reason",
+    "final_output_location": "fixtures/",
+    "in_file_name": "test_wrangler_input",
+    "out_file_name": "test_wrangler_output.json",
+    "parent_column": "ent_ref_count",
+    "publishable_indicator": "publish",
+    "run_id": "666",
+    "sns_topic_arn": "fake_sns_arn",
+    "stage5_threshold": "0.1",
+    "surrogate_key": True,
+    "survey": "BMI_SG",
+    "threshold": "3",
+    "top1_column": "largest_contributor",
+    "top2_column": "second_largest_contributor",
+    # The wrangler input only has the aggregated columns for the first total column.
+    "total_columns": ["Q608_total"],
+    "total_steps": 6,
+    "unique_identifier": ["responder_id", "period", "county"]
+}
+
+
+def read_input():
+    with open("tests/fixtures/test_wrangler_input.json", "r") as file_1:
+        return pd.DataFrame(json.loads(file_1.read()))
+
+
+def test_encode_decode():
+    data = read_input()
+    data["county"] = data["county"].astype("category")
+    # The county is read by stage 5 to work out the largest contributors.
+    changes = {"grouping_columns": ["county"], "disclosure_stages": "1 5"}
+    data = data.drop(columns=["Q608_total_largest_contributor"])
+
+    keyed, identifiers, stage_variables = surrogate_key.encode(
+        data, changes["disclosure_stages"], dict(runtime_variables, **changes))
+
+    assert keyed.columns[data.columns.get_loc("period")] == surrogate_key.KEY
+    assert "responder_id" not in keyed and "period" not in keyed
+    assert "county" in keyed
+    assert keyed[surrogate_key.KEY].dtype == "int32"
+    assert keyed[surrogate_key.KEY].tolist() == list(range(len(data)))
+    assert list(identifiers.columns) == ["period", "responder_id"]
+    assert stage_variables["unique_identifier"] == [surrogate_key.KEY]
+
+    # The key finds each row's identifiers wherever the row ends up.
+    restored = surrogate_key.decode(keyed.iloc[::-1], identifiers)
+    assert_frame_equal(restored, data.iloc[::-1][restored.columns])
+    columns = list(data.columns)
+    columns.remove("responder_id")
+    columns.insert(columns.index("period") + 1, "responder_id")
+    assert list(restored.columns) == columns
+
+
+def test_encode_keeps_read_identifiers():
+    data = read_input()
+    variables = dict(runtime_variables, unique_identifier=["county"],
+                     grouping_columns=["county"])
+
+    keyed, identifiers, stage_variables = surrogate_key.encode(data, "1 2 5", variables)
+
+    assert keyed is data and identifiers is None and stage_variables is variables
+    with pytest.raises(ValueError):
+        surrogate_key.encode(data.assign(identifier_key=1), "1 2 5", runtime_variables)
+
+
+@mock_s3
+@pytest.mark.parametrize("execution_mode", ["inline", "chained"])
+@mock.patch("disclosure_wrangler.send_summary_message")
+@mock.patch("disclosure_wrangler.aws_functions.save_to_s3",
+            side_effect=test_generic_library.replacement_save_to_s3)
+@mock.patch("disclosure_wrangler.aws_functions.save_dataframe_to_csv")
+def test_wrangler_surrogate_key(mock_s3_csv, mock_s3_put, mock_sns, execution_mode):
+    s3_client = test_generic_library.create_bucket(environment_variables["bucket_name"])
+    test_generic_library.upload_files(s3_client, environment_variables["bucket_name"],
+                                      ["test_wrangler_input.json"])
+    sent_columns = []
+
+    def sent_to(handler):
+        def record(event, context):
+            payload = event["RuntimeVariables"]
+            sent_columns.append(list(columnar_json.decode_records(
+                payload_compression.unpack(s3_payload.fetch(payload))).columns))
+            return handler(event, context)
+        return record
+
+    handlers = {
+        stage_registry.lambda_name(environment_variables["method_name"], stage):
+            sent_to(spec.module.lambda_handler)
+        for stage, spec in stage_registry.STAGES.items()}
+    handlers[environment_variables["finaliser_name"]] = \
+        disclosure_wrangler.finalise_lambda_handler
+    invoker = stage_chain.LocalInvoker(handlers)
+    variables = dict(runtime_variables, execution_mode=execution_mode, warmup=False)
+
+    with mock.patch.dict(disclosure_wrangler.os.environ, environment_variables):
+        with invoker:
+            output = disclosure_wrangler.lambda_handler(
+                {"RuntimeVariables": variables}, test_generic_library.context_object)
+            invoker.run()
+
+    assert output["success"]
+    assert len(sent_columns) == 3
+    for columns in sent_columns:
+        assert surrogate_key.KEY in columns and "responder_id" not in columns
+
+    prepared_data, _ = disclosure_pipeline.run_stages(read_input(), runtime_variables,
+                                                      "1 2 5")
+    with open("tests/fixtures/test_wrangler_output.json", "r") as file_2:
+        produced_data = pd.DataFrame(json.loads(file_2.read()))
+    assert_frame_equal(produced_data.sort_index(axis=1),
+                       prepared_data.sort_index(axis=1), check_dtype=False)